@@ -1,8 +1,14 @@
 from get5 import app, limiter, db, BadRequestError
 from util import as_int
-from models import Match, MapStats, PlayerStats, GameServer, Veto, Team
-
-from flask import Blueprint, request
+from models import (Match, MapStats, PlayerStats, PlayerCareer, GameServer, Veto, Team,
+                    MetricCounter)
+import counters
+import events
+import matchauth
+import scoreboard
+
+from flask import Blueprint, request, abort
+from collections import OrderedDict
 import flask_limiter
 import threading
 
@@ -14,6 +20,15 @@ api_blueprint = Blueprint('api', __name__)
 
 _matchid_re = re.compile('/match/(\d*)/.*')
 
+# The PlayerStats fields a player's entry in a 'players' event can have,
+# only the ones that changed are sent.
+_PLAYER_EVENT_FIELDS = [
+    'name', 'team_id', 'kills', 'assists', 'deaths', 'flashbang_assists',
+    'teamkills', 'suicides', 'damage', 'headshot_kills', 'roundsplayed',
+    'bomb_plants', 'bomb_defuses', 'k1', 'k2', 'k3', 'k4', 'k5',
+    'v1', 'v2', 'v3', 'v4', 'v5', 'firstkill_t', 'firstkill_ct', 'firstdeath_t',
+]
+
 
 def rate_limit_key():
     try:
@@ -21,9 +36,9 @@ def rate_limit_key():
         matchid = int(match.group(1))
         if matchid:
             # If the key matches, rate limit by the api key
-            api_key = Match.query.get_or_404(matchid).api_key
-            if api_key == request.values.get('key'):
-                return api_key
+            context = matchauth.get(matchid)
+            if matchauth.check_key(context, request.values.get('key')):
+                return context.api_key
 
     except Exception:
         pass
@@ -32,24 +47,29 @@ def rate_limit_key():
     return flask_limiter.util.get_remote_address()
 
 
-def match_api_check(request, match):
-    if match.api_key != request.values.get('key'):
-        raise BadRequestError('Wrong API key')
-
-    if match.finalized():
+def match_api_check(request, matchid):
+    # Returns the match's matchauth.AuthContext, which is usually cached, so
+    # routes only load the match if they need more than that.
+    context = match_demo_api_check(request, matchid)
+    if context.finalized:
         raise BadRequestError('Match already finalized')
+    return context
 
 
-def match_demo_api_check(request, match):
-    if match.api_key != request.values.get('key'):
+def match_demo_api_check(request, matchid):
+    context = matchauth.get(matchid)
+    if context is None:
+        abort(404)
+    if not matchauth.check_key(context, request.values.get('key')):
         raise BadRequestError('Wrong API key')
+    return context
 
 
 @api_blueprint.route('/match/<int:matchid>/finish', methods=['POST'])
 @limiter.limit('60 per hour', key_func=rate_limit_key)
 def match_finish(matchid):
+    match_api_check(request, matchid)
     match = Match.query.get_or_404(matchid)
-    match_api_check(request, match)
 
     winner = request.values.get('winner')
     if winner == 'team1':
@@ -76,12 +96,20 @@ def match_finish(matchid):
         if match.start_time is None:
             match.start_time = datetime.datetime.utcnow()
 
+    if match.end_time is None:
+        MetricCounter.increment('matches_finished')
     match.end_time = datetime.datetime.utcnow()
     server = GameServer.query.get(match.server_id)
     if server:
         server.in_use = False
 
     db.session.commit()
+    events.publish(matchid, 'match_end', {
+        'winner': winner if winner in ('team1', 'team2') else None,
+        'forfeit': bool(match.forfeit),
+        'team1_score': match.team1_score,
+        'team2_score': match.team2_score,
+    })
     app.logger.info('Finished match {}, winner={}'.format(match, winner))
     return 'Success'
 
@@ -89,8 +117,8 @@ def match_finish(matchid):
 @api_blueprint.route('/match/<int:matchid>/map/<int:mapnumber>/start', methods=['POST'])
 @limiter.limit('60 per hour', key_func=rate_limit_key)
 def match_map_start(matchid, mapnumber):
+    match_api_check(request, matchid)
     match = Match.query.get_or_404(matchid)
-    match_api_check(request, match)
 
     if match.start_time is None:
         match.start_time = datetime.datetime.utcnow()
@@ -100,6 +128,8 @@ def match_map_start(matchid, mapnumber):
     # Create mapstats object if needed
     MapStats.get_or_create(matchid, mapnumber, map_name)
     db.session.commit()
+    scoreboard.invalidate(matchid)
+    events.publish(matchid, 'map_start', {'map': mapnumber, 'mapname': map_name})
 
     return 'Success'
 
@@ -107,10 +137,10 @@ def match_map_start(matchid, mapnumber):
 @api_blueprint.route('/match/<int:matchid>/map/<int:mapnumber>/update', methods=['POST'])
 @limiter.limit('1000 per hour', key_func=rate_limit_key)
 def match_map_update(matchid, mapnumber):
-    match = Match.query.get_or_404(matchid)
-    match_api_check(request, match)
+    match_api_check(request, matchid)
 
-    map_stats = match.map_stats.filter_by(map_number=mapnumber).first()
+    map_stats = MapStats.query.filter_by(
+        match_id=matchid, map_number=mapnumber).first()
     if map_stats:
         t1 = as_int(request.values.get('team1score'))
         t2 = as_int(request.values.get('team2score'))
@@ -118,6 +148,8 @@ def match_map_update(matchid, mapnumber):
             map_stats.team1_score = t1
             map_stats.team2_score = t2
             db.session.commit()
+            scoreboard.invalidate(matchid)
+            events.publish(matchid, 'score', {'map': mapnumber, 'team1': t1, 'team2': t2})
     else:
         return 'Failed to find map stats object', 400
 
@@ -127,17 +159,21 @@ def match_map_update(matchid, mapnumber):
 @api_blueprint.route('/match/<int:matchid>/vetoUpdate', methods=['POST'])
 @limiter.limit('60 per hour', key_func=rate_limit_key)
 def match_veto_update(matchid):
-    match = Match.query.get_or_404(matchid)
-    match_api_check(request, match)
+    context = match_api_check(request, matchid)
     if request.values.get('teamString') == "team1":
-        teamName = Team.query.get(match.team1_id).name
+        teamName = Team.query.get(context.team1_id).name
     elif request.values.get('teamString') == "team2":
-        teamName = Team.query.get(match.team2_id).name
+        teamName = Team.query.get(context.team2_id).name
     else:
         teamName = "Decider"
     veto = Veto.create(matchid, teamName,
                        request.values.get('map'), request.values.get('pick_or_veto'))
     db.session.commit()
+    events.publish(matchid, 'veto', {
+        'team': teamName,
+        'map': request.values.get('map'),
+        'pick_or_veto': request.values.get('pick_or_veto'),
+    })
     app.logger.info("Confirmed Map Veto For {} on map {}".format(
         teamName, request.values.get('map')))
     return 'Success'
@@ -147,9 +183,9 @@ def match_veto_update(matchid):
 @limiter.limit('60 per hour', key_func=rate_limit_key)
 def match_demo_name(matchid, mapnumber):
     # Upload demo name into database to reference later.
-    match = Match.query.get_or_404(matchid)
-    match_demo_api_check(request, match)
-    map_stats = match.map_stats.filter_by(map_number=mapnumber).first()
+    match_demo_api_check(request, matchid)
+    map_stats = MapStats.query.filter_by(
+        match_id=matchid, map_number=mapnumber).first()
     if map_stats:
         map_stats.demoFile = request.values.get('demoFile')
         db.session.commit()
@@ -162,11 +198,13 @@ def match_demo_name(matchid, mapnumber):
 @api_blueprint.route('/match/<int:matchid>/map/<int:mapnumber>/finish', methods=['POST'])
 @limiter.limit('60 per hour', key_func=rate_limit_key)
 def match_map_finish(matchid, mapnumber):
+    match_api_check(request, matchid)
     match = Match.query.get_or_404(matchid)
-    match_api_check(request, match)
 
     map_stats = match.map_stats.filter_by(map_number=mapnumber).first()
     if map_stats:
+        if map_stats.end_time is None:
+            MetricCounter.increment('maps_played')
         map_stats.end_time = datetime.datetime.utcnow()
 
         winner = request.values.get('winner')
@@ -179,71 +217,169 @@ def match_map_finish(matchid, mapnumber):
         else:
             map_stats.winner = None
 
+        # Resync the career totals of everyone on this map with their raw
+        # stats, in case any incremental updates raced each other.
+        PlayerCareer.rebuild(
+            [player.steam_id for player in map_stats.player_stats])
         db.session.commit()
+        events.publish(matchid, 'map_end', {
+            'map': mapnumber,
+            'winner': winner if winner in ('team1', 'team2') else None,
+            'team1_score': match.team1_score,
+            'team2_score': match.team2_score,
+        })
     else:
         return 'Failed to find map stats object', 404
 
     return 'Success'
 
 
+def update_player_stats(match, player_stats, values, old_values):
+    # values is either the request form of the per-player route, or one
+    # player's entry of the batched route. old_values are the player's career
+    # values from before this update ({} for a new row). Returns the player's
+    # entry for a 'players' event, or None if nothing changed.
+    before = [getattr(player_stats, field) for field in _PLAYER_EVENT_FIELDS]
+    player_stats.name = values.get('name')
+    team = values.get('team')
+    if team == 'team1':
+        player_stats.team_id = match.team1_id
+    elif team == 'team2':
+        player_stats.team_id = match.team2_id
+
+    player_stats.kills = as_int(values.get('kills'))
+    player_stats.assists = as_int(values.get('assists'))
+    player_stats.deaths = as_int(values.get('deaths'))
+    player_stats.flashbang_assists = as_int(
+        values.get('flashbang_assists'))
+    player_stats.teamkills = as_int(values.get('teamkills'))
+    player_stats.suicides = as_int(values.get('suicides'))
+    player_stats.damage = as_int(values.get('damage'))
+    player_stats.headshot_kills = as_int(
+        values.get('headshot_kills'))
+    player_stats.roundsplayed = as_int(
+        values.get('roundsplayed'))
+    player_stats.bomb_plants = as_int(
+        values.get('bomb_plants'))
+    player_stats.bomb_defuses = as_int(
+        values.get('bomb_defuses'))
+    player_stats.k1 = as_int(values.get('1kill_rounds'))
+    player_stats.k2 = as_int(values.get('2kill_rounds'))
+    player_stats.k3 = as_int(values.get('3kill_rounds'))
+    player_stats.k4 = as_int(values.get('4kill_rounds'))
+    player_stats.k5 = as_int(values.get('5kill_rounds'))
+    player_stats.v1 = as_int(values.get('v1'))
+    player_stats.v2 = as_int(values.get('v2'))
+    player_stats.v3 = as_int(values.get('v3'))
+    player_stats.v4 = as_int(values.get('v4'))
+    player_stats.v5 = as_int(values.get('v5'))
+    player_stats.firstkill_t = as_int(
+        values.get('firstkill_t'))
+    player_stats.firstkill_ct = as_int(
+        values.get('firstkill_ct'))
+    player_stats.firstdeath_t = as_int(
+        values.get('firstdeath_t'))
+    player_stats.firstdeath_ct = as_int(
+        values.get('firstdeath_ct'))
+
+    # Cancelled matches don't count towards season totals.
+    season_id = None if match.cancelled else match.season_id
+    PlayerCareer.update_player(
+        player_stats.steam_id, season_id, old_values, player_stats.get_career_values())
+
+    delta = dict((field, getattr(player_stats, field))
+                 for field, old in zip(_PLAYER_EVENT_FIELDS, before)
+                 if getattr(player_stats, field) != old)
+    if delta:
+        delta['steamid'] = player_stats.steam_id
+        return delta
+    return None
+
+
 @api_blueprint.route(
     '/match/<int:matchid>/map/<int:mapnumber>/player/<steamid64>/update',
     methods=['POST'])
 @limiter.limit('100 per minute', key_func=rate_limit_key)
 def match_map_update_player(matchid, mapnumber, steamid64):
-    match = Match.query.get_or_404(matchid)
-    api_key = request.values.get('key')
-    if match.api_key != api_key:
+    context = matchauth.get(matchid)
+    if context is None:
+        abort(404)
+    if not matchauth.check_key(context, request.values.get('key')):
         return 'Wrong API key', 400
 
-    map_stats = match.map_stats.filter_by(map_number=mapnumber).first()
+    map_stats = MapStats.query.filter_by(
+        match_id=matchid, map_number=mapnumber).first()
     if map_stats:
-        player_stats = PlayerStats.get_or_create(matchid, mapnumber, steamid64)
+        match = Match.query.get(matchid)
+        player_stats, created = PlayerStats.get_or_create(
+            matchid, mapnumber, steamid64, map_stats)
         if player_stats:
-            player_stats.name = request.values.get('name')
-            team = request.values.get('team')
-            if team == 'team1':
-                player_stats.team_id = match.team1_id
-            elif team == 'team2':
-                player_stats.team_id = match.team2_id
-
-            player_stats.kills = as_int(request.values.get('kills'))
-            player_stats.assists = as_int(request.values.get('assists'))
-            player_stats.deaths = as_int(request.values.get('deaths'))
-            player_stats.flashbang_assists = as_int(
-                request.values.get('flashbang_assists'))
-            player_stats.teamkills = as_int(request.values.get('teamkills'))
-            player_stats.suicides = as_int(request.values.get('suicides'))
-            player_stats.damage = as_int(request.values.get('damage'))
-            player_stats.headshot_kills = as_int(
-                request.values.get('headshot_kills'))
-            player_stats.roundsplayed = as_int(
-                request.values.get('roundsplayed'))
-            player_stats.bomb_plants = as_int(
-                request.values.get('bomb_plants'))
-            player_stats.bomb_defuses = as_int(
-                request.values.get('bomb_defuses'))
-            player_stats.k1 = as_int(request.values.get('1kill_rounds'))
-            player_stats.k2 = as_int(request.values.get('2kill_rounds'))
-            player_stats.k3 = as_int(request.values.get('3kill_rounds'))
-            player_stats.k4 = as_int(request.values.get('4kill_rounds'))
-            player_stats.k5 = as_int(request.values.get('5kill_rounds'))
-            player_stats.v1 = as_int(request.values.get('v1'))
-            player_stats.v2 = as_int(request.values.get('v2'))
-            player_stats.v3 = as_int(request.values.get('v3'))
-            player_stats.v4 = as_int(request.values.get('v4'))
-            player_stats.v5 = as_int(request.values.get('v5'))
-            player_stats.firstkill_t = as_int(
-                request.values.get('firstkill_t'))
-            player_stats.firstkill_ct = as_int(
-                request.values.get('firstkill_ct'))
-            player_stats.firstdeath_t = as_int(
-                request.values.get('firstdeath_t'))
-            player_stats.firstdeath_ct = as_int(
-                request.values.get('firstdeath_ct'))
-
+            old_values = {}
+            if not created:
+                old_values = player_stats.get_career_values()
+            delta = update_player_stats(match, player_stats, request.values, old_values)
             db.session.commit()
+            counters.inc('player_stat_upserts')
+            scoreboard.invalidate(matchid)
+            if delta:
+                events.publish(matchid, 'players', {'map': mapnumber, 'players': [delta]})
     else:
         return 'Failed to find map stats object', 404
 
     return 'Success'
+
+
+# Takes every player's stats for a map in one request, as a JSON list of
+# objects with a 'steamid' and the same fields the per-player route accepts.
+# The list can also be sent as {"key": ..., "players": [...]}.
+@api_blueprint.route(
+    '/match/<int:matchid>/map/<int:mapnumber>/players/update',
+    methods=['POST'])
+@limiter.limit('100 per minute', key_func=rate_limit_key)
+def match_map_update_players(matchid, mapnumber):
+    data = request.get_json(force=True, silent=True)
+    api_key = request.values.get('key')
+    if isinstance(data, dict):
+        api_key = data.get('key', api_key)
+        data = data.get('players')
+    if not isinstance(data, list) or not all(isinstance(p, dict) for p in data):
+        return 'Expected a JSON list of players', 400
+
+    context = matchauth.get(matchid)
+    if context is None:
+        abort(404)
+    if not matchauth.check_key(context, api_key):
+        return 'Wrong API key', 400
+
+    map_stats = MapStats.query.filter_by(
+        match_id=matchid, map_number=mapnumber).first()
+    if not map_stats:
+        return 'Failed to find map stats object', 404
+    match = Match.query.get(matchid)
+
+    # A player listed twice is only updated once, with their last entry, so
+    # their career isn't changed twice by the same stats.
+    entries = OrderedDict()
+    for values in data:
+        entries[str(values.get('steamid', ''))] = values
+
+    players, created = PlayerStats.get_or_create_many(map_stats, entries.keys())
+    old_values = dict((steam_id, player_stats.get_career_values())
+                      for steam_id, player_stats in players.items()
+                      if steam_id not in created)
+    updated = 0
+    deltas = []
+    for steam_id, values in entries.items():
+        if steam_id in players:
+            delta = update_player_stats(match, players[steam_id], values,
+                                        old_values.get(steam_id, {}))
+            if delta:
+                deltas.append(delta)
+            updated += 1
+    db.session.commit()
+    counters.inc('player_stat_upserts', updated)
+    scoreboard.invalidate(matchid)
+    if deltas:
+        events.publish(matchid, 'players', {'map': mapnumber, 'players': deltas})
+
+    return 'Success'
@@ -1,7 +1,12 @@
 import unittest
+import json
+
+import sqlalchemy
 
 import get5_test
-from models import Match, MapStats, PlayerStats, GameServer
+import matchauth
+from get5 import db
+from models import Match, MapStats, PlayerStats, PlayerCareer, PlayerSeasonCareer, GameServer
 
 
 class ApiTests(get5_test.Get5Test):
@@ -116,6 +121,228 @@ class ApiTests(get5_test.Get5Test):
         self.assertEqual(self.app.get('/matches').status_code, 200)
         self.assertEqual(self.app.get('/matches/1').status_code, 200)
 
+    def test_player_careers(self):
+        match = Match.query.get(1)
+        matchkey = match.api_key
+        steam_id = '76561198053858673'
+        self.app.post('/match/1/map/0/start',
+                      data={'mapname': 'de_dust2', 'key': matchkey})
+
+        def update_player(**values):
+            values['key'] = matchkey
+            values['team'] = 'team1'
+            response = self.app.post(
+                '/match/1/map/0/player/{}/update'.format(steam_id), data=values)
+            self.assertEqual(response.status_code, 200)
+
+        update_player(roundsplayed='5', kills='5', deaths='3', damage='500')
+        update_player(roundsplayed='10', kills='8', deaths='4', damage='900',
+                      headshot_kills='4')
+
+        career = PlayerCareer.query.get(steam_id)
+        self.assertEqual(career.maps_played, 1)
+        self.assertEqual(career.kills, 8)
+        self.assertEqual(career.deaths, 4)
+        self.assertEqual(career.roundsplayed, 10)
+        self.assertAlmostEqual(career.get_adr(), 90.0)
+        self.assertAlmostEqual(career.get_kdr(), 2.0)
+        self.assertAlmostEqual(career.get_hsp(), 0.5)
+        season_career = PlayerSeasonCareer.query.get((1, steam_id))
+        self.assertEqual(season_career.kills, 8)
+
+        # A rebuild from the raw stats must agree with the running totals.
+        expected = dict((key, getattr(career, key))
+                        for key in PlayerCareer.get_value_names())
+        PlayerCareer.rebuild()
+        db.session.commit()
+        career = PlayerCareer.query.get(steam_id)
+        for key, value in expected.items():
+            self.assertAlmostEqual(getattr(career, key), value)
+
+        # Cancelling the match removes it from the season totals only.
+        with self.app as c:
+            with c.session_transaction() as sess:
+                sess['user_id'] = 1
+            self.assertEqual(c.get('/match/1/cancel').status_code, 302)
+        self.assertIsNone(PlayerSeasonCareer.query.get((1, steam_id)))
+        self.assertEqual(PlayerCareer.query.get(steam_id).kills, 8)
+
+    def test_concurrent_first_career_update(self):
+        matchkey = Match.query.get(1).api_key
+        self.app.post('/match/1/map/0/start',
+                      data={'mapname': 'de_dust2', 'key': matchkey})
+        steam_id = '76561198053858673'
+        inserted = []
+
+        # An update from another match creates the career just before this one.
+        def before_cursor_execute(conn, cursor, statement, *args):
+            if statement.startswith('INSERT INTO player_career') and not inserted:
+                inserted.append(True)
+                row = dict((key, 0) for key in PlayerCareer.get_value_names())
+                row.update(steam_id=steam_id, maps_played=1, kills=3)
+                conn.execute(PlayerCareer.__table__.insert().values(**row))
+
+        sqlalchemy.event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = self.app.post(
+                '/match/1/map/0/player/{}/update'.format(steam_id),
+                data={'key': matchkey, 'kills': '4'})
+        finally:
+            sqlalchemy.event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(inserted)
+        career = PlayerCareer.query.get(steam_id)
+        self.assertEqual(career.maps_played, 2)
+        self.assertEqual(career.kills, 7)
+
+    def test_batched_player_update(self):
+        matchkey = Match.query.get(1).api_key
+        self.app.post('/match/1/map/0/start',
+                      data={'mapname': 'de_dust2', 'key': matchkey})
+        url = '/match/1/map/0/players/update'
+
+        players = [
+            {'steamid': '76561198053858673', 'name': 'player1', 'team': 'team1',
+             'kills': 5, 'deaths': 3, 'roundsplayed': 10, 'damage': 800,
+             '3kill_rounds': 1},
+            {'steamid': '76561198064755913', 'name': 'player2', 'team': 'team2',
+             'kills': '2', 'deaths': '6', 'roundsplayed': '10'},
+        ]
+        response = self.app.post(url + '?key=' + matchkey, data=json.dumps(players),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        player1 = PlayerStats.query.filter_by(steam_id='76561198053858673').one()
+        self.assertEqual(player1.kills, 5)
+        self.assertEqual(player1.k3, 1)
+        self.assertEqual(player1.team_id, 1)
+        player2 = PlayerStats.query.filter_by(steam_id='76561198064755913').one()
+        self.assertEqual(player2.deaths, 6)
+        self.assertEqual(player2.team_id, 2)
+        self.assertEqual(PlayerCareer.query.get('76561198064755913').maps_played, 1)
+
+        # Updating again changes the same rows, the key can go in the body too.
+        players[0]['kills'] = 7
+        response = self.app.post(url, data=json.dumps({'key': matchkey, 'players': players}),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PlayerStats.query.count(), 2)
+        self.assertEqual(PlayerStats.query.filter_by(
+            steam_id='76561198053858673').one().kills, 7)
+        career = PlayerCareer.query.get('76561198053858673')
+        self.assertEqual(career.maps_played, 1)
+        self.assertEqual(career.kills, 7)
+
+        response = self.app.post(url + '?key=wrongkey', data=json.dumps(players),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.app.post(url + '?key=' + matchkey, data='not json',
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.app.post('/match/1/map/1/players/update?key=' + matchkey,
+                                 data=json.dumps(players),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_batched_player_update_duplicates(self):
+        matchkey = Match.query.get(1).api_key
+        self.app.post('/match/1/map/0/start',
+                      data={'mapname': 'de_dust2', 'key': matchkey})
+        url = '/match/1/map/0/players/update?key=' + matchkey
+        self.app.post(url, data=json.dumps([
+            {'steamid': '76561198053858673', 'kills': 2, 'roundsplayed': 3}]),
+            content_type='application/json')
+
+        # The last entry for a player is the one used, and only once.
+        response = self.app.post(url, data=json.dumps([
+            {'steamid': '76561198053858673', 'kills': 4, 'roundsplayed': 5},
+            {'steamid': '76561198053858673', 'kills': 5, 'roundsplayed': 6},
+        ]), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PlayerStats.query.filter_by(
+            steam_id='76561198053858673').one().kills, 5)
+        career = PlayerCareer.query.get('76561198053858673')
+        self.assertEqual(career.kills, 5)
+        self.assertEqual(career.maps_played, 1)
+
+    def test_concurrent_first_update(self):
+        matchkey = Match.query.get(1).api_key
+        self.app.post('/match/1/map/0/start',
+                      data={'mapname': 'de_dust2', 'key': matchkey})
+        map_id = MapStats.query.filter_by(match_id=1, map_number=0).one().id
+        steam_id = '76561198053858673'
+        inserted = []
+
+        # Another update for the player creates the row just before this one.
+        def before_cursor_execute(conn, cursor, statement, *args):
+            if statement.startswith('INSERT INTO player_stats') and not inserted:
+                inserted.append(True)
+                conn.execute(PlayerStats.__table__.insert().values(
+                    match_id=1, map_id=map_id, steam_id=steam_id))
+                conn.execute(MapStats.__table__.update().where(
+                    MapStats.id == map_id).values(player_count=MapStats.player_count + 1))
+
+        sqlalchemy.event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = self.app.post(
+                '/match/1/map/0/player/{}/update'.format(steam_id),
+                data={'key': matchkey, 'kills': '4'})
+        finally:
+            sqlalchemy.event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(inserted)
+        self.assertEqual(PlayerStats.query.filter_by(steam_id=steam_id).one().kills, 4)
+        self.assertEqual(MapStats.query.get(map_id).player_count, 1)
+
+    def test_player_cap(self):
+        matchkey = Match.query.get(1).api_key
+        self.app.post('/match/1/map/0/start',
+                      data={'mapname': 'de_dust2', 'key': matchkey})
+
+        kills = []
+
+        def count_update_queries():
+            statements = []
+
+            def before_cursor_execute(conn, cursor, statement, *args):
+                statements.append(statement)
+
+            sqlalchemy.event.listen(
+                db.engine, 'before_cursor_execute', before_cursor_execute)
+            try:
+                response = self.app.post(
+                    '/match/1/map/0/player/76561198000000000/update',
+                    data={'key': matchkey, 'kills': str(len(kills))})
+                kills.append(1)
+                self.assertEqual(response.status_code, 200)
+            finally:
+                sqlalchemy.event.remove(
+                    db.engine, 'before_cursor_execute', before_cursor_execute)
+            return len(statements)
+
+        def add_players(first, count):
+            players = [{'steamid': str(76561198000000000 + i), 'kills': 1}
+                       for i in range(first, first + count)]
+            response = self.app.post('/match/1/map/0/players/update?key=' + matchkey,
+                                     data=json.dumps(players),
+                                     content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+
+        add_players(0, 2)
+        few_players = count_update_queries()
+        add_players(2, 30)
+        self.assertEqual(count_update_queries(), few_players)
+
+        # Only 40 players fit on a map.
+        add_players(32, 10)
+        map_stats = MapStats.query.filter_by(match_id=1, map_number=0).one()
+        self.assertEqual(map_stats.player_count, 40)
+        self.assertEqual(map_stats.player_stats.count(), 40)
+        self.app.post('/match/1/map/0/player/76561198000000099/update',
+                      data={'key': matchkey, 'kills': '3'})
+        self.assertIsNone(PlayerStats.query.filter_by(
+            steam_id='76561198000000099').first())
+
     def test_match_stats_wrong_api_key(self):
         self.assertEqual(self.app.get('/match/1').status_code, 200)
         self.assertEqual(self.app.get('/matches').status_code, 200)
@@ -140,6 +367,72 @@ class ApiTests(get5_test.Get5Test):
         self.assertEqual(response.status_code, 400)
         self.assertIn('Wrong API key', response.data)
 
+    def count_match_queries(self, url, data):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        sqlalchemy.event.listen(
+            db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = self.app.post(url, data=data)
+        finally:
+            sqlalchemy.event.remove(
+                db.engine, 'before_cursor_execute', before_cursor_execute)
+        self.assertEqual(response.status_code, 200)
+        return len([s for s in statements if 'FROM "match"' in s or 'FROM match' in s])
+
+    def test_auth_context_is_cached(self):
+        matchkey = Match.query.get(1).api_key
+        self.app.post('/match/1/map/0/start', data={'mapname': 'de_dust2', 'key': matchkey})
+
+        # The rate limiter and the route share one cached lookup.
+        data = {'team1score': '1', 'team2score': '0', 'key': matchkey}
+        self.assertEqual(self.count_match_queries('/match/1/map/0/update', data), 0)
+        data = {'key': matchkey, 'team': 'team1', 'kills': '1'}
+        self.assertEqual(self.count_match_queries(
+            '/match/1/map/0/player/76561198053858673/update', data), 1)
+
+        context = matchauth.get(1)
+        self.assertEqual((context.team1_id, context.team2_id), (1, 2))
+        self.assertFalse(context.finalized)
+        self.assertTrue(matchauth.check_key(context, unicode(matchkey)))
+        self.assertFalse(matchauth.check_key(context, matchkey[:-1]))
+        self.assertFalse(matchauth.check_key(context, u'\xe9' * 24))
+        self.assertFalse(matchauth.check_key(context, None))
+        self.assertIsNone(matchauth.get(100))
+
+    def test_auth_context_invalidated_on_commit(self):
+        matchauth.clear()
+        context = matchauth.get(1)
+        Match.query.get(1).cancelled = True
+        db.session.flush()
+        # Other requests can't see the change yet.
+        self.assertIs(matchauth.get(1), context)
+        db.session.rollback()
+        self.assertIs(matchauth.get(1), context)
+
+        Match.query.get(1).cancelled = True
+        db.session.commit()
+        self.assertTrue(matchauth.get(1).finalized)
+
+    def test_finalized_match_rejects_updates(self):
+        matchkey = Match.query.get(1).api_key
+        self.app.post('/match/1/map/0/start', data={'mapname': 'de_dust2', 'key': matchkey})
+        data = {'team1score': '1', 'team2score': '0', 'key': matchkey}
+        self.assertEqual(self.app.post('/match/1/map/0/update', data=data).status_code, 200)
+
+        with self.app as c:
+            with c.session_transaction() as sess:
+                sess['user_id'] = 1
+            self.assertEqual(c.get('/match/1/cancel').status_code, 302)
+
+        response = self.app.post('/match/1/map/0/update', data=data)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Match already finalized', response.data)
+        self.assertEqual(self.app.post('/match/100/map/0/update', data=data).status_code, 404)
+
     def test_rate_limiting(self):
         match = Match.query.get(1)
         data = {
@@ -0,0 +1,83 @@
+#!/usr/bin/env python2.7
+
+# Compares the tiered cache behind get5.cache with the filesystem cache it
+# replaced: reads of values another process wrote (cold), reads of values
+# this process has read before (warm), cold reads each made from a new
+# thread, like the requests on a server that starts a thread for each one
+# (thread), writes, and how many files each leaves behind. This never
+# touches the configured cache, run it from the repo root with:
+#
+#   python2.7 -m get5.cache_bench [--keys 5000]
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from werkzeug.contrib.cache import FileSystemCache
+
+import counters
+import tieredcache
+
+# Something like a cached server's connect info.
+VALUE = {'online': True, 'password': 'secret', 'gotv_port': 27020,
+         'fetched_at': 1500000000.0}
+
+
+def time_each(fn, keys):
+    # Microseconds per call.
+    start = time.time()
+    for key in keys:
+        fn(key)
+    return (time.time() - start) / len(keys) * 1e6
+
+
+def in_new_thread(fn):
+    def run(key):
+        thread = threading.Thread(target=fn, args=(key,))
+        thread.start()
+        thread.join()
+    return run
+
+
+def count_files(directory):
+    return sum(len(files) for _, _, files in os.walk(directory))
+
+
+def bench(name, open_cache, keys):
+    directory = tempfile.mkdtemp()
+    try:
+        writer = open_cache(directory)
+        set_us = time_each(lambda key: writer.set(key, VALUE, timeout=3600), keys)
+        # A fresh instance has nothing in memory, like another process.
+        reader = open_cache(directory)
+        cold_us = time_each(reader.get, keys)
+        warm_us = time_each(reader.get, keys)
+        thread_us = time_each(in_new_thread(open_cache(directory).get), keys[:1000])
+        print('{:>12} {:>10.1f} {:>10.1f} {:>10.1f} {:>12.1f} {:>8}'.format(
+            name, set_us, cold_us, warm_us, thread_us, count_files(directory)))
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the cache backends.')
+    parser.add_argument('--keys', type=int, default=5000,
+                        help='number of values written and read')
+    args = parser.parse_args()
+
+    keys = ['server_connect_info/{}/10.0.0.1:27015'.format(i) for i in range(args.keys)]
+    print('{:>12} {:>10} {:>10} {:>10} {:>12} {:>8}'.format(
+        'cache', 'set (us)', 'cold (us)', 'warm (us)', 'thread (us)', 'files'))
+    bench('filesystem', lambda directory: FileSystemCache(
+        directory, threshold=25000), keys)
+    bench('tiered', lambda directory: tieredcache.TieredCache(
+        tieredcache.SQLiteCache(os.path.join(directory, 'cache.db'), threshold=25000),
+        max_entries=args.keys, local_ttls={'server_connect_info': 60}), keys)
+    counters.reset()
+
+
+if __name__ == '__main__':
+    main()
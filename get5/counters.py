@@ -0,0 +1,154 @@
+# Counters for the /metrics pages.
+#
+# There are two kinds. Totals (TOTALS) are kept in the metric_counter table
+# by MetricCounter.increment, in the same transaction as the write they
+# count, so they survive restarts and are the same for every worker.
+# Everything else (COUNTERS, the cache events and the request latency
+# histogram) is counted in memory by each process, which is how Prometheus
+# expects counters to behave: they start again from zero when a worker
+# restarts.
+
+from collections import OrderedDict
+import bisect
+import threading
+
+TOTALS = OrderedDict([
+    ('users_registered', 'Registered users'),
+    ('teams_created', 'Saved teams'),
+    ('matches_created', 'Matches created'),
+    ('matches_finished', 'Completed matches'),
+    ('servers_added', 'Servers added'),
+    ('maps_played', 'Maps played'),
+    ('unique_players', 'Unique players'),
+])
+
+COUNTERS = OrderedDict([
+    ('player_stat_upserts', 'Player stats rows created or updated by the game servers'),
+    ('rcon_commands', 'RCON commands sent'),
+    ('rcon_connections', 'RCON connections opened'),
+    ('rcon_failures', 'RCON commands that failed'),
+    ('steam_api_calls', 'Requests made to the Steam API'),
+    ('steam_api_failures', 'Requests to the Steam API that failed'),
+    ('steam_profile_hits', 'Steam names served from a stored profile'),
+    ('steam_profile_stale_hits', 'Steam names served from a stored profile past its TTL'),
+    ('steam_profile_misses', 'Steam names with no stored profile'),
+    ('steam_profiles_refreshed', 'Stored Steam profiles refreshed in the background'),
+    ('rate_limit_rejections', 'Requests rejected by the API rate limits'),
+])
+
+# What tieredcache counts for each key namespace.
+CACHE_EVENTS = OrderedDict([
+    ('local_hit', 'Cache lookups answered from the web server process\'s own memory'),
+    ('shared_hit', 'Cache lookups answered from the cache shared between processes'),
+    ('miss', 'Cache lookups that found nothing'),
+    ('eviction', 'Values dropped from a process\'s memory to make room for others'),
+])
+
+# Upper bounds, in seconds, of the request latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_counters = dict((name, 0) for name in COUNTERS)
+# endpoint -> [bucket counts (the last one is +Inf), sum of seconds, count]
+_latencies = {}
+# namespace -> CACHE_EVENTS name -> count
+_cache_events = {}
+
+
+def inc(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+def inc_cache(namespace, event):
+    with _lock:
+        if namespace not in _cache_events:
+            _cache_events[namespace] = dict((name, 0) for name in CACHE_EVENTS)
+        _cache_events[namespace][event] += 1
+
+
+def get_cache_events():
+    with _lock:
+        return dict((namespace, dict(events)) for namespace, events in _cache_events.items())
+
+
+def observe_request(endpoint, seconds):
+    index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+    with _lock:
+        if endpoint not in _latencies:
+            _latencies[endpoint] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+        histogram = _latencies[endpoint]
+        histogram[0][index] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+
+def get_counters():
+    with _lock:
+        return dict(_counters)
+
+
+def reset():
+    with _lock:
+        for name in _counters:
+            _counters[name] = 0
+        _latencies.clear()
+        _cache_events.clear()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_bound(bound):
+    return '{:g}'.format(bound)
+
+
+def render_prometheus(totals):
+    # Renders totals (a dict of TOTALS name -> value) and this process's own
+    # counters in the Prometheus text exposition format.
+    lines = []
+
+    def add_counter(name, description, value):
+        metric = 'get5_{}_total'.format(name)
+        lines.append('# HELP {} {}'.format(metric, description))
+        lines.append('# TYPE {} counter'.format(metric))
+        lines.append('{} {}'.format(metric, value))
+
+    with _lock:
+        counters = dict(_counters)
+        latencies = dict((endpoint, (list(h[0]), h[1], h[2]))
+                         for endpoint, h in _latencies.items())
+        cache_events = dict((namespace, dict(events))
+                            for namespace, events in _cache_events.items())
+
+    for name, description in TOTALS.items():
+        add_counter(name, description, totals.get(name, 0))
+    for name, description in COUNTERS.items():
+        add_counter(name, description, counters[name])
+
+    for event, description in CACHE_EVENTS.items():
+        metric = 'get5_cache_{}_total'.format(event)
+        lines.append('# HELP {} {}'.format(metric, description))
+        lines.append('# TYPE {} counter'.format(metric))
+        for namespace in sorted(cache_events):
+            lines.append('{}{{namespace="{}"}} {}'.format(
+                metric, _escape(namespace), cache_events[namespace][event]))
+
+    metric = 'get5_request_duration_seconds'
+    lines.append('# HELP {} Time taken to handle a request'.format(metric))
+    lines.append('# TYPE {} histogram'.format(metric))
+    for endpoint in sorted(latencies):
+        buckets, total, count = latencies[endpoint]
+        label = 'endpoint="{}"'.format(_escape(endpoint))
+        cumulative = 0
+        for bound, bucket in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+            cumulative += bucket
+            if bound != '+Inf':
+                bound = _format_bound(bound)
+            lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                metric, label, bound, cumulative))
+        lines.append('{}_sum{{{}}} {:.6f}'.format(metric, label, total))
+        lines.append('{}_count{{{}}} {}'.format(metric, label, count))
+
+    return '\n'.join(lines) + '\n'
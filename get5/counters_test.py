@@ -0,0 +1,104 @@
+import unittest
+
+import counters
+import get5_test
+import util
+from get5 import db
+from models import Match, MetricCounter, PlayerCareer
+
+
+class CountersTests(get5_test.Get5Test):
+
+    def setUp(self):
+        super(CountersTests, self).setUp()
+        counters.reset()
+
+    def tearDown(self):
+        counters.reset()
+        super(CountersTests, self).tearDown()
+
+    def finish_map_and_match(self, key):
+        self.app.post('/match/1/map/0/start', data={'mapname': 'de_dust2', 'key': key})
+        self.app.post('/match/1/map/0/player/76561198064755904/update',
+                      data={'key': key, 'kills': 3, 'deaths': 1, 'roundsplayed': 5})
+        self.app.post('/match/1/map/0/finish', data={'winner': 'team1', 'key': key})
+        self.app.post('/match/1/finish', data={'winner': 'team1', 'key': key})
+
+    def test_totals(self):
+        # From create_test_data.
+        totals = MetricCounter.get_all()
+        self.assertEqual(totals['users_registered'], 2)
+        self.assertEqual(totals['teams_created'], 2)
+        self.assertEqual(totals['servers_added'], 2)
+        self.assertEqual(totals['matches_created'], 1)
+        self.assertNotIn('matches_finished', totals)
+
+        key = Match.query.get(1).api_key
+        self.finish_map_and_match(key)
+        # Finishing again doesn't count twice.
+        self.finish_map_and_match(key)
+
+        totals = MetricCounter.get_all()
+        self.assertEqual(totals['maps_played'], 1)
+        self.assertEqual(totals['matches_finished'], 1)
+        self.assertEqual(totals['unique_players'], 1)
+        self.assertEqual(counters.get_counters()['player_stat_upserts'], 2)
+
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Completed matches: 1', response.data)
+
+    def test_unique_players_after_rebuild(self):
+        key = Match.query.get(1).api_key
+        self.finish_map_and_match(key)
+        self.assertEqual(MetricCounter.get_all()['unique_players'], 1)
+
+        # As after upgrading, before the careers are rebuilt.
+        PlayerCareer.query.delete()
+        MetricCounter.set('unique_players', 0)
+        db.session.commit()
+        PlayerCareer.rebuild()
+        db.session.commit()
+        self.assertEqual(MetricCounter.get_all()['unique_players'], 1)
+
+    def test_prometheus(self):
+        self.app.get('/matches')
+        self.app.get('/matches')
+        response = self.app.get('/metrics/prometheus')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+
+        lines = response.data.splitlines()
+        self.assertIn('# TYPE get5_matches_created_total counter', lines)
+        self.assertIn('get5_matches_created_total 1', lines)
+        self.assertIn('get5_rcon_commands_total 0', lines)
+        self.assertIn('# TYPE get5_request_duration_seconds histogram', lines)
+        self.assertIn(
+            'get5_request_duration_seconds_bucket{endpoint="match.matches",le="+Inf"} 2',
+            lines)
+        self.assertIn('get5_request_duration_seconds_count{endpoint="match.matches"} 2',
+                      lines)
+
+    def test_rcon_failures(self):
+        response = util.send_rcon_command('127.0.0.1', 1, 'password', 'status',
+                                          num_retries=1, timeout=0.5)
+        self.assertIsNone(response)
+        values = counters.get_counters()
+        self.assertEqual(values['rcon_commands'], 1)
+        self.assertEqual(values['rcon_failures'], 1)
+
+    def test_histogram_buckets(self):
+        counters.observe_request('a', 0.01)
+        counters.observe_request('a', 0.3)
+        counters.observe_request('a', 60)
+        lines = counters.render_prometheus({}).splitlines()
+        self.assertIn('get5_request_duration_seconds_bucket{endpoint="a",le="0.005"} 0', lines)
+        self.assertIn('get5_request_duration_seconds_bucket{endpoint="a",le="0.01"} 1', lines)
+        self.assertIn('get5_request_duration_seconds_bucket{endpoint="a",le="0.5"} 2', lines)
+        self.assertIn('get5_request_duration_seconds_bucket{endpoint="a",le="10"} 2', lines)
+        self.assertIn('get5_request_duration_seconds_bucket{endpoint="a",le="+Inf"} 3', lines)
+        self.assertIn('get5_request_duration_seconds_sum{endpoint="a"} 60.310000', lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
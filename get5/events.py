@@ -0,0 +1,126 @@
+from flask import json
+from collections import deque
+
+import threading
+import time
+
+# Live updates for /match/<id>/events. The api routes publish what changed
+# after committing it, and every viewer of the match gets the same
+# preformatted Server-Sent Events frame, so publishing costs the same however
+# many are watching. Only viewers connected to the process that handled the
+# game server's request see its events.
+
+# Events kept per match, for viewers that reconnect with a Last-Event-ID.
+BACKLOG = 100
+# Seconds between comments sent to idle streams, so proxies keep them open.
+KEEPALIVE_SECONDS = 15
+# Matches nobody has watched for this long are forgotten.
+IDLE_SECONDS = 60 * 10
+
+_lock = threading.Lock()
+_channels = {}
+
+
+class Channel(object):
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.frames = deque(maxlen=BACKLOG)
+        self.last_id = 0
+        self.subscribers = 0
+        self.last_used = time.time()
+
+    def publish(self, event, data):
+        with self.condition:
+            self.last_id += 1
+            self.frames.append((self.last_id, format_frame(self.last_id, event, data)))
+            self.condition.notify_all()
+        return self.last_id
+
+    def wait(self, last_id, timeout):
+        # Returns the frames published after last_id, waiting up to timeout
+        # seconds for one if there aren't any yet, and the new last_id.
+        with self.condition:
+            if last_id > self.last_id:
+                # From before this process started, nothing to catch up on.
+                last_id = self.last_id
+            if last_id == self.last_id:
+                self.condition.wait(timeout)
+            frames = [frame for id, frame in self.frames if id > last_id]
+            return frames, self.last_id
+
+
+def format_frame(id, event, data):
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(
+        id, event, json.dumps(data, separators=(',', ':')))
+
+
+def publish(match_id, event, data):
+    # Sends data to everyone following the match. Does nothing if nobody has
+    # followed it recently.
+    with _lock:
+        channel = _channels.get(match_id)
+    if channel is not None:
+        channel.publish(event, data)
+
+
+def subscribe(match_id):
+    now = time.time()
+    with _lock:
+        for id, channel in _channels.items():
+            if channel.subscribers == 0 and channel.last_used < now - IDLE_SECONDS:
+                del _channels[id]
+        channel = _channels.get(match_id)
+        if channel is None:
+            channel = _channels[match_id] = Channel()
+        channel.subscribers += 1
+        channel.last_used = now
+    return channel
+
+
+def unsubscribe(channel):
+    with _lock:
+        channel.subscribers -= 1
+        channel.last_used = time.time()
+
+
+def stream(match_id, last_id=None, keepalive=None):
+    # The body of an event stream response, which follows the match from
+    # when this is called. Starts after last_id if given, otherwise with the
+    # next event.
+    channel = subscribe(match_id)
+    if last_id is None:
+        last_id = channel.last_id
+    return Stream(channel, last_id, keepalive or KEEPALIVE_SECONDS)
+
+
+class Stream(object):
+    # The WSGI server calls close when the viewer goes away, even if the
+    # stream was never started.
+
+    def __init__(self, channel, last_id, keepalive):
+        self.channel = channel
+        self.last_id = last_id
+        self.keepalive = keepalive
+        self._frames = self._generate()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return next(self._frames)
+
+    def close(self):
+        if self.channel is not None:
+            self._frames.close()
+            unsubscribe(self.channel)
+            self.channel = None
+
+    def _generate(self):
+        yield 'retry: 3000\n\n'
+        while True:
+            frames, self.last_id = self.channel.wait(self.last_id, self.keepalive)
+            if not frames:
+                yield ': keepalive\n\n'
+            for frame in frames:
+                yield frame
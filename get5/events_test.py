@@ -0,0 +1,152 @@
+import unittest
+
+import events
+import get5_test
+from get5 import db
+from models import Match
+
+import json
+import threading
+
+
+class ChannelTests(unittest.TestCase):
+
+    def test_publish_and_wait(self):
+        channel = events.Channel()
+        self.assertEqual(channel.wait(0, 0), ([], 0))
+        channel.publish('score', {'team1': 1})
+        channel.publish('score', {'team1': 2})
+        frames, last_id = channel.wait(0, 0)
+        self.assertEqual(last_id, 2)
+        self.assertEqual(frames, [
+            'id: 1\nevent: score\ndata: {"team1":1}\n\n',
+            'id: 2\nevent: score\ndata: {"team1":2}\n\n',
+        ])
+        self.assertEqual(channel.wait(1, 0), (frames[1:], 2))
+        # An id from before a restart starts from now.
+        self.assertEqual(channel.wait(50, 0), ([], 2))
+
+    def test_backlog_is_bounded(self):
+        channel = events.Channel()
+        for i in range(events.BACKLOG + 10):
+            channel.publish('score', {'round': i})
+        frames, last_id = channel.wait(0, 0)
+        self.assertEqual(len(frames), events.BACKLOG)
+        self.assertTrue(frames[0].startswith('id: 11\n'))
+
+    def test_one_publish_for_many_viewers(self):
+        streams = [events.stream(1000, keepalive=5) for _ in range(50)]
+        try:
+            for stream in streams:
+                self.assertEqual(next(stream), 'retry: 3000\n\n')
+            ready = threading.Event()
+            frames = []
+
+            def follow(stream):
+                ready.wait()
+                frames.append(next(stream))
+
+            threads = [threading.Thread(target=follow, args=(stream,)) for stream in streams]
+            for thread in threads:
+                thread.start()
+            ready.set()
+            events.publish(1000, 'score', {'team1': 3})
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(frames), 50)
+            # Every viewer was sent the same frame, formatted once.
+            self.assertEqual(len(set(id(frame) for frame in frames)), 1)
+        finally:
+            for stream in streams:
+                stream.close()
+        self.assertEqual(events._channels[1000].subscribers, 0)
+
+    def test_keepalive(self):
+        stream = events.stream(1001, keepalive=0.01)
+        try:
+            next(stream)
+            self.assertEqual(next(stream), ': keepalive\n\n')
+        finally:
+            stream.close()
+
+
+class MatchEventsTests(get5_test.Get5Test):
+
+    def open_stream(self, c, url='/match/1/events', **kwargs):
+        response = c.get(url, buffered=False, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.addCleanup(response.close)
+        stream = iter(response.response)
+        self.assertEqual(next(stream), 'retry: 3000\n\n')
+        return stream
+
+    def read_event(self, stream):
+        frame = next(stream)
+        lines = dict(line.split(': ', 1) for line in frame.strip().split('\n'))
+        return lines['event'], json.loads(lines['data'])
+
+    def test_api_updates_are_published(self):
+        stream = self.open_stream(self.app)
+        matchkey = Match.query.get(1).api_key
+
+        self.app.post('/match/1/map/0/start', data={'mapname': 'de_dust2', 'key': matchkey})
+        self.assertEqual(self.read_event(stream),
+                         ('map_start', {'map': 0, 'mapname': 'de_dust2'}))
+
+        self.app.post('/match/1/map/0/update',
+                      data={'team1score': 4, 'team2score': 2, 'key': matchkey})
+        self.assertEqual(self.read_event(stream),
+                         ('score', {'map': 0, 'team1': 4, 'team2': 2}))
+
+        url = '/match/1/map/0/player/76561198053858673/update'
+        values = {'key': matchkey, 'name': 'player1', 'team': 'team1',
+                  'kills': 3, 'deaths': 1, 'roundsplayed': 6}
+        self.app.post(url, data=values)
+        event, data = self.read_event(stream)
+        self.assertEqual(event, 'players')
+        self.assertEqual(data['players'][0]['kills'], 3)
+        self.assertEqual(data['players'][0]['team_id'], 1)
+
+        # Only what changed is sent.
+        values['kills'] = 4
+        values['roundsplayed'] = 7
+        self.app.post(url, data=values)
+        self.assertEqual(self.read_event(stream), ('players', {'map': 0, 'players': [
+            {'steamid': '76561198053858673', 'kills': 4, 'roundsplayed': 7}]}))
+
+        self.app.post('/match/1/vetoUpdate', data={
+            'key': matchkey, 'teamString': 'team1', 'map': 'de_nuke', 'pick_or_veto': 'ban'})
+        self.assertEqual(self.read_event(stream), ('veto', {
+            'team': 'EnvyUs', 'map': 'de_nuke', 'pick_or_veto': 'ban'}))
+
+        self.app.post('/match/1/map/0/finish', data={'winner': 'team1', 'key': matchkey})
+        self.assertEqual(self.read_event(stream), ('map_end', {
+            'map': 0, 'winner': 'team1', 'team1_score': 1, 'team2_score': 0}))
+
+        self.app.post('/match/1/finish', data={'winner': 'team1', 'key': matchkey})
+        self.assertEqual(self.read_event(stream), ('match_end', {
+            'winner': 'team1', 'forfeit': False, 'team1_score': 1, 'team2_score': 0}))
+
+    def test_reconnect_catches_up(self):
+        stream = self.open_stream(self.app)
+        matchkey = Match.query.get(1).api_key
+        self.app.post('/match/1/map/0/start', data={'mapname': 'de_dust2', 'key': matchkey})
+        self.app.post('/match/1/map/0/update',
+                      data={'team1score': 1, 'team2score': 0, 'key': matchkey})
+        first_id = int(next(stream).split('\n')[0][len('id: '):])
+
+        stream = self.open_stream(self.app, headers={'Last-Event-ID': str(first_id)})
+        self.assertEqual(self.read_event(stream),
+                         ('score', {'map': 0, 'team1': 1, 'team2': 0}))
+
+    def test_private_match(self):
+        match = Match.query.get(1)
+        match.private_match = True
+        db.session.commit()
+        self.assertEqual(self.app.get('/match/1/events').status_code, 400)
+        self.assertEqual(self.app.get('/match/100/events').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
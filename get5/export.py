@@ -0,0 +1,159 @@
+from get5 import app, db, BadRequestError
+from models import Match, MapStats, PlayerStats, Team, SteamProfile
+
+from flask import Blueprint, request, g, stream_with_context
+from io import BytesIO as StringIO
+from collections import OrderedDict
+import csv
+import datetime
+import json
+
+export_blueprint = Blueprint('export', __name__)
+
+# How many rows are fetched from the database at a time.
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def export_columns():
+    return OrderedDict([
+        ('id', PlayerStats.id),
+        ('match_id', PlayerStats.match_id),
+        ('season_id', Match.season_id),
+        ('map_number', MapStats.map_number),
+        ('map_name', MapStats.map_name),
+        ('map_start_time', MapStats.start_time),
+        ('team_id', PlayerStats.team_id),
+        ('team', Team.name),
+        ('steamid', PlayerStats.steam_id),
+        # Names come from the Steam profile cache only, an export never waits
+        # on the Steam API. Players we haven't seen get their in-game name.
+        ('name', db.func.coalesce(SteamProfile.personaname, PlayerStats.name)),
+        ('kills', PlayerStats.kills),
+        ('deaths', PlayerStats.deaths),
+        ('assists', PlayerStats.assists),
+        ('flashbang_assists', PlayerStats.flashbang_assists),
+        ('headshot_kills', PlayerStats.headshot_kills),
+        ('damage', PlayerStats.damage),
+        ('roundsplayed', PlayerStats.roundsplayed),
+        ('teamkills', PlayerStats.teamkills),
+        ('suicides', PlayerStats.suicides),
+        ('bomb_plants', PlayerStats.bomb_plants),
+        ('bomb_defuses', PlayerStats.bomb_defuses),
+        ('k1', PlayerStats.k1),
+        ('k2', PlayerStats.k2),
+        ('k3', PlayerStats.k3),
+        ('k4', PlayerStats.k4),
+        ('k5', PlayerStats.k5),
+        ('v1', PlayerStats.v1),
+        ('v2', PlayerStats.v2),
+        ('v3', PlayerStats.v3),
+        ('v4', PlayerStats.v4),
+        ('v5', PlayerStats.v5),
+        ('firstkill_t', PlayerStats.firstkill_t),
+        ('firstkill_ct', PlayerStats.firstkill_ct),
+        ('firstdeath_t', PlayerStats.firstdeath_t),
+        ('firstdeath_ct', PlayerStats.firstdeath_Ct),
+        ('kdr', PlayerStats.kdr_sql()),
+        ('adr', PlayerStats.adr_sql()),
+        ('hsp', PlayerStats.hsp_sql()),
+        ('rating', PlayerStats.rating_sql()),
+    ])
+
+
+def iter_player_stats(season_id=None, since=None, until=None):
+    # Yields one tuple per PlayerStats row, in export_columns() order. Rows
+    # are streamed from the database in batches (with a server-side cursor
+    # where the driver supports one), so memory use doesn't grow with the
+    # size of the export.
+    columns = export_columns()
+    query = db.session.query(*columns.values()).select_from(PlayerStats).join(
+        Match, Match.id == PlayerStats.match_id).outerjoin(
+        MapStats, MapStats.id == PlayerStats.map_id).outerjoin(
+        Team, Team.id == PlayerStats.team_id).outerjoin(
+        SteamProfile, SteamProfile.steam_id == PlayerStats.steam_id)
+
+    if season_id is not None:
+        query = query.filter(Match.season_id == season_id)
+    if since is not None:
+        query = query.filter(Match.start_time >= since)
+    if until is not None:
+        query = query.filter(Match.start_time < until)
+
+    return query.order_by(PlayerStats.id).yield_per(EXPORT_BATCH_SIZE)
+
+
+def _format_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def generate_csv(rows):
+    data = StringIO()
+    csvWrite = csv.writer(data)
+    csvWrite.writerow(export_columns().keys())
+    for row in rows:
+        csvWrite.writerow([_format_value(value) for value in row])
+        # Hand the output over in chunks rather than a line at a time.
+        if data.tell() >= 64 * 1024:
+            yield data.getvalue()
+            data.seek(0)
+            data.truncate(0)
+    yield data.getvalue()
+
+
+def generate_ndjson(rows):
+    names = export_columns().keys()
+    lines = []
+    for row in rows:
+        values = [value.isoformat() if isinstance(value, datetime.datetime) else value
+                  for value in row]
+        lines.append(json.dumps(OrderedDict(zip(names, values))))
+        if len(lines) >= EXPORT_BATCH_SIZE:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def generate(format, rows):
+    if format == 'csv':
+        return generate_csv(rows)
+    return generate_ndjson(rows)
+
+
+def parse_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise BadRequestError('Invalid date {}, expected YYYY-MM-DD'.format(value))
+
+
+@export_blueprint.route('/export/playerstats.<format>')
+def export_player_stats(format):
+    if format not in EXPORT_FORMATS:
+        raise BadRequestError('Unknown export format')
+    if not g.user or not (g.user.admin or g.user.super_admin):
+        raise BadRequestError('Only admins can export stats')
+
+    season_id = request.values.get('season_id', type=int)
+    since = parse_date(request.values.get('since'))
+    until = parse_date(request.values.get('until'))
+    app.logger.info('Exporting player stats as {} for {}'.format(format, g.user))
+
+    rows = iter_player_stats(season_id, since, until)
+    response = app.response_class(
+        stream_with_context(generate(format, rows)),
+        mimetype=EXPORT_FORMATS[format])
+    response.headers.set('Content-Disposition', 'attachment',
+                         filename='playerstats.{}'.format(format))
+    return response
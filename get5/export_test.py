@@ -0,0 +1,79 @@
+import unittest
+import csv
+import datetime
+import json
+from io import BytesIO as StringIO
+
+import get5_test
+from get5 import db
+from models import Match, MapStats, PlayerStats, SteamProfile
+
+
+class ExportTests(get5_test.Get5Test):
+
+    def add_stats(self):
+        map_stats = MapStats.get_or_create(1, 0, 'de_dust2')
+        db.session.commit()
+        for i, steam_id in enumerate(['76561198053858673', '76561198064755913']):
+            db.session.add(PlayerStats(
+                match_id=1, map_id=map_stats.id, team_id=1, steam_id=steam_id,
+                name='ingame{}'.format(i), kills=20 + i, deaths=10, damage=2000,
+                roundsplayed=25, headshot_kills=5))
+        db.session.add(SteamProfile(steam_id='76561198053858673', personaname=u'caf\xe9',
+                                    updated_at=datetime.datetime.utcnow()))
+        db.session.commit()
+
+    def login(self, user_id):
+        with self.app.session_transaction() as sess:
+            sess['user_id'] = user_id
+
+    def test_export_csv(self):
+        self.add_stats()
+        self.login(1)
+        response = self.app.get('/export/playerstats.csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/csv')
+
+        rows = list(csv.DictReader(StringIO(response.data)))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['team'], 'EnvyUs')
+        self.assertEqual(rows[0]['name'], 'caf\xc3\xa9')
+        self.assertEqual(rows[1]['name'], 'ingame1')
+        self.assertEqual(rows[1]['kills'], '21')
+        self.assertEqual(rows[0]['season_id'], '1')
+        self.assertAlmostEqual(float(rows[0]['adr']), 80.0)
+
+    def test_export_ndjson(self):
+        self.add_stats()
+        self.login(1)
+        response = self.app.get('/export/playerstats.ndjson')
+        self.assertEqual(response.status_code, 200)
+        rows = [json.loads(line) for line in response.data.splitlines()]
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['steamid'], '76561198053858673')
+        self.assertEqual(rows[0]['name'], u'caf\xe9')
+        self.assertAlmostEqual(rows[0]['hsp'], 0.25)
+
+        response = self.app.get('/export/playerstats.ndjson?season_id=2')
+        self.assertEqual(response.data, '')
+
+        Match.query.get(1).start_time = datetime.datetime(2019, 5, 1)
+        db.session.commit()
+        response = self.app.get('/export/playerstats.ndjson?since=2019-04-01&until=2019-06-01')
+        self.assertEqual(len(response.data.splitlines()), 2)
+        response = self.app.get('/export/playerstats.ndjson?since=2019-06-01')
+        self.assertEqual(response.data, '')
+        response = self.app.get('/export/playerstats.ndjson?since=yesterday')
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_admin_only(self):
+        self.add_stats()
+        self.assertEqual(self.app.get('/export/playerstats.csv').status_code, 400)
+        self.login(2)
+        self.assertEqual(self.app.get('/export/playerstats.csv').status_code, 400)
+        self.login(1)
+        self.assertEqual(self.app.get('/export/playerstats.xml').status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+import get5
+from get5 import app, db
+import models
+import util
+
+import datetime
+import json
+import sqlalchemy
+import threading
+
+# How often run_worker looks for jobs that are due when it's idle.
+_WAKEUP_SECONDS = 1
+
+_HANDLERS = {}
+
+
+class JobError(Exception):
+    # Raised by a handler when trying again won't help.
+    pass
+
+
+def handler(kind):
+    def decorator(f):
+        _HANDLERS[kind] = f
+        return f
+    return decorator
+
+
+@handler('load_match')
+def load_match(job):
+    match = models.Match.query.get(job.match_id)
+    if match is None:
+        raise JobError('Match no longer exists')
+    # The queue does the retrying, but only of batches that weren't sent:
+    # loading the configs again would restart the match.
+    try:
+        loaded = match.send_to_server(job.get_payload().get('config_url'),
+                                      raise_errors=True, num_retries=1)
+    except util.RconSentError as e:
+        raise JobError(str(e))
+    if not loaded:
+        raise util.RconError('Failed to load match configs on server')
+
+
+@handler('rcon')
+def rcon(job):
+    server = models.GameServer.query.get(job.server_id)
+    if server is None:
+        raise JobError('Server no longer exists')
+    payload = job.get_payload()
+    # The queue does the retrying, but only of commands that weren't sent,
+    # so a pause or a backup restore never runs twice.
+    try:
+        response = server.send_rcon_command(
+            payload['command'], raise_errors=True, num_retries=1)
+    except util.RconSentError as e:
+        raise JobError(str(e))
+    if payload.get('expect_response') and not response:
+        raise JobError('No response from server')
+    return response
+
+
+def enqueue(kind, match=None, server=None, payload=None, user=None, key=None):
+    # Adds a job to the current transaction, so it only runs if whatever
+    # queued it is committed. Returns the existing job if key was used before.
+    if key is not None:
+        existing = models.Job.query.filter_by(idempotency_key=key).first()
+        if existing is not None:
+            return existing
+
+    now = datetime.datetime.utcnow()
+    values = dict(
+        kind=kind,
+        match_id=match.id if match else None,
+        server_id=server.id if server else None,
+        user_id=user.id if user else None,
+        payload=json.dumps(payload or {}),
+        idempotency_key=key,
+        status=models.Job.PENDING,
+        attempts=0,
+        max_attempts=get5.config_setting('JOB_MAX_ATTEMPTS'),
+        run_after=now,
+        created_at=now,
+        updated_at=now)
+    if key is None:
+        job = models.Job(**values)
+        db.session.add(job)
+        return job
+
+    try:
+        result = db.session.execute(models.Job.__table__.insert().values(**values))
+    except sqlalchemy.exc.IntegrityError:
+        # Another request queued it since the check above. Only the INSERT
+        # failed, the transaction carries on.
+        return models.Job.query.filter_by(idempotency_key=key).with_for_update().one()
+    return models.Job.query.get(result.inserted_primary_key[0])
+
+
+def enqueue_rcon(match, server, command, user=None, key=None, expect_response=False):
+    return enqueue('rcon', match, server,
+                   {'command': command, 'expect_response': expect_response},
+                   user, key)
+
+
+def claim_next(now=None):
+    # Marks the next due job running and returns it, or returns None. A job
+    # waits while an earlier one for the same server hasn't finished, so a
+    # pause that's being retried can't end up after the unpause.
+    now = now or datetime.datetime.utcnow()
+    Job = models.Job
+    earlier = db.aliased(Job)
+    blocked = db.session.query(earlier.id).filter(
+        earlier.server_id == Job.server_id,
+        earlier.id < Job.id,
+        earlier.status.in_([Job.PENDING, Job.RUNNING])).exists()
+
+    while True:
+        job = Job.query.filter(
+            Job.status == Job.PENDING, Job.run_after <= now, ~blocked).order_by(
+            Job.id).first()
+        if job is None:
+            return None
+        # Another worker may have got it first.
+        claimed = Job.query.filter_by(id=job.id, status=Job.PENDING).update(
+            {Job.status: Job.RUNNING, Job.updated_at: now},
+            synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return job
+
+
+def run_job(job, now=None):
+    now = now or datetime.datetime.utcnow()
+    try:
+        result = _HANDLERS[job.kind](job)
+    except Exception as e:
+        db.session.rollback()
+        job.attempts = (job.attempts or 0) + 1
+        job.last_error = str(e)[:256] or e.__class__.__name__
+        if isinstance(e, (JobError, KeyError)) or job.attempts >= job.max_attempts:
+            job.status = models.Job.FAILED
+            app.logger.warning('Job {} failed: {}'.format(job.id, job.last_error))
+        else:
+            # Backs off exponentially between attempts.
+            job.status = models.Job.PENDING
+            job.run_after = now + datetime.timedelta(
+                seconds=get5.config_setting('JOB_RETRY_DELAY') * 2 ** (job.attempts - 1))
+    else:
+        job.attempts = (job.attempts or 0) + 1
+        job.status = models.Job.DONE
+        job.result = result
+        job.last_error = None
+    job.updated_at = now
+    db.session.commit()
+    return job
+
+
+def requeue_stale(now=None):
+    # Jobs left running by a worker that died.
+    now = now or datetime.datetime.utcnow()
+    oldest_allowed = now - datetime.timedelta(
+        seconds=get5.config_setting('JOB_STALE_SECONDS'))
+    requeued = models.Job.query.filter(
+        models.Job.status == models.Job.RUNNING,
+        models.Job.updated_at < oldest_allowed).update(
+        {models.Job.status: models.Job.PENDING}, synchronize_session=False)
+    db.session.commit()
+    return requeued
+
+
+def run_once(now=None):
+    # Runs every job that is due, and returns how many were run.
+    requeue_stale(now)
+    ran = 0
+    job = claim_next(now)
+    while job is not None:
+        run_job(job, now)
+        ran += 1
+        job = claim_next(now)
+    return ran
+
+
+def run_worker(stop_event=None):
+    # Runs jobs as they become due until stop_event is set.
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        try:
+            ran = run_once()
+            if ran:
+                app.logger.info('Ran {} jobs'.format(ran))
+        except Exception:
+            app.logger.exception('Failed to run jobs')
+        finally:
+            db.session.remove()
+        stop_event.wait(_WAKEUP_SECONDS)
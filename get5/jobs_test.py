@@ -0,0 +1,220 @@
+import unittest
+
+import get5_test
+import jobs
+import rconpool
+import rconpool_test
+from get5 import db
+from models import GameServer, Match, Job
+
+import datetime
+import sqlalchemy
+
+
+class JobTests(rconpool_test.FakeRconServerMixin, get5_test.Get5Test):
+
+    def login(self, c):
+        with c.session_transaction() as sess:
+            sess['user_id'] = 1
+
+    def test_run_rcon_job(self):
+        match = Match.query.get(1)
+        jobs.enqueue_rcon(match, GameServer.query.get(1), 'sm_pause')
+        db.session.commit()
+
+        self.assertEqual(jobs.run_once(), 1)
+        job = Job.query.one()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.result, 'response to sm_pause')
+        self.assertEqual(self.rcon_server.commands, ['sm_pause'])
+        self.assertEqual(Job.get_unfinished(1), [])
+        self.assertEqual(jobs.run_once(), 0)
+
+    def test_idempotency_key(self):
+        match = Match.query.get(1)
+        server = GameServer.query.get(1)
+        first = jobs.enqueue_rcon(match, server, 'sm_pause', key='pause-1')
+        db.session.commit()
+        self.assertEqual(jobs.enqueue_rcon(match, server, 'sm_pause', key='pause-1').id,
+                         first.id)
+        jobs.enqueue_rcon(match, server, 'sm_pause', key='pause-2')
+        db.session.commit()
+        self.assertEqual(Job.query.count(), 2)
+
+    def test_concurrent_idempotency_key(self):
+        match = Match.query.get(1)
+        server = GameServer.query.get(1)
+        inserted = []
+
+        # Another request queues the same job just before this one.
+        def before_cursor_execute(conn, cursor, statement, *args):
+            if statement.startswith('INSERT INTO job') and not inserted:
+                inserted.append(None)
+                now = datetime.datetime.utcnow()
+                inserted[0] = conn.execute(Job.__table__.insert().values(
+                    kind='rcon', match_id=match.id, server_id=server.id,
+                    payload='{"command": "sm_pause"}', idempotency_key='pause-1',
+                    status=Job.PENDING, attempts=0, max_attempts=3, run_after=now,
+                    created_at=now, updated_at=now)).inserted_primary_key[0]
+
+        sqlalchemy.event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            job = jobs.enqueue_rcon(match, server, 'sm_pause', key='pause-1')
+        finally:
+            sqlalchemy.event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        db.session.commit()
+        self.assertEqual(job.id, inserted[0])
+        self.assertEqual(Job.query.count(), 1)
+
+    def test_retries_then_fails(self):
+        self.rcon_server.password = 'wrong'
+        match = Match.query.get(1)
+        server = GameServer.query.get(1)
+        jobs.enqueue_rcon(match, server, 'sm_pause')
+        jobs.enqueue_rcon(match, server, 'sm_unpause')
+        db.session.commit()
+
+        now = datetime.datetime.utcnow()
+        self.assertEqual(jobs.run_once(now), 1)
+        pause, unpause = Job.query.order_by(Job.id).all()
+        self.assertEqual(pause.status, Job.PENDING)
+        self.assertEqual(pause.attempts, 1)
+        self.assertEqual(pause.last_error, 'Incorrect rcon password')
+        self.assertEqual(pause.run_after, now + datetime.timedelta(seconds=5))
+        self.assertIn('Retrying', pause.get_status_string())
+        # The unpause waits for the pause.
+        self.assertEqual(unpause.attempts, 0)
+
+        for attempt in range(2, 6):
+            now += datetime.timedelta(hours=1)
+            jobs.run_once(now)
+            pause = Job.query.get(pause.id)
+            self.assertEqual(pause.attempts, attempt)
+        self.assertEqual(pause.status, Job.FAILED)
+        # Once the pause had failed, the unpause got its turn.
+        self.assertEqual(Job.query.get(unpause.id).attempts, 1)
+        self.assertEqual([job.id for job in Job.get_unfinished(1)],
+                         [pause.id, unpause.id])
+
+        self.rcon_server.password = 'password'
+        rconpool.pool.close_all()
+        now += datetime.timedelta(hours=1)
+        self.assertEqual(jobs.run_once(now), 1)
+        self.assertEqual(Job.query.get(unpause.id).status, Job.DONE)
+
+    def test_missing_server_fails_at_once(self):
+        jobs.enqueue_rcon(Match.query.get(1), GameServer.query.get(2), 'sm_pause')
+        db.session.commit()
+        GameServer.query.filter_by(id=2).delete()
+        db.session.commit()
+
+        jobs.run_once()
+        job = Job.query.one()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 1)
+
+    def test_requeue_stale(self):
+        jobs.enqueue_rcon(Match.query.get(1), GameServer.query.get(1), 'sm_pause')
+        db.session.commit()
+        now = datetime.datetime.utcnow()
+        job = jobs.claim_next(now)
+        self.assertEqual(Job.query.get(job.id).status, Job.RUNNING)
+        self.assertIsNone(jobs.claim_next(now))
+
+        self.assertEqual(jobs.requeue_stale(now), 0)
+        self.assertEqual(jobs.requeue_stale(now + datetime.timedelta(hours=1)), 1)
+        self.assertEqual(jobs.claim_next(now).id, job.id)
+
+    def test_match_pages_queue_commands(self):
+        with self.app as c:
+            self.login(c)
+            for _ in range(2):
+                response = c.get('/match/1/pause?key=abc')
+                self.assertEqual(response.status_code, 302)
+            self.assertEqual(self.rcon_server.commands, [])
+
+            response = c.get('/match/1')
+            self.assertIn('sm_pause: Pending', response.data)
+        self.assertEqual(Job.query.count(), 1)
+
+        jobs.run_once()
+        # The match page also reads the server's connect info.
+        self.assertEqual(self.rcon_server.commands.count('sm_pause'), 1)
+        with self.app as c:
+            self.login(c)
+            self.assertNotIn('sm_pause', c.get('/match/1').data)
+
+    def test_cancel_ends_match_on_server(self):
+        with self.app as c:
+            self.login(c)
+            self.assertEqual(c.get('/match/1/cancel').status_code, 302)
+
+        jobs.run_once()
+        self.assertEqual(self.rcon_server.commands, ['get5_endmatch'])
+
+    def test_load_match(self):
+        with self.app as c:
+            self.login(c)
+            response = c.post('/match/create', data={
+                'server_id': 2,
+                'team1_id': 1,
+                'team2_id': 2,
+                'match_title': 'Map {MAPNUMBER} of {MAXMAPS}',
+                'series_type': 'bo1',
+                'veto_first': 'CT',
+                'veto_mappool': ['de_dust2'],
+                'team1_series_score': 0,
+                'team2_series_score': 0,
+            })
+            self.assertEqual(response.status_code, 302)
+
+        job = Job.query.one()
+        self.assertEqual(job.kind, 'load_match')
+        match = Match.query.get(job.match_id)
+        load_command = 'get5_loadmatch_url ' + job.get_payload()['config_url']
+        self.assertIn('/match/{}/config'.format(match.id), load_command)
+        # get5 only replies if it couldn't load the match.
+        rcon_server = self.rcon_servers[1]
+        rcon_server.outputs[load_command] = ''
+
+        jobs.run_once()
+        self.assertEqual(Job.query.one().status, Job.DONE)
+        self.assertEqual(rcon_server.commands, [
+            load_command, 'get5_web_api_key ' + match.api_key, 'map de_dust2'])
+
+    def test_load_match_unreachable_server(self):
+        match = Match.query.get(1)
+        server = GameServer.query.get(match.server_id)
+        # Nothing listens there.
+        server.port = 1
+        jobs.enqueue('load_match', match, server, {'config_url': 'example.com/match/1/config'})
+        db.session.commit()
+
+        jobs.run_once()
+        job = Job.query.one()
+        self.assertEqual(job.status, Job.PENDING)
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNotNone(job.last_error)
+
+    def test_sent_commands_not_retried(self):
+        match = Match.query.get(1)
+        server = GameServer.query.get(match.server_id)
+        load_command = 'get5_loadmatch_url example.com/match/1/config'
+        self.rcon_server.hang_ups.update(['sm_pause', load_command])
+        jobs.enqueue_rcon(match, server, 'sm_pause')
+        jobs.enqueue('load_match', match, server, {'config_url': 'example.com/match/1/config'})
+        db.session.commit()
+
+        now = datetime.datetime.utcnow()
+        self.assertEqual(jobs.run_once(now), 2)
+        for job in Job.query:
+            self.assertEqual(job.status, Job.FAILED)
+            self.assertEqual(job.attempts, 1)
+        self.assertEqual(jobs.run_once(now + datetime.timedelta(hours=1)), 0)
+        self.assertEqual(self.rcon_server.commands.count('sm_pause'), 1)
+        self.assertEqual(self.rcon_server.commands.count(load_command), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,13 @@
 from flask import Blueprint, request, render_template, flash, g, redirect, jsonify, Markup, json
 
 import steamid
+import steamprofiles
 import get5
 from get5 import app, db, BadRequestError, config_setting
-from models import User, Team, Match, GameServer, MapStats, PlayerStats, Season
+from models import (Team, Match, MapStats, Season, PlayerCareer, PlayerSeasonCareer,
+                    get_steam_name)
 from collections import OrderedDict, defaultdict
 from datetime import datetime
-from statistics import mean
 import util
 import re
 from copy import deepcopy
@@ -15,56 +16,72 @@ from copy import deepcopy
 # and on season, just wrap it in one function to avoid code reuse.
 
 
+def get_team_standings(seasonid=None):
+    # Aggregate every decided map of every finished match in one grouped
+    # query. Rows are keyed on (team1, team2, map winner), so the number of
+    # rows scales with distinct pairings instead of the number of maps.
+    mapResults = db.session.query(
+        Match.team1_id, Match.team2_id, MapStats.winner,
+        db.func.count(MapStats.id),
+        db.func.sum(MapStats.team1_score),
+        db.func.sum(MapStats.team2_score)).join(
+        MapStats, MapStats.match_id == Match.id).filter(
+        Match.cancelled == False, Match.end_time.isnot(None),  # noqa: E712
+        Match.winner.isnot(None), MapStats.winner.isnot(None))
+    if seasonid is not None:
+        mapResults = mapResults.filter(Match.season_id == seasonid)
+    mapResults = mapResults.group_by(
+        Match.team1_id, Match.team2_id, MapStats.winner).all()
+
+    # Shoutouts to n3rds.
+    dTeamResults = defaultdict(
+        lambda: {'wins': 0, 'losses': 0, 'rounddiff': 0})
+    for team1_id, team2_id, winner, maps, team1_rounds, team2_rounds in mapResults:
+        team1_rounds = team1_rounds or 0
+        team2_rounds = team2_rounds or 0
+        if winner == team1_id:
+            loser = team2_id
+            rounddiff = team1_rounds - team2_rounds
+        else:
+            loser = team1_id
+            rounddiff = team2_rounds - team1_rounds
+
+        dTeamResults[winner]['wins'] += maps
+        dTeamResults[winner]['rounddiff'] += rounddiff
+        dTeamResults[loser]['losses'] += maps
+        dTeamResults[loser]['rounddiff'] -= rounddiff
+
+    # Standings are keyed by team name, so grab every name in one go.
+    teamNames = {}
+    if dTeamResults:
+        teamNames = dict(Team.query.filter(
+            Team.id.in_(dTeamResults.keys())).with_entities(Team.id, Team.name))
+
+    dTeamStandings = defaultdict(
+        lambda: {'teamid': 0, 'wins': 0, 'losses': 0, 'rounddiff': 0})
+    for teamid, results in dTeamResults.items():
+        if teamid not in teamNames:
+            continue
+        standing = dTeamStandings[teamNames[teamid]]
+        standing['teamid'] = teamid
+        standing['wins'] += results['wins']
+        standing['losses'] += results['losses']
+        standing['rounddiff'] += results['rounddiff']
+
+    # Sort teams via lexigraphical sort on wins, losses and round difference.
+    return OrderedDict(
+        sorted(dTeamStandings.items(),
+               key=lambda x: (x[1].get('wins'), x[1].get('losses'), x[1].get('rounddiff')),
+               reverse=True))
+
+
 def getLeaderboard(seasonid=None):
     if seasonid is None:
-        totalMatches = Match.query.order_by(-Match.id).filter(
-            Match.cancelled == False, Match.end_time.isnot(None), Match.winner.isnot(None))
         seasonsBoard = False
     else:
-        totalMatches = Match.query.order_by(-Match.id).filter(
-            Match.cancelled == False, Match.end_time.isnot(None),
-            Match.season_id == seasonid, Match.winner.isnot(None))
         seasonsBoard = True
         season = Season.query.get_or_404(seasonid)
-    allTeams = Team.query.order_by(-Team.id)
-    # Shoutouts to n3rds.
-    dTeamStandings = defaultdict(
-        lambda: {'teamid': 0, 'wins': 0, 'losses': 0, 'rounddiff': 0})
-    # Build our own object with team and links, rank, and round diff?
-    # Building our own object requires matches, map_stats for each match.
-    # Just build a dictionary with each match and stats?
-    for match in totalMatches:
-        map_stats = MapStats.query.filter(
-            MapStats.match_id==match.id, MapStats.winner != None)
-        # Get the losing team, and scores for round difference.
-        for all_stats in map_stats:
-            winningRounds = 0
-            losingRounds = 0
-            # Get each winner ID and create a list that returns the Team Name,
-            # amount of wins for now.
-            winningTeam = Team.query.filter_by(id=all_stats.winner).first()
-            if all_stats.winner == match.team1_id:
-                losingTeam = Team.query.filter_by(id=match.team2_id).first()
-                winningRounds = winningRounds + all_stats.team1_score
-                losingRounds = losingRounds + all_stats.team2_score
-            else:
-                losingTeam = Team.query.filter_by(id=match.team1_id).first()
-                losingRounds = losingRounds + all_stats.team1_score
-                winningRounds = winningRounds + all_stats.team2_score
-
-            # Update winning and losing teams.
-            dTeamStandings[winningTeam.name]['teamid'] = winningTeam.id
-            dTeamStandings[winningTeam.name]['wins'] += 1
-            dTeamStandings[winningTeam.name][
-                'rounddiff'] += (winningRounds - losingRounds)
-            dTeamStandings[losingTeam.name]['teamid'] = losingTeam.id
-            dTeamStandings[losingTeam.name]['losses'] += 1
-            dTeamStandings[losingTeam.name][
-                'rounddiff'] += (losingRounds - winningRounds)
-
-    # Sort teams via lexigraphical sort, very inefficient but it works for now.
-    dTeamStandings = OrderedDict(
-        sorted(dTeamStandings.items(), key=lambda x: (x[1].get('wins'), x[1].get('losses'), x[1].get('rounddiff')), reverse=True))
+    dTeamStandings = get_team_standings(seasonid)
     # app.logger.info('Currently in dTeamStandings: \n{}'.format(dTeamStandings))
     if seasonsBoard:
         return render_template('leaderboard.html', standings=dTeamStandings, user=g.user, seasonsBoard=seasonsBoard, seasonName=season.name)
@@ -73,49 +90,42 @@ def getLeaderboard(seasonid=None):
 
 
 def getPlayerLeaderboard(seasonid=None):
-    dctPlayer = {'steamid': '', 'steamurl': '', 'name': '', 'kills': 0, 'deaths': 0, 'kdr': 0.0, 'assists': 0, 'adr': 0.0,
-                 '3k': 0, '4k': 0, '5k': 0, '1v1': 0, '1v2': 0, '1v3': 0, '1v4': 0, '1v5': 0, 'rating': 0.0, 'hsp': 0.0, 'trp': 0, 'fba': 0}
+    # Career totals are maintained as players' stats come in, so the board
+    # is a single read of the rollup table.
+    if seasonid is None:
+        careers = PlayerCareer.query.filter(PlayerCareer.maps_played > 0)
+    else:
+        careers = PlayerSeasonCareer.query.filter(
+            PlayerSeasonCareer.season_id == seasonid,
+            PlayerSeasonCareer.maps_played > 0)
+
+    careers = careers.all()
+    steamprofiles.prefetch(career.steam_id for career in careers)
+
     lstAllPlayerDict = []
-    playerValues = PlayerStats.query.all()
-    matchQuery = Match.query.filter(
-        Match.season_id == seasonid,
-        Match.cancelled == False).with_entities(Match.id)
-    res = [int(r[0]) for r in matchQuery]
-    # Filter through every steam ID
-    for player in playerValues:
-        if any(d.get('steamid', None) == player.get_steam_id() for d in lstAllPlayerDict):
-            continue
-        if seasonid is not None:
-            totalStats = PlayerStats.query.filter(
-                PlayerStats.steam_id == player.get_steam_id()).filter(PlayerStats.match_id.in_(res))
-            # Odd result set sometimes returning 0?
-            if totalStats.count() < 1:
-                continue
-        else:
-            totalStats = PlayerStats.query.filter_by(
-                steam_id=player.get_steam_id())
-        dctPlayer['steamid'] = (player.get_steam_id())
-        dctPlayer['steamurl'] = (player.get_steam_url())
-        dctPlayer['name'] = (player.get_player_name())
-        dctPlayer['kills'] = (sum(c.kills for c in totalStats))
-        dctPlayer['deaths'] = (sum(c.deaths for c in totalStats))
-        dctPlayer['kdr'] = (mean(c.get_kdr() for c in totalStats))
-        dctPlayer['assists'] = (sum(c.assists for c in totalStats))
-        dctPlayer['adr'] = (mean(c.get_adr() for c in totalStats))
-        dctPlayer['3k'] = (sum(c.k3 for c in totalStats))
-        dctPlayer['4k'] = (sum(c.k4 for c in totalStats))
-        dctPlayer['5k'] = (sum(c.k5 for c in totalStats))
-        dctPlayer['1v1'] = (sum(c.v1 for c in totalStats))
-        dctPlayer['1v2'] = (sum(c.v2 for c in totalStats))
-        dctPlayer['1v3'] = (sum(c.v3 for c in totalStats))
-        dctPlayer['1v4'] = (sum(c.v4 for c in totalStats))
-        dctPlayer['1v5'] = (sum(c.v5 for c in totalStats))
-        dctPlayer['rating'] = (mean(c.get_rating() for c in totalStats))
-        dctPlayer['hsp'] = (mean(c.get_hsp() for c in totalStats))
-        dctPlayer['trp'] = (sum(c.roundsplayed for c in totalStats))
-        dctPlayer['fba'] = (sum(c.flashbang_assists for c in totalStats))
-        lstAllPlayerDict.append(dctPlayer)
+    for career in careers:
         dctPlayer = {}
+        dctPlayer['steamid'] = career.steam_id
+        dctPlayer['steamurl'] = career.get_steam_url()
+        dctPlayer['name'] = get_steam_name(career.steam_id)
+        dctPlayer['kills'] = career.kills
+        dctPlayer['deaths'] = career.deaths
+        dctPlayer['kdr'] = career.get_kdr()
+        dctPlayer['assists'] = career.assists
+        dctPlayer['adr'] = career.get_adr()
+        dctPlayer['3k'] = career.k3
+        dctPlayer['4k'] = career.k4
+        dctPlayer['5k'] = career.k5
+        dctPlayer['1v1'] = career.v1
+        dctPlayer['1v2'] = career.v2
+        dctPlayer['1v3'] = career.v3
+        dctPlayer['1v4'] = career.v4
+        dctPlayer['1v5'] = career.v5
+        dctPlayer['rating'] = career.get_rating()
+        dctPlayer['hsp'] = career.get_hsp()
+        dctPlayer['trp'] = career.roundsplayed
+        dctPlayer['fba'] = career.flashbang_assists
+        lstAllPlayerDict.append(dctPlayer)
     return lstAllPlayerDict
 
 leaderboard_blueprint = Blueprint('leaderboard', __name__)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python2.7
+
+# Times the team standings engine against freshly seeded sqlite databases.
+# This never touches the configured database, run it from the repo root with:
+#
+#   python2.7 -m get5.leaderboard_bench [--sizes 10000 50000 100000]
+
+import argparse
+import datetime
+import logging
+import os
+import random
+import tempfile
+import time
+
+import get5
+from get5 import db
+
+NUM_TEAMS = 64
+MAPS_PER_MATCH = 3
+
+
+def seed(num_maps):
+    from models import User, Team, Match, MapStats
+
+    user = User.get_or_create('76561198053858673')
+    db.session.commit()
+
+    teams = [{'user_id': user.id, 'name': 'Team {}'.format(i), 'tag': 'T{}'.format(i),
+              'flag': '', 'logo': '', 'auths': [], 'public_team': False}
+             for i in range(NUM_TEAMS)]
+    db.engine.execute(Team.__table__.insert(), teams)
+    team_ids = [t.id for t in Team.query.with_entities(Team.id)]
+
+    now = datetime.datetime.utcnow()
+    matches = []
+    for i in range(num_maps / MAPS_PER_MATCH + 1):
+        team1, team2 = random.sample(team_ids, 2)
+        matches.append({'user_id': user.id, 'team1_id': team1, 'team2_id': team2,
+                        'winner': random.choice((team1, team2)), 'max_maps': MAPS_PER_MATCH,
+                        'cancelled': i % 50 == 0, 'start_time': now, 'end_time': now,
+                        'season_id': 1 if i % 2 else None})
+    db.engine.execute(Match.__table__.insert(), matches)
+
+    map_stats = []
+    for match in Match.query.with_entities(Match.id, Match.team1_id, Match.team2_id):
+        for map_number in range(MAPS_PER_MATCH):
+            if len(map_stats) >= num_maps:
+                break
+            winner = random.choice((match.team1_id, match.team2_id))
+            loser_score = random.randint(0, 14)
+            map_stats.append({
+                'match_id': match.id, 'map_number': map_number, 'map_name': 'de_dust2',
+                'winner': winner,
+                'team1_score': 16 if winner == match.team1_id else loser_score,
+                'team2_score': 16 if winner == match.team2_id else loser_score})
+    db.engine.execute(MapStats.__table__.insert(), map_stats)
+
+
+def time_call(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        fn()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the team leaderboard.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000, 100000],
+                        help='number of maps to seed for each run')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='how many times each standings query is run')
+    args = parser.parse_args()
+
+    import leaderboard
+    get5.app.logger.setLevel(logging.ERROR)
+
+    print('{:>10} {:>14} {:>14}'.format('maps', 'all time (ms)', 'season (ms)'))
+    for size in args.sizes:
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        get5.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+        try:
+            with get5.app.app_context():
+                db.create_all()
+                seed(size)
+                all_time = time_call(leaderboard.get_team_standings, args.repeat)
+                season = time_call(lambda: leaderboard.get_team_standings(1), args.repeat)
+                db.session.remove()
+                db.get_engine(get5.app).dispose()
+            print('{:>10} {:>14.1f} {:>14.1f}'.format(size, all_time * 1000, season * 1000))
+        finally:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,11 @@
 import unittest
+import datetime
+from statistics import mean
 
 import get5_test
-from flask import url_for
-from models import User, Team, Match, GameServer, MapStats, Season
+import leaderboard
+from get5 import db
+from models import Match, MapStats, PlayerStats, PlayerCareer
 
 
 class LeaderboardTests(get5_test.Get5Test):
@@ -33,5 +36,79 @@ class LeaderboardTests(get5_test.Get5Test):
         self.assertEqual(self.app.get(
             '/leaderboard/season/2/players').status_code, 404)
 
+    def test_team_standings(self):
+        match = Match.query.get(1)
+        match.end_time = datetime.datetime.utcnow()
+        match.winner = match.team1_id
+        map_one = MapStats.get_or_create(match.id, 0, 'de_dust2')
+        map_one.winner = match.team1_id
+        map_one.team1_score = 16
+        map_one.team2_score = 10
+        db.session.commit()
+
+        standings = leaderboard.get_team_standings()
+        self.assertEqual(standings.keys(), ['EnvyUs', 'Fnatic'])
+        self.assertEqual(standings['EnvyUs'], {
+            'teamid': 1, 'wins': 1, 'losses': 0, 'rounddiff': 6})
+        self.assertEqual(standings['Fnatic'], {
+            'teamid': 2, 'wins': 0, 'losses': 1, 'rounddiff': -6})
+        self.assertEqual(leaderboard.get_team_standings(1), standings)
+        self.assertEqual(leaderboard.get_team_standings(2).keys(), [])
+
+        # Cancelled matches never count towards the standings.
+        match.cancelled = True
+        db.session.commit()
+        self.assertEqual(leaderboard.get_team_standings().keys(), [])
+
+    def test_player_leaderboard(self):
+        map_one = MapStats.get_or_create(1, 0, 'de_dust2')
+        db.session.commit()
+        rows = [
+            {'kills': 20, 'deaths': 10, 'roundsplayed': 25, 'damage': 2500,
+             'headshot_kills': 10, 'k1': 8, 'k2': 3, 'k3': 2, 'v1': 1},
+            {'kills': 5, 'deaths': 0, 'roundsplayed': 0, 'damage': 0,
+             'headshot_kills': 0, 'k1': 5},
+        ]
+        for map_id, values in enumerate(rows):
+            stats = PlayerStats()
+            stats.match_id = 1
+            stats.map_id = map_one.id + map_id
+            stats.team_id = 1
+            stats.steam_id = '76561198053858673'
+            for key, value in values.items():
+                setattr(stats, key, value)
+            db.session.add(stats)
+        db.session.commit()
+        PlayerCareer.rebuild()
+        db.session.commit()
+        all_stats = PlayerStats.query.all()
+
+        # Avoid resolving names through the Steam API.
+        get_steam_name = leaderboard.get_steam_name
+        leaderboard.get_steam_name = lambda steam64: 'player'
+        try:
+            board = leaderboard.getPlayerLeaderboard()
+            season_board = leaderboard.getPlayerLeaderboard(1)
+            other_board = leaderboard.getPlayerLeaderboard(2)
+        finally:
+            leaderboard.get_steam_name = get_steam_name
+
+        self.assertEqual(len(board), 1)
+        self.assertEqual(board, season_board)
+        self.assertEqual(other_board, [])
+        player = board[0]
+        self.assertEqual(player['steamid'], '76561198053858673')
+        self.assertEqual(player['name'], 'player')
+        self.assertEqual(player['kills'], 25)
+        self.assertEqual(player['deaths'], 10)
+        self.assertEqual(player['trp'], 25)
+        self.assertEqual(player['3k'], 2)
+        self.assertEqual(player['1v1'], 1)
+        self.assertAlmostEqual(player['kdr'], mean(s.get_kdr() for s in all_stats))
+        self.assertAlmostEqual(player['adr'], mean(s.get_adr() for s in all_stats))
+        self.assertAlmostEqual(player['hsp'], mean(s.get_hsp() for s in all_stats))
+        self.assertAlmostEqual(player['rating'], mean(s.get_rating() for s in all_stats))
+
+
 if __name__ == '__main__':
     unittest.main()
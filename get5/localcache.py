@@ -0,0 +1,78 @@
+# Small caches of values built from the database, kept in the memory of each
+# process. A LocalCache entry is dropped once a change to the rows it was
+# built from is committed in this process (see invalidate_on_commit), and
+# other processes notice the change when their entry expires.
+
+from collections import OrderedDict
+
+import sqlalchemy
+import threading
+import time
+
+
+class LocalCache(object):
+    # A dict that drops its least recently used entries past max_entries.
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # key -> (value, expires)
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        # Returns the value for key, or None if it's missing or has expired.
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[1] <= time.time():
+                return None
+            self._entries[key] = entry
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.time() + ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def delete_if(self, predicate):
+        # Drops every entry where predicate(key, value) is true.
+        with self._lock:
+            for key, entry in self._entries.items():
+                if predicate(key, entry[0]):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def invalidate_on_commit(collect, invalidate):
+    # After each flush collect(session) returns what it changed, as a set of
+    # ids, and invalidate(ids) is called with all of them once the
+    # transaction commits. Invalidating at the flush would let another
+    # request cache the old values again before the change was visible to
+    # it, and a rolled back change leaves what's cached right.
+    pending_key = object()
+
+    @sqlalchemy.event.listens_for(sqlalchemy.orm.Session, 'after_flush')
+    def _collect_flushed(session, flush_context):
+        ids = collect(session)
+        if ids:
+            session.info.setdefault(pending_key, set()).update(ids)
+
+    @sqlalchemy.event.listens_for(sqlalchemy.orm.Session, 'after_commit')
+    def _invalidate_committed(session):
+        ids = session.info.pop(pending_key, None)
+        if ids:
+            invalidate(ids)
+
+    @sqlalchemy.event.listens_for(sqlalchemy.orm.Session, 'after_soft_rollback')
+    def _discard_rolled_back(session, previous_transaction):
+        if previous_transaction.parent is None:
+            session.info.pop(pending_key, None)
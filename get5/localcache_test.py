@@ -0,0 +1,41 @@
+import unittest
+
+import localcache
+
+import time
+
+
+class LocalCacheTests(unittest.TestCase):
+
+    def test_expires(self):
+        cache = localcache.LocalCache(10)
+        cache.set('a', 1, 60)
+        cache.set('b', 2, 0.05)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), 2)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNone(cache.get('c'))
+
+    def test_eviction(self):
+        cache = localcache.LocalCache(3)
+        for i in range(3):
+            cache.set(i, i, 60)
+        # Reading an entry makes it the most recently used.
+        cache.get(0)
+        cache.set(3, 3, 60)
+        self.assertEqual(cache._entries.keys(), [2, 0, 3])
+
+    def test_delete(self):
+        cache = localcache.LocalCache(10)
+        for i in range(5):
+            cache.set(i, i * 10, 60)
+        cache.delete_many([0, 1, 100])
+        cache.delete_if(lambda key, value: value == 30)
+        self.assertEqual(cache._entries.keys(), [2, 4])
+        cache.clear()
+        self.assertIsNone(cache.get(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,15 +1,23 @@
-from flask import Blueprint, request, render_template, flash, g, redirect, jsonify, Markup, json
+from flask import Blueprint, request, render_template, flash, g, redirect, Markup, abort
 import csv
+import events
 from io import BytesIO as StringIO
+import jobs
+import matchconfig
+import pagination
+import scoreboard
+import serverallocator
+import serverinfo
 import steamid
+import steamprofiles
 import get5
 from get5 import app, db, BadRequestError, config_setting
-from models import User, Team, Match, GameServer, Season, Veto, match_audit, MapStats, PlayerStats, MatchSpectator
-from collections import OrderedDict
+from models import (User, Team, Match, GameServer, ServerStatus, Season, Veto, match_audit,
+                    MapStats, PlayerStats, PlayerCareer, MatchSpectator, Job)
 from datetime import datetime
 import util
+import uuid
 import re
-from copy import deepcopy
 
 from wtforms import (
     Form, widgets, validators,
@@ -163,19 +171,22 @@ class MatchForm(Form):
         if self.server_id.choices is None:
             self.server_id.choices = []
 
-        server_ids = []
-        for s in user.servers:
-            if not s.in_use:
-                server_ids.append(s.id)
-
-        for s in GameServer.query.filter_by(public_server=True):
-            if not s.in_use and s.id not in server_ids:
-                server_ids.append(s.id)
-
-        server_tuples = []
-        for server_id in server_ids:
-            server_tuples.append(
-                (server_id, GameServer.query.get(server_id).get_display()))
+        servers = GameServer.query.filter(
+            db.or_(GameServer.user_id == user.id, GameServer.public_server == True),  # noqa: E712
+            db.or_(GameServer.in_use == False,  # noqa: E712
+                   GameServer.in_use == None)).order_by(  # noqa: E711
+            GameServer.user_id != user.id, GameServer.id).all()
+
+        # Flag servers the poller last found unusable, without asking them.
+        statuses = ServerStatus.get_for(s.id for s in servers)
+        server_tuples = [(serverallocator.AUTO_SERVER_ID,
+                          'Automatic (healthiest free server)')]
+        for s in servers:
+            display = s.get_display()
+            status = statuses.get(s.id)
+            if status is not None and status.get_avaliability()[0] is None:
+                display = '{} - {}'.format(display, status.get_status_string())
+            server_tuples.append((s.id, display))
 
         self.server_id.choices += server_tuples
 
@@ -215,15 +226,27 @@ def match_create():
         elif form.validate():
             mock = config_setting('TESTING')
 
-            server = GameServer.query.get_or_404(form.data['server_id'])
-
-            match_on_server = g.user.matches.filter_by(
-                server_id=server.id, end_time=None, cancelled=False).first()
+            auto_server = (form.data['server_id'] == serverallocator.AUTO_SERVER_ID)
+            if auto_server:
+                server = serverallocator.allocate(g.user)
+            else:
+                server = GameServer.query.get_or_404(form.data['server_id'])
+                match_on_server = g.user.matches.filter_by(
+                    server_id=server.id, end_time=None, cancelled=False).first()
 
             server_available = False
             json_reply = None
 
-            if g.user.id != server.user_id and not server.public_server:
+            if server is None:
+                server_available = False
+                message = 'No free servers are available right now'
+            elif auto_server:
+                # The allocator only hands out servers the poller found ready,
+                # and has already reserved it.
+                server_available = True
+                json_reply, message = ServerStatus.query.get(
+                    server.id).get_avaliability()
+            elif g.user.id != server.user_id and not server.public_server:
                 server_available = False
                 message = 'This is not your server!'
             elif match_on_server is not None:
@@ -234,10 +257,21 @@ def match_create():
                 server_available = True
                 message = 'Success'
             else:
-                json_reply, message = util.check_server_avaliability(
-                    server, dbKey)
+                # Use what the poller last saw, and only ask the server
+                # ourselves if it hasn't been checked recently.
+                status = ServerStatus.query.get(server.id)
+                if status is not None and status.is_fresh(
+                        config_setting('SERVER_STATUS_MAX_AGE')):
+                    json_reply, message = status.get_avaliability()
+                else:
+                    json_reply, message = util.check_server_avaliability(
+                        server, dbKey)
                 server_available = (json_reply is not None)
 
+            if server_available and not auto_server and not server.reserve():
+                server_available = False
+                message = 'Server is already in use'
+
             if server_available:
                 skip_veto = 'preset' in form.data['series_type']
                 try:
@@ -272,7 +306,7 @@ def match_create():
                     max_maps, skip_veto,
                     form.data['match_title'], form.data['veto_mappool'],
                     season_id, form.data['side_type'],
-                    form.data['veto_first'], form.data['server_id'],
+                    form.data['veto_first'], server.id,
                     team1_series_score, team2_series_score, specList,
                     form.data['private_match'], form.data['enforce_teams'], 
                     form.data['min_player_ready'])
@@ -283,8 +317,10 @@ def match_create():
                 else:
                     match.plugin_version = 'unknown'
 
-                server.in_use = True
-
+                db.session.flush()
+                jobs.enqueue('load_match', match, server,
+                             {'config_url': match.get_config_url()}, g.user,
+                             'match/{}/load'.format(match.id))
                 db.session.commit()
 
                 # Implement normalized spectator list.
@@ -295,10 +331,7 @@ def match_create():
                 app.logger.info('User {} created match {}, assigned to server {}'
                                 .format(g.user.id, match.id, server.id))
 
-                if mock or match.send_to_server():
-                    return redirect('/mymatches')
-                else:
-                    flash('Failed to load match configs on server')
+                return redirect('/mymatches')
             else:
                 flash(message)
 
@@ -339,14 +372,11 @@ def match_forfeit(matchid, teamwinner):
     server = GameServer.query.get(match.server_id)
     if server:
         server.in_use = False
+        jobs.enqueue_rcon(match, server, 'get5_endmatch', g.user,
+                          'match/{}/end'.format(match.id))
 
     db.session.commit()
 
-    try:
-        server.send_rcon_command('get5_endmatch', raise_errors=True)
-    except util.RconError as e:
-        flash('Failed to cancel match: ' + str(e))
-
     return redirect('/mymatches')
 
 @match_blueprint.route('/match/<int:matchid>')
@@ -364,99 +394,87 @@ def match(matchid):
     check_private_or_public(match, team1, team2)
 
     map_stat_list = match.map_stats.all()
+    steamprofiles.prefetch(r.steam_id for r in PlayerStats.query.filter(
+        PlayerStats.match_id == match.id).with_entities(PlayerStats.steam_id))
     completed = match.winner
-    try:
-        if server is not None and (completed is None and match.cancelled == 0):
-            password = server.receive_rcon_value('sv_password')
-            connect_string = str("steam://connect/") + str(server.ip_string) + str(":") + \
-                str(server.port) + str("/") + str(password)
-            gotv_port = server.receive_rcon_value('tv_port')
-            gotv_string = str("steam://connect/") + str(server.ip_string) + str(":") + \
-                str(gotv_port)
-        else:
-            connect_string = None
-            gotv_string = None
-    except util.RconError as e:
-        connect_string = None
-        gotv_string = None
-        app.logger.info('Attempted to connect to server {}, but it is offline'
-                        .format(server.ip_string))
+    connect_info = None
+    connect_string = None
+    gotv_string = None
+    if server is not None and (completed is None and match.cancelled == 0):
+        # Read from the cache, the server is only asked in the background.
+        connect_info = serverinfo.get_connect_info(server)
+        if connect_info is not None:
+            connect_string = connect_info.connect_string(server)
+            gotv_string = connect_info.gotv_string(server)
 
     is_match_owner = False
     is_server_op = False
     has_admin_access = False
     has_super_admin_access = False
+    queued_jobs = []
     if g.user:
         is_match_owner = (g.user.id == match.user_id)
         has_admin_access = (config_setting(
             'ADMINS_ACCESS_ALL_MATCHES') and g.user.admin)
         has_super_admin_access = g.user.super_admin
         is_server_op = util.is_server_owner(g.user, server)
+        if is_match_owner or has_admin_access or has_super_admin_access or is_server_op:
+            queued_jobs = Job.get_unfinished(match.id)
     return render_template(
         'match.html', user=g.user, admin_access=has_admin_access,
         match=match, team1=team1, team2=team2,
         map_stat_list=map_stat_list, completed=completed, connect_string=connect_string,
-        gotv_string=gotv_string, super_admin_access=has_super_admin_access, vetoes=vetoes,
-        server_owner=is_server_op, match_owner=is_match_owner)
+        gotv_string=gotv_string, connect_info=connect_info,
+        super_admin_access=has_super_admin_access, vetoes=vetoes,
+        server_owner=is_server_op, match_owner=is_match_owner,
+        queued_jobs=queued_jobs, action_key=uuid.uuid4().hex)
 
 
 @match_blueprint.route('/match/<int:matchid>/scoreboard')
 def match_scoreboard(matchid):
-    def merge(a, b):
-        if isinstance(b, dict) and isinstance(a, dict):
-            a_and_b = a.viewkeys() & b.viewkeys()
-            every_key = a.viewkeys() | b.viewkeys()
-            return {k: merge(a[k], b[k]) if k in a_and_b else
-                    deepcopy(a[k] if k in a else b[k]) for k in every_key}
-        return deepcopy(b)
+    entry = scoreboard.get_scoreboard(matchid)
+    if entry is None:
+        abort(404)
+    if entry['private']:
+        match = Match.query.get_or_404(matchid)
+        team1 = Team.query.get_or_404(match.team1_id)
+        team2 = Team.query.get_or_404(match.team2_id)
+        check_private_or_public(match, team1, team2)
 
+    response = app.response_class(entry['body'], mimetype='application/json')
+    response.set_etag(entry['etag'])
+    return response.make_conditional(request)
+
+
+@match_blueprint.route('/match/<int:matchid>/events')
+def match_events(matchid):
+    # Live updates as Server-Sent Events, see events.py. Fetch the
+    # scoreboard first, the events only say what changed.
     match = Match.query.get_or_404(matchid)
     team1 = Team.query.get_or_404(match.team1_id)
     team2 = Team.query.get_or_404(match.team2_id)
     check_private_or_public(match, team1, team2)
-    map_num = 0
-    map_stat_list = match.map_stats.all()
-    player_dict = {}
-    matches = OrderedDict()
-    match_num = 0
-    sorted_player_dict = OrderedDict()
-    for map_stats in map_stat_list:
-        for player in map_stats.player_stats:
-            player_dict = merge(
-                player_dict, player.get_ind_scoreboard(map_stats.map_number))
-        # Sort teams based on kills.
-        sorted_player_dict[team1.name] = OrderedDict(
-            sorted(player_dict[team1.name].items(), key=lambda x: x[1].get('kills'), reverse=True))
-        sorted_player_dict[team2.name] = OrderedDict(
-            sorted(player_dict[team2.name].items(), key=lambda x: x[1].get('kills'), reverse=True))
-
-        t1score = map_stats.team1_score
-        t2score = map_stats.team2_score
-        curMap = map_stats.map_name
-        sorted_player_dict[team1.name]['TeamName'] = team1.name
-        sorted_player_dict[team2.name]['TeamName'] = team2.name
-        sorted_player_dict[team1.name]['TeamScore'] = t1score
-        sorted_player_dict[team2.name]['TeamScore'] = t2score
-        sorted_player_dict['map'] = curMap
-        matches['map_' + str(match_num)] = sorted_player_dict
-        match_num += 1
-        sorted_player_dict = OrderedDict()
-        player_dict = {}
 
-    response = app.response_class(
-        json.dumps(matches, sort_keys=False),
-        mimetype='application/json')
+    last_id = request.headers.get('Last-Event-ID')
+    if last_id is not None:
+        last_id = util.as_int(last_id)
+    response = app.response_class(events.stream(matchid, last_id),
+                                  mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stops nginx from holding events back.
+    response.headers['X-Accel-Buffering'] = 'no'
     return response
 
 
 @match_blueprint.route('/match/<int:matchid>/config')
 def match_config(matchid):
-    match = Match.query.get_or_404(matchid)
-    dict = match.build_match_dict()
-    response = app.response_class(
-        json.dumps(dict, sort_keys=False),
-        mimetype='application/json')
-    return response
+    config = matchconfig.get_config(matchid, request.url_root)
+    if config is None:
+        abort(404)
+    etag, body = config
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response.make_conditional(request)
 
 
 @match_blueprint.route('/match/<int:matchid>/cancel')
@@ -469,14 +487,15 @@ def match_cancel(matchid):
     server = GameServer.query.get(match.server_id)
     if server:
         server.in_use = False
+        jobs.enqueue_rcon(match, server, 'get5_endmatch', g.user,
+                          'match/{}/end'.format(match.id))
 
+    # Drop this match from its players' season totals.
+    if match.season_id is not None:
+        PlayerCareer.rebuild([r.steam_id for r in PlayerStats.query.filter(
+            PlayerStats.match_id == match.id).with_entities(PlayerStats.steam_id)])
     db.session.commit()
 
-    try:
-        server.send_rcon_command('get5_endmatch', raise_errors=True)
-    except util.RconError as e:
-        flash('Failed to cancel match: ' + str(e))
-
     return redirect('/mymatches')
 
 
@@ -518,11 +537,9 @@ def match_pause(matchid):
     admintools_check(match)
     server = GameServer.query.get_or_404(match.server_id)
 
-    try:
-        server.send_rcon_command('sm_pause', raise_errors=True)
-        flash('Paused match')
-    except util.RconError as e:
-        flash('Failed to send pause command: ' + str(e))
+    jobs.enqueue_rcon(match, server, 'sm_pause', g.user, job_key(match, 'pause'))
+    db.session.commit()
+    flash('Pausing match')
 
     return redirect('/match/{}'.format(matchid))
 
@@ -533,11 +550,9 @@ def match_unpause(matchid):
     admintools_check(match)
     server = GameServer.query.get_or_404(match.server_id)
 
-    try:
-        server.send_rcon_command('sm_unpause', raise_errors=True)
-        flash('Unpaused match')
-    except util.RconError as e:
-        flash('Failed to send unpause command: ' + str(e))
+    jobs.enqueue_rcon(match, server, 'sm_unpause', g.user, job_key(match, 'unpause'))
+    db.session.commit()
+    flash('Unpausing match')
 
     return redirect('/match/{}'.format(matchid))
 
@@ -555,16 +570,13 @@ def match_adduser(matchid):
     auth = request.values.get('auth')
     suc, new_auth = steamid.auth_to_steam64(auth)
     if suc:
-        try:
-            command = 'get5_addplayer {} {}'.format(new_auth, team)
-            response = server.send_rcon_command(command, raise_errors=True)
-            match_audit.create(g.user.id, matchid, datetime.now(), command)
-            if (team == "spec"):
-                MatchSpectator.set_or_create(matchid, new_auth)
-            db.session.commit()
-            flash(response)
-        except util.RconError as e:
-            flash('Failed to send command: ' + str(e))
+        command = 'get5_addplayer {} {}'.format(new_auth, team)
+        jobs.enqueue_rcon(match, server, command, g.user, job_key(match, 'adduser'))
+        match_audit.create(g.user.id, matchid, datetime.now(), command)
+        if (team == "spec"):
+            MatchSpectator.set_or_create(matchid, new_auth)
+        db.session.commit()
+        flash('Adding player {}'.format(new_auth))
 
     else:
         flash('Invalid steamid: {}'.format(auth))
@@ -589,26 +601,45 @@ def match_backup(matchid):
             backup_files = []
 
         return render_template('match_backup.html', user=g.user,
-                               match=match, backup_files=backup_files)
+                               match=match, backup_files=backup_files,
+                               action_key=uuid.uuid4().hex)
 
     else:
         # Restore the backup file
         command = 'get5_loadbackup {}'.format(file)
-        response = server.send_rcon_command(command)
-
-        if response:
-            flash('Restored backup file {}'.format(file))
-        else:
-            flash('Failed to restore backup file {}'.format(file))
-            return redirect('/match/{}/backup'.format(matchid))
+        jobs.enqueue_rcon(match, server, command, g.user,
+                          job_key(match, 'backup'), expect_response=True)
+        db.session.commit()
+        flash('Restoring backup file {}'.format(file))
 
         return redirect('/match/{}'.format(matchid))
 
 
+def match_to_dict(match):
+    def format_time(value):
+        return value.isoformat() if value is not None else None
+
+    team1_score, team2_score = match.get_current_score()
+    return {
+        'id': match.id,
+        'team1': {'id': match.team1_id, 'name': match.team1.name if match.team1 else None},
+        'team2': {'id': match.team2_id, 'name': match.team2.name if match.team2 else None},
+        'team1_score': team1_score,
+        'team2_score': team2_score,
+        'status': match.get_status_string(),
+        'season_id': match.season_id,
+        'start_time': format_time(match.start_time),
+        'end_time': format_time(match.end_time),
+    }
+
+
 @match_blueprint.route("/matches")
 def matches():
-    matches = Match.query.order_by(-Match.id).filter_by(
-        cancelled=False)
+    matches = Match.query.filter_by(cancelled=False).options(
+        *Match.listing_options())
+    matches = pagination.paginate_request(matches, Match.id, descending=True)
+    if util.as_int(request.values.get('json'), on_fail=0):
+        return pagination.jsonify_page(matches, 'matches', match_to_dict)
     return render_template('matches.html', user=g.user, matches=matches,
                            my_matches=False, all_matches=True)
 
@@ -616,7 +647,10 @@ def matches():
 @match_blueprint.route("/matches/<int:userid>")
 def matches_user(userid):
     user = User.query.get_or_404(userid)
-    matches = user.matches.order_by(-Match.id)
+    matches = user.matches.options(*Match.listing_options())
+    matches = pagination.paginate_request(matches, Match.id, descending=True)
+    if util.as_int(request.values.get('json'), on_fail=0):
+        return pagination.jsonify_page(matches, 'matches', match_to_dict)
     is_owner = (g.user is not None) and (userid == g.user.id)
     return render_template('matches.html', user=g.user, matches=matches,
                            my_matches=is_owner, all_matches=False, match_owner=user)
@@ -639,13 +673,21 @@ def delete_cancelled_matches():
         return redirect('/login')
     user = User.query.get_or_404(g.user.id)
     matches = user.matches.filter_by(cancelled=1)
+    steam_ids = []
     for match in matches:
+        steam_ids += [r.steam_id for r in PlayerStats.query.filter_by(
+            match_id=match.id).with_entities(PlayerStats.steam_id)]
         PlayerStats.query.filter_by(match_id=match.id).delete()
         MapStats.query.filter_by(match_id=match.id).delete()
         Veto.query.filter_by(match_id=match.id).delete()
         MatchSpectator.query.filter_by(match_id=match.id).delete()
+        Job.query.filter_by(match_id=match.id).delete()
+    match_ids = [match.id for match in matches]
     matches.delete()
+    PlayerCareer.rebuild(steam_ids)
     db.session.commit()
+    for match_id in match_ids:
+        scoreboard.invalidate(match_id)
     return redirect('/matches/' + str(g.user.id))
 
 
@@ -664,7 +706,9 @@ def map_stat_to_csv(matchid, mapid):
         map_stat = match.map_stats.filter_by(
             map_number=mapid, match_id=matchid).first()
         app.logger.info("{}".format(map_stat))
-        for player in map_stat.player_stats:
+        players = map_stat.player_stats.all()
+        steamprofiles.prefetch(player.steam_id for player in players)
+        for player in players:
             csvWrite.writerow(player.statsToCSVRow())
             yield data.getvalue()
             data.seek(0)
@@ -682,6 +726,15 @@ def map_stat_to_csv(matchid, mapid):
 # Begin Helper Functions
 
 
+def job_key(match, action):
+    # The match page's links carry a key, so following one twice only
+    # queues the command once.
+    key = request.values.get('key')
+    if not key:
+        return None
+    return 'match/{}/{}/{}'.format(match.id, action, key[:64])
+
+
 def super_admintools_check(match):
     if not g.user:
         raise BadRequestError('You do not have access to this page')
@@ -1,8 +1,13 @@
 import unittest
+import datetime
+import json
 
 import get5_test
+from get5 import db
 from flask import url_for
-from models import User, Match, GameServer
+from models import User, Match, GameServer, MapStats
+
+import sqlalchemy
 
 
 class MatchTests(get5_test.Get5Test):
@@ -197,6 +202,69 @@ class MatchTests(get5_test.Get5Test):
         self.assertFalse(match.live())
         self.assertFalse(match.finished())
 
+    def add_matches(self, count):
+        now = datetime.datetime.utcnow()
+        for i in range(count):
+            match = Match(user_id=1, team1_id=1, team2_id=2, server_id=1,
+                          season_id=1 if i % 2 else None, max_maps=1,
+                          start_time=now, end_time=now if i % 3 else None)
+            db.session.add(match)
+            db.session.flush()
+            db.session.add(MapStats(match_id=match.id, map_number=0,
+                                    map_name='de_dust2', team1_score=i, team2_score=3))
+        db.session.commit()
+
+    def count_queries(self, url):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        sqlalchemy.event.listen(
+            db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = self.app.get(url)
+            self.assertEqual(response.status_code, 200)
+        finally:
+            sqlalchemy.event.remove(
+                db.engine, 'before_cursor_execute', before_cursor_execute)
+        return len(statements)
+
+    def test_match_list_query_count(self):
+        self.add_matches(40)
+        # Logged in as the owner, so the server column is rendered too.
+        with self.app.session_transaction() as sess:
+            sess['user_id'] = 1
+        for url in ('/matches', '/matches/1', '/season/1'):
+            self.assertEqual(self.count_queries(url + '?limit=5'),
+                             self.count_queries(url + '?limit=40'))
+
+    def test_match_list_pagination(self):
+        self.add_matches(30)
+        response = self.app.get('/matches?limit=10')
+        self.assertIn('/matches?after=22&amp;limit=10', response.data)
+        self.assertIn('/match/31"', response.data)
+        self.assertNotIn('/match/21"', response.data)
+
+        # Match 1 is the last one, so there is no next page.
+        response = self.app.get('/matches?after=11&limit=10')
+        self.assertIn('/match/10"', response.data)
+        self.assertIn('/match/1"', response.data)
+        self.assertNotIn('/match/11"', response.data)
+        self.assertNotIn('Next page', response.data)
+
+    def test_match_list_json(self):
+        self.add_matches(5)
+        data = json.loads(self.app.get('/matches?json=1&limit=4').data)
+        self.assertEqual([match['id'] for match in data['matches']], [6, 5, 4, 3])
+        self.assertEqual(data['next_cursor'], 3)
+        self.assertEqual(data['matches'][0]['team1']['name'], 'EnvyUs')
+        self.assertEqual(data['matches'][0]['team2_score'], 3)
+
+        data = json.loads(self.app.get('/matches/1?json=1&after=3').data)
+        self.assertEqual([match['id'] for match in data['matches']], [2, 1])
+        self.assertIsNone(data['next_cursor'])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,84 @@
+import get5
+import localcache
+from get5 import db
+from models import Match
+
+from collections import namedtuple
+
+import hmac
+import itertools
+import sqlalchemy
+
+# What the game server API needs to authenticate a request for a match,
+# cached so the rate limiter and the route don't both load the match. A
+# match's entry is dropped when a change to it is committed in this
+# process, and other processes notice after MATCH_AUTH_CACHE_TTL seconds.
+MAX_ENTRIES = 1024
+
+AuthContext = namedtuple('AuthContext', ['api_key', 'finalized', 'team1_id', 'team2_id'])
+
+# match_id -> AuthContext
+_cache = localcache.LocalCache(MAX_ENTRIES)
+
+
+def get(matchid):
+    # Returns the match's AuthContext, or None if there's no such match.
+    context = _cache.get(matchid)
+    if context is not None:
+        return context
+
+    row = db.session.query(
+        Match.api_key, Match.cancelled, Match.end_time, Match.team1_id,
+        Match.team2_id).filter(Match.id == matchid).first()
+    if row is None:
+        return None
+    context = AuthContext(
+        api_key=row.api_key,
+        finalized=bool(row.cancelled or row.end_time is not None),
+        team1_id=row.team1_id,
+        team2_id=row.team2_id)
+    _cache.set(matchid, context, get5.config_setting('MATCH_AUTH_CACHE_TTL'))
+    return context
+
+
+def check_key(context, key):
+    # Compares in constant time, so the key can't be guessed a character at
+    # a time from how long the check takes.
+    if context is None or not context.api_key or not key:
+        return False
+    return hmac.compare_digest(_to_bytes(context.api_key), _to_bytes(key))
+
+
+def _to_bytes(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def invalidate(match_ids):
+    _cache.delete_many(match_ids)
+
+
+def clear():
+    _cache.clear()
+
+
+# The Match columns an AuthContext is made from.
+_COLUMNS = ['api_key', 'cancelled', 'end_time', 'team1_id', 'team2_id']
+
+
+def _changes_context(obj):
+    state = sqlalchemy.inspect(obj)
+    return any(state.attrs[column].history.has_changes() for column in _COLUMNS)
+
+
+def _flushed(session):
+    # Finishing or cancelling a match changes whether it takes updates. The
+    # history is only there until the flush, so it's checked then.
+    match_ids = set(obj.id for obj in itertools.chain(session.new, session.dirty)
+                    if isinstance(obj, Match) and _changes_context(obj))
+    match_ids.update(obj.id for obj in session.deleted if isinstance(obj, Match))
+    return match_ids
+
+
+localcache.invalidate_on_commit(_flushed, invalidate)
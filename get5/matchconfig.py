@@ -0,0 +1,67 @@
+import get5
+import localcache
+from models import Match, Team
+
+from flask import json
+
+import hashlib
+import itertools
+
+# Game servers fetch /match/<id>/config on every map change and restart, so
+# the serialized config is kept in memory until the match or one of its
+# teams changes. Changes made by other processes are only noticed when an
+# entry expires, after MATCH_CONFIG_CACHE_TTL seconds.
+MAX_ENTRIES = 512
+
+# (match_id, url_root) -> (etag, body, team_ids)
+_cache = localcache.LocalCache(MAX_ENTRIES)
+
+
+def get_config(matchid, url_root):
+    # Returns (etag, body) for the match's config, or None if there's no such
+    # match. url_root is part of the key as the config points the server
+    # back at the host it was fetched from.
+    key = (matchid, url_root)
+    entry = _cache.get(key)
+    if entry is not None:
+        return entry[0], entry[1]
+
+    match = Match.query.get(matchid)
+    if match is None:
+        return None
+    body = json.dumps(match.build_match_dict(), sort_keys=False)
+    if isinstance(body, unicode):
+        body = body.encode('utf-8')
+    etag = hashlib.sha1(body).hexdigest()
+    _cache.set(key, (etag, body, (match.team1_id, match.team2_id)),
+               get5.config_setting('MATCH_CONFIG_CACHE_TTL'))
+    return etag, body
+
+
+def invalidate(match_ids=(), team_ids=()):
+    match_ids = set(match_ids)
+    team_ids = set(team_ids)
+    _cache.delete_if(
+        lambda key, entry: key[0] in match_ids or team_ids.intersection(entry[2]))
+
+
+def clear():
+    _cache.clear()
+
+
+def _flushed(session):
+    changed = set()
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Match):
+            changed.add(('match', obj.id))
+        elif isinstance(obj, Team):
+            changed.add(('team', obj.id))
+    return changed
+
+
+def _invalidate_committed(changed):
+    invalidate([obj_id for kind, obj_id in changed if kind == 'match'],
+               [obj_id for kind, obj_id in changed if kind == 'team'])
+
+
+localcache.invalidate_on_commit(_flushed, _invalidate_committed)
@@ -0,0 +1,101 @@
+import unittest
+
+import get5
+import get5_test
+import matchconfig
+from get5 import db
+from models import Match, Team
+
+import json
+
+
+class MatchConfigTests(get5_test.Get5Test):
+
+    def setUp(self):
+        super(MatchConfigTests, self).setUp()
+        matchconfig.clear()
+        self.builds = 0
+        build_match_dict = Match.build_match_dict
+
+        def counting_build_match_dict(match):
+            self.builds += 1
+            return build_match_dict(match)
+        Match.build_match_dict = counting_build_match_dict
+        self.addCleanup(setattr, Match, 'build_match_dict', build_match_dict)
+
+    def test_repeated_fetches(self):
+        response = self.app.get('/match/1/config')
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertEqual(json.loads(response.data)['matchid'], '1')
+
+        response = self.app.get('/match/1/config')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], etag)
+
+        response = self.app.get('/match/1/config', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, '')
+        self.assertEqual(self.builds, 1)
+
+    def test_missing_match(self):
+        self.assertEqual(self.app.get('/match/100/config').status_code, 404)
+
+    def test_match_change_invalidates(self):
+        etag = self.app.get('/match/1/config').headers['ETag']
+        match = Match.query.get(1)
+        match.title = 'Grand final, map {MAPNUMBER}'
+        db.session.commit()
+
+        response = self.app.get('/match/1/config', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['match_title'],
+                         'Grand final, map {MAPNUMBER}')
+        self.assertEqual(self.builds, 2)
+
+    def test_team_change_invalidates(self):
+        self.app.get('/match/1/config')
+        team = Team.query.get(Match.query.get(1).team2_id)
+        team.name = 'Renamed'
+        db.session.commit()
+
+        data = json.loads(self.app.get('/match/1/config').data)
+        self.assertEqual(data['team2']['name'], 'Renamed')
+        self.assertEqual(self.builds, 2)
+
+    def test_invalidated_on_commit(self):
+        with get5.app.test_request_context():
+            etag = matchconfig.get_config(1, 'http://localhost/')[0]
+            match = Match.query.get(1)
+            match.title = 'Grand final, map {MAPNUMBER}'
+            db.session.flush()
+            # Other requests can't see the change yet.
+            self.assertEqual(matchconfig.get_config(1, 'http://localhost/')[0], etag)
+            db.session.rollback()
+            self.assertEqual(matchconfig.get_config(1, 'http://localhost/')[0], etag)
+            self.assertEqual(self.builds, 1)
+
+            match = Match.query.get(1)
+            match.title = 'Grand final, map {MAPNUMBER}'
+            db.session.commit()
+            self.assertNotEqual(matchconfig.get_config(1, 'http://localhost/')[0], etag)
+            self.assertEqual(self.builds, 2)
+
+    def test_spectator_ids_not_modified(self):
+        self.addCleanup(get5.app.config.__setitem__, 'SPECTATOR_IDS',
+                        get5.app.config.get('SPECTATOR_IDS', []))
+        get5.app.config['SPECTATOR_IDS'] = ['76561198000000001']
+        match = Match.query.get(1)
+        match.spectator_auths = ['76561198000000002']
+        db.session.commit()
+
+        for _ in range(2):
+            matchconfig.clear()
+            data = json.loads(self.app.get('/match/1/config').data)
+            self.assertEqual(data['spectators']['players'],
+                             ['76561198000000001', '76561198000000002'])
+        self.assertEqual(get5.app.config['SPECTATOR_IDS'], ['76561198000000001'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,18 @@
-from get5 import app, db, cache
+from get5 import app, db
 import countries
 import logos
+import steamprofiles
 import util
 
 from flask import url_for, Markup
 from collections import OrderedDict
-import requests
 
 import datetime
 import string
 import random
 import json
 import re
+import sqlalchemy
 
 dbKey = app.config['DATABASE_KEY']
 
@@ -34,6 +35,7 @@ class User(db.Model):
             rv = User()
             rv.steam_id = steam_id
             db.session.add(rv)
+            MetricCounter.increment('users_registered')
             app.logger.info('Creating user for {}'.format(steam_id))
 
         rv.admin = ('ADMIN_IDS' in app.config) and (
@@ -76,16 +78,38 @@ class GameServer(db.Model):
         rv.rcon_password = rcon_password
         rv.public_server = public_server
         db.session.add(rv)
+        MetricCounter.increment('servers_added')
         return rv
 
-    def send_rcon_command(self, command, raise_errors=False, num_retries=3, timeout=3.0):
+    def reserve(self):
+        # Marks the server in use if it's free, in one compare-and-set UPDATE,
+        # so two matches can't both be given it. Returns whether it was free.
+        reserved = GameServer.query.filter(
+            GameServer.id == self.id,
+            db.or_(GameServer.in_use == False,  # noqa: E712
+                   GameServer.in_use == None)).update(  # noqa: E711
+            {GameServer.in_use: True}, synchronize_session=False)
+        db.session.expire(self, ['in_use'])
+        return reserved > 0
+
+    def get_rcon_password(self):
         encRcon = util.decrypt(dbKey, self.rcon_password)
         if encRcon is None:
             encRcon = self.rcon_password
+        return encRcon
+
+    def send_rcon_command(self, command, raise_errors=False, num_retries=3, timeout=3.0):
         return util.send_rcon_command(
-            self.ip_string, self.port, encRcon,
+            self.ip_string, self.port, self.get_rcon_password(),
             command, raise_errors, num_retries, timeout)
 
+    def send_rcon_batch(self, commands, raise_errors=False, num_retries=3, timeout=3.0):
+        # Sends all the commands in one round trip, returning their responses
+        # in order, or None if the server couldn't be reached.
+        return util.send_rcon_commands(
+            self.ip_string, self.port, self.get_rcon_password(),
+            commands, raise_errors, num_retries, timeout)
+
     def get_hostport(self):
         return '{}:{}'.format(self.ip_string, self.port)
 
@@ -96,27 +120,93 @@ class GameServer(db.Model):
             return self.get_hostport()
 
     def receive_rcon_value(self, command):
+        return self.receive_rcon_values([command])[0]
+
+    def receive_rcon_values(self, commands):
+        # Reads several cvars in one round trip, with None for any that
+        # couldn't be read.
         try:
-            response = self.send_rcon_command(command, raise_errors=False)
-            if response is not None:
-                pattern = r'"([A-Za-z0-9_\./\\-]*)"'
-                value = re.split(pattern, Markup(
-                    response.replace('\n', '<br>')))
-            else:
-                return None
+            responses = self.send_rcon_batch(commands, raise_errors=False)
+        except Exception as e:
+            app.logger.info(
+                "Tried to receive value from server but failed.\n{}".format(e))
+            responses = None
+        if responses is None:
+            return [None] * len(commands)
+        return [self.parse_rcon_value(response) for response in responses]
+
+    @staticmethod
+    def parse_rcon_value(response):
+        try:
+            pattern = r'"([A-Za-z0-9_\./\\-]*)"'
+            value = re.split(pattern, Markup(
+                response.replace('\n', '<br>')))
+            # Not sure how stable this will be, but send off for the third
+            # value of the string split. Most values returned have format
+            # "sv_password" = "test" (def. "")
+            return value[3]
         except Exception as e:
             app.logger.info(
                 "Tried to receive value from server but failed.\n{}".format(e))
             return None
-        # Not sure how stable this will be, but send off for the third
-        # value of the string split. Most values returned have format
-        # "sv_password" = "test" (def. "")
-        return value[3]
 
     def __repr__(self):
         return 'GameServer({})'.format(self.get_hostport())
 
 
+class ServerStatus(db.Model):
+    # Written by serverpoller, which checks every server in the background.
+    server_id = db.Column(db.Integer, db.ForeignKey('game_server.id'), primary_key=True)
+    online = db.Column(db.Boolean, default=False)
+    latency_ms = db.Column(db.Integer)
+    plugin_version = db.Column(db.String(32))
+    gamestate = db.Column(db.Integer)
+    # Why the server can't take a match, if it can't.
+    error = db.Column(db.String(128))
+    last_checked = db.Column(db.DateTime)
+    last_online = db.Column(db.DateTime)
+    # Checks failed in a row, and when the server is due to be checked again.
+    failures = db.Column(db.Integer, default=0)
+    next_check = db.Column(db.DateTime, index=True)
+
+    @staticmethod
+    def get_for(server_ids):
+        # server_id -> ServerStatus for the servers that have been checked.
+        server_ids = list(server_ids)
+        if not server_ids:
+            return {}
+        return dict((status.server_id, status) for status in
+                    ServerStatus.query.filter(ServerStatus.server_id.in_(server_ids)))
+
+    def is_fresh(self, max_age):
+        oldest = datetime.datetime.utcnow() - datetime.timedelta(seconds=max_age)
+        return self.last_checked is not None and self.last_checked >= oldest
+
+    def get_avaliability(self):
+        # The same (json_reply, message) as util.check_server_avaliability,
+        # from the last check.
+        if not self.online:
+            return None, 'Failed to connect to server'
+        elif self.error:
+            return None, self.error
+        elif self.gamestate != 0:
+            return None, 'Server already has a get5 match setup'
+        return {'plugin_version': self.plugin_version, 'gamestate': self.gamestate}, ''
+
+    def get_status_string(self):
+        if not self.online:
+            return 'Offline'
+        elif self.error:
+            return 'Online, {}'.format(self.error)
+        elif self.gamestate != 0:
+            return 'Online, match loaded'
+        return 'Online'
+
+    def __repr__(self):
+        return 'ServerStatus(server_id={}, online={}, latency_ms={}, gamestate={})'.format(
+            self.server_id, self.online, self.latency_ms, self.gamestate)
+
+
 class Team(db.Model):
     MAXPLAYERS = 7
 
@@ -137,6 +227,7 @@ class Team(db.Model):
         rv.set_data(name, tag, flag, logo, auths,
                     (public_team and user.admin), preferred_names)
         db.session.add(rv)
+        MetricCounter.increment('teams_created')
         return rv
 
     def set_data(self, name, tag, flag, logo, auths, public_team, preferred_names=None):
@@ -159,9 +250,10 @@ class Team(db.Model):
 
     def get_players(self):
         results = []
+        names = steamprofiles.get_names(self.auths)
         for steam64 in self.auths:
             if steam64:
-                name = get_steam_name(steam64)
+                name = names.get(str(steam64))
                 if not name:
                     name = ''
 
@@ -262,6 +354,10 @@ class Team(db.Model):
             self.id, self.user_id, self.name, self.flag, self.logo, self.public_team)
 
 class TeamAuthNames(db.Model):
+    __table_args__ = (
+        db.Index('ix_team_auth_names_team_id_auth', 'team_id', 'auth', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     team_id = db.Column(db.Integer, db.ForeignKey('team.id'))
     auth = db.Column(db.String(17))
@@ -366,6 +462,11 @@ class match_audit(db.Model):
 
 
 class Match(db.Model):
+    __table_args__ = (
+        db.Index('ix_match_season_id_cancelled', 'season_id', 'cancelled'),
+        db.Index('ix_match_user_id_cancelled', 'user_id', 'cancelled'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     server_id = db.Column(db.Integer, db.ForeignKey(
@@ -391,6 +492,14 @@ class Match(db.Model):
     veto_mappool = db.Column(db.String(500))
     map_stats = db.relationship('MapStats', backref='match', lazy='dynamic')
 
+    # Plain relationships so listings can eager load everything they show,
+    # see Match.listing_options().
+    team1 = db.relationship('Team', foreign_keys=[team1_id])
+    team2 = db.relationship('Team', foreign_keys=[team2_id])
+    server = db.relationship('GameServer', foreign_keys=[server_id])
+    maps = db.relationship('MapStats', order_by='MapStats.map_number',
+                           viewonly=True)
+
     side_type = db.Column(db.String(32))
     team1_score = db.Column(db.Integer, default=0)
     team2_score = db.Column(db.Integer, default=0)
@@ -432,6 +541,7 @@ class Match(db.Model):
         rv.enforce_teams = enforce_teams
         rv.min_player_ready = min_player_ready
         db.session.add(rv)
+        MetricCounter.increment('matches_created')
         return rv
 
     def get_status_string(self, show_winner=True):
@@ -501,39 +611,53 @@ class Match(db.Model):
     def get_season_id(self):
         return self.season_id
 
+    @staticmethod
+    def listing_options():
+        # Loads everything matches.html reads in the same query (or one
+        # extra one for the map stats), however many matches are shown.
+        return (db.joinedload(Match.team1), db.joinedload(Match.team2),
+                db.joinedload(Match.server), db.joinedload(Match.user),
+                db.joinedload(Match.season), db.selectinload(Match.maps))
+
     def get_current_score(self):
         if self.max_maps == 1:
-            mapstat = self.map_stats.first()
-            if not mapstat:
+            if not self.maps:
                 return (0, 0)
             else:
+                mapstat = self.maps[0]
                 return (mapstat.team1_score, mapstat.team2_score)
 
         else:
             return (self.team1_score, self.team2_score)
 
-    def send_to_server(self):
-        server = GameServer.query.get(self.server_id)
-        if not server:
-            return False
-
+    def get_config_url(self):
+        # Needs a request context, so jobs that load the match are given this
+        # when they're queued.
         url = url_for('match.match_config', matchid=self.id,
                       _external=True, _scheme='http')
         # Remove http protocal since the get5 plugin can't parse args with the
         # : in them.
         url = url.replace("http://", "")
         url = url.replace("https://", "")
+        return url
 
-        loadmatch_response = server.send_rcon_command(
-            'get5_loadmatch_url ' + url)
-
-        server.send_rcon_command(
-            'get5_web_api_key ' + self.api_key)
+    def send_to_server(self, config_url=None, raise_errors=False, num_retries=3):
+        server = GameServer.query.get(self.server_id)
+        if not server:
+            return False
 
-        # ***HACK FIX TO ENSURE CHECK_AUTHS WORKS AS INTENDED***
-        server.send_rcon_command('map de_dust2')
+        url = config_url or self.get_config_url()
+        responses = server.send_rcon_batch([
+            'get5_loadmatch_url ' + url,
+            'get5_web_api_key ' + self.api_key,
+            # ***HACK FIX TO ENSURE CHECK_AUTHS WORKS AS INTENDED***
+            'map de_dust2',
+        ], raise_errors, num_retries)
+        if responses is None:
+            # Couldn't reach the server.
+            return False
 
-        if loadmatch_response:  # There should be no response
+        if responses[0]:  # There should be no response
             return False
 
         return True
@@ -625,7 +749,7 @@ class Match(db.Model):
 
         # Perm spectators will go within config, then can add more from match
         # screen.
-        d['spectators'] = {"players": app.config['SPECTATOR_IDS']}
+        d['spectators'] = {"players": list(app.config['SPECTATOR_IDS'])}
 
         # If we don't have any perm spectators, create the new list.
         if not d['spectators']:
@@ -670,6 +794,10 @@ class MatchSpectator(db.Model):
         self.auth = auth
 
 class MapStats(db.Model):
+    __table_args__ = (
+        db.Index('ix_map_stats_match_id_map_number', 'match_id', 'map_number'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     match_id = db.Column(db.Integer, db.ForeignKey('match.id'))
     map_number = db.Column(db.Integer)
@@ -682,6 +810,11 @@ class MapStats(db.Model):
     player_stats = db.relationship(
         'PlayerStats', backref='mapstats', lazy='dynamic')
     demoFile = db.Column(db.String(256))
+    # Number of PlayerStats rows for this map, kept by PlayerStats.get_or_create
+    # so the player cap doesn't need to count them.
+    player_count = db.Column(db.Integer, default=0, server_default='0')
+
+    MAX_PLAYERS = 40
 
     @staticmethod
     def get_or_create(match_id, map_number, map_name='', demoFile=None):
@@ -700,19 +833,41 @@ class MapStats(db.Model):
             rv.team1_score = 0
             rv.team2_score = 0
             rv.demoFile = demoFile
+            rv.player_count = 0
             db.session.add(rv)
         return rv
 
+    def reserve_player_slot(self):
+        # Atomically counts one more player towards the cap, returns False if
+        # the map is already full.
+        if self.id is None:
+            db.session.flush()
+        reserved = MapStats.query.filter(
+            MapStats.id == self.id,
+            db.func.coalesce(MapStats.player_count, 0) < MapStats.MAX_PLAYERS).update(
+            {MapStats.player_count: db.func.coalesce(MapStats.player_count, 0) + 1},
+            synchronize_session=False)
+        return reserved > 0
+
+    def release_player_slot(self):
+        MapStats.query.filter(MapStats.id == self.id).update(
+            {MapStats.player_count: MapStats.player_count - 1},
+            synchronize_session=False)
+
     def __repr__(self):
         return 'MapStats(' + str(self.id) + ',' + str(self.map_name) + ')'
 
 
 class PlayerStats(db.Model):
+    __table_args__ = (
+        db.Index('ix_player_stats_map_id_steam_id', 'map_id', 'steam_id', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    match_id = db.Column(db.Integer, db.ForeignKey('match.id'))
+    match_id = db.Column(db.Integer, db.ForeignKey('match.id'), index=True)
     map_id = db.Column(db.Integer, db.ForeignKey('map_stats.id'))
     team_id = db.Column(db.Integer, db.ForeignKey('team.id'))
-    steam_id = db.Column(db.String(40))
+    steam_id = db.Column(db.String(40), index=True)
     name = db.Column(db.String(40))
     kills = db.Column(db.Integer, default=0)
     deaths = db.Column(db.Integer, default=0)
@@ -749,11 +904,15 @@ class PlayerStats(db.Model):
     def get_player_name(self):
         return get_steam_name(self.steam_id)
 
+    AverageKPR = 0.679
+    AverageSPR = 0.317
+    AverageRMK = 1.277
+
     def get_rating(self):
         try:
-            AverageKPR = 0.679
-            AverageSPR = 0.317
-            AverageRMK = 1.277
+            AverageKPR = PlayerStats.AverageKPR
+            AverageSPR = PlayerStats.AverageSPR
+            AverageRMK = PlayerStats.AverageRMK
             KillRating = float(self.kills) / float(self.roundsplayed) / AverageKPR
             SurvivalRating = float(self.roundsplayed -
                                 self.deaths) / self.roundsplayed / AverageSPR
@@ -766,24 +925,57 @@ class PlayerStats(db.Model):
             return rating
         except ZeroDivisionError:
             return 0
+
+    # The *_sql methods build the same per-map values as their get_*
+    # counterparts as SQL expressions, so they can be averaged in a query.
+    @staticmethod
+    def rating_sql():
+        rounds = db.cast(PlayerStats.roundsplayed, db.Float)
+        killRating = db.cast(PlayerStats.kills, db.Float) / \
+            rounds / PlayerStats.AverageKPR
+        survivalRating = (rounds - PlayerStats.deaths) / \
+            rounds / PlayerStats.AverageSPR
+        killcount = db.cast(PlayerStats.k1 + 4 * PlayerStats.k2 + 9 * PlayerStats.k3 +
+                            16 * PlayerStats.k4 + 25 * PlayerStats.k5, db.Float)
+        roundsWithMultipleKillsRating = killcount / rounds / PlayerStats.AverageRMK
+        return db.case([(PlayerStats.roundsplayed == 0, 0.0)],
+                       else_=(killRating + 0.7 * survivalRating +
+                              roundsWithMultipleKillsRating) / 2.7)
+
     def get_kdr(self):
         if self.deaths == 0:
             return float(self.kills)
         else:
             return float(self.kills) / self.deaths
 
+    @staticmethod
+    def kdr_sql():
+        kills = db.cast(PlayerStats.kills, db.Float)
+        return db.case([(PlayerStats.deaths == 0, kills)],
+                       else_=kills / PlayerStats.deaths)
+
     def get_hsp(self):
         if self.kills == 0:
             return 0.0
         else:
             return float(self.headshot_kills) / self.kills
 
+    @staticmethod
+    def hsp_sql():
+        return db.case([(PlayerStats.kills == 0, 0.0)],
+                       else_=db.cast(PlayerStats.headshot_kills, db.Float) / PlayerStats.kills)
+
     def get_adr(self):
         if self.roundsplayed == 0:
             return 0.0
         else:
             return float(self.damage) / self.roundsplayed
 
+    @staticmethod
+    def adr_sql():
+        return db.case([(PlayerStats.roundsplayed == 0, 0.0)],
+                       else_=db.cast(PlayerStats.damage, db.Float) / PlayerStats.roundsplayed)
+
     def get_fpr(self):
         if self.roundsplayed == 0:
             return 0.0
@@ -793,50 +985,84 @@ class PlayerStats(db.Model):
     """ Custom made individual scoreboard to work with VMIX and an Excel file.
         The values will be automagically updated and put straight into a broadcast (neat!)"""
 
-    def get_ind_scoreboard(self, map_number):
-        d = {}
-        map_stats = MapStats.query.filter_by(
-            match_id=self.match_id, map_number=map_number).first()
-        team = Team.query.get(self.team_id)
-        d['map'] = map_stats.map_name
-        d[team.name] = {}
-        d[team.name][self.steam_id] = {}
-        d[team.name][self.steam_id]['Player'] = get_steam_name(self.steam_id)
-        d[team.name][self.steam_id]['kills'] = round(float(self.kills), 1)
-        d[team.name][self.steam_id]['deaths'] = round(float(self.deaths), 1)
-        d[team.name][self.steam_id]['assists'] = round(float(self.assists), 1)
-        d[team.name][self.steam_id]['rating'] = round(
-            float(self.get_rating()), 2)
-        d[team.name][self.steam_id]['hsp'] = round(float(self.get_hsp()), 2)
-        d[team.name][self.steam_id]['firstkill'] = round(
+    def get_scoreboard_values(self):
+        # One player's entry in the match's scoreboard, see scoreboard.py.
+        d = OrderedDict()
+        d['Player'] = get_steam_name(self.steam_id)
+        d['kills'] = round(float(self.kills), 1)
+        d['deaths'] = round(float(self.deaths), 1)
+        d['assists'] = round(float(self.assists), 1)
+        d['rating'] = round(float(self.get_rating()), 2)
+        d['hsp'] = round(float(self.get_hsp()), 2)
+        d['firstkill'] = round(
             float(self.firstkill_ct + self.firstkill_t), 1)
-        d[team.name][self.steam_id]['k2'] = round(float(self.k2), 1)
-        d[team.name][self.steam_id]['k3'] = round(float(self.k3), 1)
-        d[team.name][self.steam_id]['k4'] = round(float(self.k4), 1)
-        d[team.name][self.steam_id]['k5'] = round(float(self.k5), 1)
-        d[team.name][self.steam_id]['ADR'] = round(float(self.get_adr()), 1)
+        d['k2'] = round(float(self.k2), 1)
+        d['k3'] = round(float(self.k3), 1)
+        d['k4'] = round(float(self.k4), 1)
+        d['k5'] = round(float(self.k5), 1)
+        d['ADR'] = round(float(self.get_adr()), 1)
         return d
 
     def get_deaths(self):
         return float(self.deaths)
 
     @staticmethod
-    def get_or_create(matchid, mapnumber, steam_id):
-        mapstats = MapStats.get_or_create(matchid, mapnumber)
-        if len(mapstats.player_stats.all()) >= 40:  # Cap on players per map
-            return None
-
-        rv = mapstats.player_stats.filter_by(steam_id=steam_id).first()
-
-        if rv is None:
-            rv = PlayerStats()
-            rv.match_id = matchid
-            rv.map_number = mapstats.id
-            rv.steam_id = steam_id
-            rv.map_id = mapstats.id
-            db.session.add(rv)
+    def get_or_create(matchid, mapnumber, steam_id, mapstats=None):
+        # Returns (PlayerStats or None, whether it was just created).
+        if mapstats is None:
+            mapstats = MapStats.get_or_create(matchid, mapnumber)
+        rv, created = PlayerStats.get_or_create_many(mapstats, [steam_id])
+        return rv.get(steam_id), steam_id in created
 
-        return rv
+    @staticmethod
+    def get_or_create_many(mapstats, steam_ids):
+        # Returns a dict of steam_id -> PlayerStats for one map, looking up
+        # every existing row in a single (map_id, steam_id) index lookup, and
+        # the set of steam_ids whose rows were just created. New rows are only
+        # created while the map is under its player cap.
+        steam_ids = [steam_id for steam_id in steam_ids if steam_id]
+        rv = {}
+        created = set()
+        if not steam_ids:
+            return rv, created
+        for player_stats in PlayerStats.query.filter(
+                PlayerStats.map_id == mapstats.id,
+                PlayerStats.steam_id.in_(steam_ids)):
+            rv[player_stats.steam_id] = player_stats
+
+        for steam_id in steam_ids:
+            if steam_id in rv:
+                continue
+            if not mapstats.reserve_player_slot():
+                break
+            try:
+                result = db.session.execute(PlayerStats.__table__.insert().values(
+                    match_id=mapstats.match_id, map_id=mapstats.id, steam_id=steam_id))
+            except sqlalchemy.exc.IntegrityError:
+                # Another update for the player created the row first. Only
+                # the INSERT failed, the transaction carries on. A locking
+                # read, so the row is seen even though it was committed after
+                # this transaction started.
+                mapstats.release_player_slot()
+                player_stats = PlayerStats.query.filter_by(
+                    map_id=mapstats.id, steam_id=steam_id).with_for_update().one()
+            else:
+                created.add(steam_id)
+                player_stats = PlayerStats.query.get(result.inserted_primary_key[0])
+            rv[steam_id] = player_stats
+
+        return rv, created
+
+    def get_career_values(self):
+        values = {}
+        for key in CareerStatsMixin.COUNTERS:
+            values[key] = util.as_int(getattr(self, key))
+        values['maps_played'] = 1
+        values['kdr_total'] = self.get_kdr()
+        values['adr_total'] = self.get_adr()
+        values['hsp_total'] = self.get_hsp()
+        values['rating_total'] = self.get_rating()
+        return values
 
     def statsToCSVRow(self):
         team = Team.query.get(self.team_id)
@@ -854,9 +1080,169 @@ class PlayerStats(db.Model):
         return (ourCSVText)
 
 
+class CareerStatsMixin(object):
+    COUNTERS = ('kills', 'deaths', 'assists', 'flashbang_assists',
+                'headshot_kills', 'damage', 'roundsplayed',
+                'k1', 'k2', 'k3', 'k4', 'k5', 'v1', 'v2', 'v3', 'v4', 'v5')
+    # Per-map ratios are kept as running sums, so dividing by maps_played
+    # gives the same average as taking the mean over every PlayerStats row.
+    RATIOS = ('kdr', 'adr', 'hsp', 'rating')
+
+    maps_played = db.Column(db.Integer, default=0)
+    kills = db.Column(db.Integer, default=0)
+    deaths = db.Column(db.Integer, default=0)
+    assists = db.Column(db.Integer, default=0)
+    flashbang_assists = db.Column(db.Integer, default=0)
+    headshot_kills = db.Column(db.Integer, default=0)
+    damage = db.Column(db.Integer, default=0)
+    roundsplayed = db.Column(db.Integer, default=0)
+    k1 = db.Column(db.Integer, default=0)
+    k2 = db.Column(db.Integer, default=0)
+    k3 = db.Column(db.Integer, default=0)
+    k4 = db.Column(db.Integer, default=0)
+    k5 = db.Column(db.Integer, default=0)
+    v1 = db.Column(db.Integer, default=0)
+    v2 = db.Column(db.Integer, default=0)
+    v3 = db.Column(db.Integer, default=0)
+    v4 = db.Column(db.Integer, default=0)
+    v5 = db.Column(db.Integer, default=0)
+    kdr_total = db.Column(db.Float, default=0.0)
+    adr_total = db.Column(db.Float, default=0.0)
+    hsp_total = db.Column(db.Float, default=0.0)
+    rating_total = db.Column(db.Float, default=0.0)
+
+    @staticmethod
+    def get_value_names():
+        return (('maps_played',) + CareerStatsMixin.COUNTERS +
+                tuple(ratio + '_total' for ratio in CareerStatsMixin.RATIOS))
+
+    @classmethod
+    def add_values(cls, values, **keys):
+        # Increment in SQL so concurrent updates for one player can't clobber
+        # each other, and only insert when the player has no row yet.
+        updates = {}
+        for key, value in values.items():
+            if value:
+                updates[key] = getattr(cls, key) + value
+        if not updates:
+            return
+
+        query = cls.query.filter_by(**keys)
+        if query.update(updates, synchronize_session=False) == 0:
+            row = dict(keys)
+            for key in CareerStatsMixin.get_value_names():
+                row[key] = values.get(key, 0)
+            try:
+                db.session.execute(cls.__table__.insert().values(**row))
+            except sqlalchemy.exc.IntegrityError:
+                # Another update for the player created the row first. Only
+                # the INSERT failed, the transaction carries on.
+                query.update(updates, synchronize_session=False)
+            else:
+                if cls is PlayerCareer:
+                    MetricCounter.increment('unique_players')
+
+    @classmethod
+    def rebuild_from(cls, query, key_columns):
+        totals = query.with_entities(*(key_columns + [
+            db.func.count(PlayerStats.id)] + [
+            db.func.sum(getattr(PlayerStats, key)) for key in CareerStatsMixin.COUNTERS] + [
+            db.func.sum(PlayerStats.kdr_sql()), db.func.sum(PlayerStats.adr_sql()),
+            db.func.sum(PlayerStats.hsp_sql()), db.func.sum(PlayerStats.rating_sql())]))
+        totals = totals.group_by(*key_columns)
+
+        keyNames = [column.key for column in key_columns]
+        valueNames = CareerStatsMixin.get_value_names()
+        rows = []
+        for row in totals:
+            rv = dict(zip(keyNames, row[:len(keyNames)]))
+            for key, value in zip(valueNames, row[len(keyNames):]):
+                if key.endswith('_total'):
+                    rv[key] = float(value or 0)
+                else:
+                    rv[key] = int(value or 0)
+            rows.append(rv)
+        db.session.bulk_insert_mappings(cls, rows)
+
+    def get_average(self, ratio):
+        if not self.maps_played:
+            return 0.0
+        return float(getattr(self, ratio + '_total')) / self.maps_played
+
+    def get_kdr(self):
+        return self.get_average('kdr')
+
+    def get_adr(self):
+        return self.get_average('adr')
+
+    def get_hsp(self):
+        return self.get_average('hsp')
+
+    def get_rating(self):
+        return self.get_average('rating')
+
+    def get_steam_url(self):
+        return 'http://steamcommunity.com/profiles/{}'.format(self.steam_id)
+
+
+class PlayerCareer(CareerStatsMixin, db.Model):
+    steam_id = db.Column(db.String(40), primary_key=True)
+
+    @staticmethod
+    def update_player(steam_id, season_id, old_values, new_values):
+        delta = {}
+        for key, value in new_values.items():
+            delta[key] = value - old_values.get(key, 0)
+
+        PlayerCareer.add_values(delta, steam_id=steam_id)
+        if season_id is not None:
+            PlayerSeasonCareer.add_values(
+                delta, season_id=season_id, steam_id=steam_id)
+
+    @staticmethod
+    def rebuild(steam_ids=None):
+        # Recompute the totals of the given players (or everyone) from the
+        # raw PlayerStats rows. Season totals skip cancelled matches.
+        careers = PlayerCareer.query
+        seasonCareers = PlayerSeasonCareer.query
+        stats = PlayerStats.query
+        if steam_ids is not None:
+            steam_ids = list(set(steam_ids))
+            if not steam_ids:
+                return
+            careers = careers.filter(PlayerCareer.steam_id.in_(steam_ids))
+            seasonCareers = seasonCareers.filter(
+                PlayerSeasonCareer.steam_id.in_(steam_ids))
+            stats = stats.filter(PlayerStats.steam_id.in_(steam_ids))
+        careers.delete(synchronize_session=False)
+        seasonCareers.delete(synchronize_session=False)
+
+        PlayerCareer.rebuild_from(stats, [PlayerStats.steam_id])
+        # Rebuilt rows aren't counted as they're inserted, and a player whose
+        # row was deleted would otherwise be counted again when they return.
+        MetricCounter.set('unique_players', PlayerCareer.query.count())
+        seasonStats = stats.join(Match, Match.id == PlayerStats.match_id).filter(
+            Match.season_id.isnot(None), Match.cancelled == False)  # noqa: E712
+        PlayerSeasonCareer.rebuild_from(
+            seasonStats, [Match.season_id, PlayerStats.steam_id])
+
+    def __repr__(self):
+        return 'PlayerCareer(steam_id={}, maps_played={})'.format(
+            self.steam_id, self.maps_played)
+
+
+class PlayerSeasonCareer(CareerStatsMixin, db.Model):
+    season_id = db.Column(db.Integer, db.ForeignKey('season.id'), primary_key=True)
+    steam_id = db.Column(db.String(40), primary_key=True)
+
+    def __repr__(self):
+        return 'PlayerSeasonCareer(season_id={}, steam_id={}, maps_played={})'.format(
+            self.season_id, self.steam_id, self.maps_played)
+
+
 class Veto(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    match_id = db.Column(db.Integer, db.ForeignKey('match.id'))
+    match_id = db.Column(db.Integer, db.ForeignKey('match.id'), index=True)
     team_name = db.Column(db.String(64), default='')
     map = db.Column(db.String(32), default='')
     pick_or_veto = db.Column(db.String(4), default='veto')
@@ -875,16 +1261,101 @@ class Veto(db.Model):
         return 'Veto(id={})'.format(self.id)
 
 
-@cache.memoize(timeout=60 * 60 * 24)  # 1 day timeout
-def get_steam_name(steam64):
-    url = 'http://api.steampowered.com/ISteamUser/GetPlayerSummaries/v0002/?key={}&steamids={}'
-    url = url.format(app.config['STEAM_API_KEY'], steam64)
-    response = requests.get(url)
-    if response.status_code == 200:
-        try:
-            player_list = response.json()['response']['players']
-            return player_list[0]['personaname']
-        except (KeyError, IndexError):
-            return None
+class SteamProfile(db.Model):
+    steam_id = db.Column(db.String(40), primary_key=True)
+    personaname = db.Column(db.String(128))
+    updated_at = db.Column(db.DateTime, index=True)
+
+    def __repr__(self):
+        return 'SteamProfile(steam_id={}, personaname={}, updated_at={})'.format(
+            self.steam_id, self.personaname, self.updated_at)
+
+
+class MetricCounter(db.Model):
+    # Running totals for the metrics pages, see counters.TOTALS.
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+    @staticmethod
+    def increment(name, amount=1):
+        # Runs in the current transaction, so the total only changes if the
+        # write it counts is committed.
+        updated = MetricCounter.query.filter_by(name=name).update(
+            {'value': MetricCounter.value + amount}, synchronize_session=False)
+        if updated == 0:
+            db.session.add(MetricCounter(name=name, value=amount))
+            db.session.flush()
+
+    @staticmethod
+    def set(name, value):
+        # For totals recounted from the rows they count.
+        updated = MetricCounter.query.filter_by(name=name).update(
+            {'value': value}, synchronize_session=False)
+        if updated == 0:
+            db.session.add(MetricCounter(name=name, value=value))
+            db.session.flush()
+
+    @staticmethod
+    def get_all():
+        return dict(db.session.query(MetricCounter.name, MetricCounter.value))
 
-    return None
+    def __repr__(self):
+        return 'MetricCounter(name={}, value={})'.format(self.name, self.value)
+
+
+class Job(db.Model):
+    # RCON side effects of the match pages, run by ./manager.py run_jobs so
+    # a slow server can't hold up a web request. See jobs.py.
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)
+    match_id = db.Column(db.Integer, db.ForeignKey('match.id'), index=True)
+    # Jobs for the same server run in the order they were queued.
+    server_id = db.Column(db.Integer)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    payload = db.Column(db.Text)
+    # Queuing a job with a key that's been used already does nothing.
+    idempotency_key = db.Column(db.String(128), unique=True)
+    status = db.Column(db.String(16), nullable=False, default='pending', index=True)
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer)
+    run_after = db.Column(db.DateTime, index=True)
+    last_error = db.Column(db.String(256))
+    result = db.Column(db.Text)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    @staticmethod
+    def get_unfinished(match_id):
+        # What the match page lists: anything not done yet, or that failed.
+        return Job.query.filter(
+            Job.match_id == match_id,
+            Job.status != Job.DONE).order_by(Job.id).all()
+
+    def get_payload(self):
+        return json.loads(self.payload) if self.payload else {}
+
+    def get_description(self):
+        if self.kind == 'load_match':
+            return 'Load the match on the server'
+        return self.get_payload().get('command', self.kind)
+
+    def get_status_string(self):
+        if self.status == Job.PENDING and self.attempts:
+            return 'Retrying ({} of {} attempts failed: {})'.format(
+                self.attempts, self.max_attempts, self.last_error)
+        elif self.status == Job.FAILED:
+            return 'Failed: {}'.format(self.last_error)
+        return self.status.capitalize()
+
+    def __repr__(self):
+        return 'Job(id={}, kind={}, match_id={}, status={})'.format(
+            self.id, self.kind, self.match_id, self.status)
+
+
+def get_steam_name(steam64):
+    return steamprofiles.get_name(steam64)
@@ -0,0 +1,75 @@
+from flask import request, url_for, jsonify
+
+import util
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+class KeysetPage(object):
+    # One page of a listing ordered by a unique column. next_cursor is the
+    # value to pass as ?after= for the following page, or None on the last
+    # page. Fetching any page is a single indexed range scan, so deep pages
+    # cost the same as the first one.
+
+    def __init__(self, items, after, limit, next_cursor):
+        self.items = items
+        self.after = after
+        self.limit = limit
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def next_url(self):
+        if self.next_cursor is None:
+            return None
+        return self._url(after=self.next_cursor)
+
+    def first_url(self):
+        return self._url()
+
+    def _url(self, **args):
+        # Same view and arguments as the current request, other than the
+        # cursor.
+        args.update(request.view_args)
+        if self.limit != DEFAULT_LIMIT:
+            args['limit'] = self.limit
+        return url_for(request.endpoint, **args)
+
+
+def paginate(query, column, after=None, limit=DEFAULT_LIMIT, descending=False):
+    if after is not None:
+        if descending:
+            query = query.filter(column < after)
+        else:
+            query = query.filter(column > after)
+    query = query.order_by(column.desc() if descending else column)
+
+    # One extra row tells us whether there is another page without a COUNT.
+    items = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = getattr(items[-1], column.key)
+    return KeysetPage(items, after, limit, next_cursor)
+
+
+def paginate_request(query, column, descending=False):
+    # Reads ?after= and ?limit= from the current request.
+    after = request.values.get('after')
+    if after is not None:
+        after = util.as_int(after, on_fail=None)
+    limit = util.as_int(request.values.get('limit'), on_fail=DEFAULT_LIMIT)
+    limit = max(1, min(limit, MAX_LIMIT))
+    return paginate(query, column, after, limit, descending)
+
+
+def jsonify_page(page, name, to_dict):
+    # Renders a page as {name: [...], 'next_cursor': ...}, pass next_cursor
+    # back as ?after= to get the following page.
+    return jsonify({name: [to_dict(item) for item in page.items],
+                    'next_cursor': page.next_cursor})
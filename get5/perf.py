@@ -0,0 +1,143 @@
+# Opt-in request profiling, enabled with the PERF_PROFILING config setting.
+#
+# For every request this records how many SQL statements ran and how long
+# was spent in the database, in RCON commands and in Steam API calls. The
+# numbers are sent back in a Server-Timing header, logged, and aggregated
+# per endpoint for the /metrics/perf page.
+
+from flask import g, has_request_context
+import sqlalchemy
+import sqlalchemy.engine
+
+import collections
+import contextlib
+import math
+import threading
+import time
+
+# External calls timed with timed(), besides the database.
+SECTIONS = ('rcon', 'steam')
+
+# How many recent requests are kept per endpoint for the percentiles.
+SAMPLES_PER_ENDPOINT = 1000
+
+_lock = threading.Lock()
+_samples = collections.defaultdict(
+    lambda: collections.deque(maxlen=SAMPLES_PER_ENDPOINT))
+
+
+class RequestProfile(object):
+
+    def __init__(self, slow_query_ms):
+        self.start = time.time()
+        self.query_count = 0
+        self.slow_query_ms = slow_query_ms
+        self.slow_queries = []
+        self.timings = dict((section, 0.0) for section in ('db',) + SECTIONS)
+
+    def elapsed_ms(self):
+        return (time.time() - self.start) * 1000
+
+
+def current_profile():
+    if has_request_context():
+        return getattr(g, 'perf_profile', None)
+    return None
+
+
+def start_request(slow_query_ms):
+    g.perf_profile = RequestProfile(slow_query_ms)
+
+
+@contextlib.contextmanager
+def timed(section):
+    # Adds the time spent in the block to the current request's section.
+    profile = current_profile()
+    if profile is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        profile.timings[section] += (time.time() - start) * 1000
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.engine.Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_profile() is not None:
+        conn.info.setdefault('perf_query_start', []).append(time.time())
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.engine.Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile()
+    if profile is None or not conn.info.get('perf_query_start'):
+        return
+    elapsed = (time.time() - conn.info['perf_query_start'].pop()) * 1000
+    profile.query_count += 1
+    profile.timings['db'] += elapsed
+    if elapsed >= profile.slow_query_ms:
+        profile.slow_queries.append((elapsed, statement))
+
+
+def finish_request(endpoint, response, logger):
+    profile = current_profile()
+    if profile is None:
+        return response
+    g.perf_profile = None
+
+    total = profile.elapsed_ms()
+    timings = ['{};dur={:.1f}'.format(section, profile.timings[section])
+               for section in ('db',) + SECTIONS]
+    timings[0] += ';desc="{} queries"'.format(profile.query_count)
+    timings.append('total;dur={:.1f}'.format(total))
+    response.headers['Server-Timing'] = ', '.join(timings)
+
+    logger.info('perf endpoint=%s status=%s total_ms=%.1f queries=%d db_ms=%.1f '
+                'rcon_ms=%.1f steam_ms=%.1f',
+                endpoint, response.status_code, total, profile.query_count,
+                profile.timings['db'], profile.timings['rcon'], profile.timings['steam'])
+    for elapsed, statement in profile.slow_queries:
+        logger.warning('perf slow query endpoint=%s ms=%.1f: %s',
+                       endpoint, elapsed, statement)
+
+    with _lock:
+        _samples[endpoint].append((total, profile.query_count, profile.timings['db']))
+    return response
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of an already sorted list.
+    if not values:
+        return 0
+    index = int(math.ceil(fraction * len(values))) - 1
+    return values[max(0, min(index, len(values) - 1))]
+
+
+def get_endpoint_stats():
+    # One row per endpoint, slowest p95 first.
+    with _lock:
+        samples = dict((endpoint, list(values)) for endpoint, values in _samples.items())
+
+    rows = []
+    for endpoint, values in samples.items():
+        totals = sorted(value[0] for value in values)
+        queries = [value[1] for value in values]
+        rows.append({
+            'endpoint': endpoint,
+            'requests': len(values),
+            'p50': percentile(totals, 0.50),
+            'p95': percentile(totals, 0.95),
+            'p99': percentile(totals, 0.99),
+            'avg_queries': float(sum(queries)) / len(queries),
+            'max_queries': max(queries),
+            'avg_db_ms': sum(value[2] for value in values) / len(values),
+        })
+    rows.sort(key=lambda row: row['p95'], reverse=True)
+    return rows
+
+
+def reset():
+    with _lock:
+        _samples.clear()
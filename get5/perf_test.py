@@ -0,0 +1,62 @@
+import unittest
+
+import get5
+import get5_test
+import perf
+
+
+class PerfTests(get5_test.Get5Test):
+
+    def setUp(self):
+        super(PerfTests, self).setUp()
+        get5.app.config['PERF_PROFILING'] = True
+        perf.reset()
+
+    def tearDown(self):
+        get5.app.config['PERF_PROFILING'] = False
+        perf.reset()
+        super(PerfTests, self).tearDown()
+
+    def test_server_timing_header(self):
+        response = self.app.get('/matches')
+        self.assertEqual(response.status_code, 200)
+        timing = response.headers['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('rcon;dur=0.0', timing)
+        self.assertIn('total;dur=', timing)
+        queries = int(timing.split('desc="')[1].split(' ')[0])
+        self.assertGreater(queries, 0)
+
+        get5.app.config['PERF_PROFILING'] = False
+        response = self.app.get('/matches')
+        self.assertNotIn('Server-Timing', response.headers)
+
+    def test_endpoint_stats(self):
+        for _ in range(3):
+            self.app.get('/matches')
+        self.app.get('/teams')
+
+        stats = dict((row['endpoint'], row) for row in perf.get_endpoint_stats())
+        self.assertEqual(stats['match.matches']['requests'], 3)
+        self.assertEqual(stats['team.all_teams']['requests'], 1)
+        self.assertGreater(stats['match.matches']['max_queries'], 0)
+        self.assertLessEqual(stats['match.matches']['p50'], stats['match.matches']['p99'])
+
+        self.assertEqual(self.app.get('/metrics/perf').status_code, 400)
+        with self.app.session_transaction() as sess:
+            sess['user_id'] = 1
+        response = self.app.get('/metrics/perf')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('match.matches', response.data)
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(perf.percentile(values, 0.5), 50)
+        self.assertEqual(perf.percentile(values, 0.95), 95)
+        self.assertEqual(perf.percentile(values, 0.99), 99)
+        self.assertEqual(perf.percentile([7], 0.99), 7)
+        self.assertEqual(perf.percentile([], 0.5), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
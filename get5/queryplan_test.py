@@ -0,0 +1,57 @@
+import unittest
+
+import get5_test
+from get5 import db
+from models import (Match, MapStats, PlayerStats, PlayerSeasonCareer, SteamProfile,
+                    TeamAuthNames, Veto)
+
+
+# Runs EXPLAIN on the queries behind the API, stats pages and listings, and
+# fails if any of them has to read a whole table. Understands SQLite and
+# MySQL query plans.
+class QueryPlanTests(get5_test.Get5Test):
+
+    def explain(self, query):
+        sql = str(query.statement.compile(
+            dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+        if db.engine.dialect.name == 'sqlite':
+            # (id, parent, notused, detail)
+            return [row[-1] for row in db.session.execute('EXPLAIN QUERY PLAN ' + sql)]
+        elif db.engine.dialect.name == 'mysql':
+            return [(row['table'], row['type'], row['key'])
+                    for row in db.session.execute('EXPLAIN ' + sql)]
+        self.skipTest('No query plan support for ' + db.engine.dialect.name)
+
+    def assertNoFullScan(self, query):
+        plan = self.explain(query)
+        if db.engine.dialect.name == 'sqlite':
+            full_scans = [step for step in plan if step.startswith('SCAN')]
+        else:
+            full_scans = [step for step in plan if step[1] in ('ALL', 'index')]
+        self.assertEqual(full_scans, [], 'Full table scan in {}'.format(plan))
+
+    def test_match_api_queries(self):
+        self.assertNoFullScan(MapStats.query.filter_by(match_id=1, map_number=0))
+        self.assertNoFullScan(PlayerStats.query.filter(
+            PlayerStats.map_id == 1, PlayerStats.steam_id.in_(['76561198053858673'])))
+        self.assertNoFullScan(PlayerStats.query.filter_by(match_id=1))
+        self.assertNoFullScan(Veto.query.filter_by(match_id=1))
+        self.assertNoFullScan(TeamAuthNames.query.filter_by(
+            team_id=1, auth='76561198053858673'))
+
+    def test_stats_queries(self):
+        self.assertNoFullScan(PlayerStats.query.filter_by(
+            steam_id='76561198053858673').order_by(PlayerStats.id.desc()).limit(20))
+        self.assertNoFullScan(PlayerSeasonCareer.query.filter_by(season_id=1))
+        self.assertNoFullScan(SteamProfile.query.filter(
+            SteamProfile.steam_id.in_(['76561198053858673'])))
+
+    def test_match_listing_queries(self):
+        self.assertNoFullScan(Match.query.filter_by(season_id=1, cancelled=False))
+        self.assertNoFullScan(Match.query.filter_by(user_id=1, cancelled=False))
+        self.assertNoFullScan(Match.query.filter_by(user_id=1).filter(
+            Match.id < 100).order_by(Match.id.desc()).limit(20))
+
+
+if __name__ == '__main__':
+    unittest.main()
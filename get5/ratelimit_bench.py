@@ -0,0 +1,94 @@
+#!/usr/bin/env python2.7
+
+# Times the rate limit check the api routes make on every request, with the
+# counters kept in memory and in a shared sqlite database, from several
+# processes at once like gunicorn workers. This never touches the configured
+# storage, run it from the repo root with:
+#
+#   python2.7 -m get5.ratelimit_bench [--processes 1 4 8] [--checks 20000]
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter
+
+import ratelimitstorage  # noqa: F401
+
+# The limit on the stat update routes, which see the most traffic.
+LIMIT = '1000 per hour'
+
+
+def worker(url, num_keys, checks, start, results):
+    storage = storage_from_string(url)
+    limiter = FixedWindowRateLimiter(storage)
+    limit = parse(LIMIT)
+    keys = ['10.0.0.{}'.format(i) for i in range(num_keys)]
+    timings = []
+    start.wait()
+    for i in range(checks):
+        key = keys[i % num_keys]
+        begin = time.time()
+        limiter.hit(limit, key)
+        timings.append(time.time() - begin)
+    results.put(timings)
+
+
+def run(url, processes, num_keys, checks):
+    # Returns the mean and 99th percentile seconds per check, and the checks
+    # made per second by all the processes together.
+    start = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=worker,
+                                       args=(url, num_keys, checks, start, results))
+               for _ in range(processes)]
+    for process in workers:
+        process.start()
+    time.sleep(0.5)
+    begin = time.time()
+    start.set()
+    timings = []
+    for _ in workers:
+        timings.extend(results.get())
+    elapsed = time.time() - begin
+    for process in workers:
+        process.join()
+
+    timings.sort()
+    mean = sum(timings) / len(timings)
+    p99 = timings[int(len(timings) * 0.99)]
+    return mean, p99, len(timings) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the rate limit storage.')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 4, 8],
+                        help='number of processes checking limits at once for each run')
+    parser.add_argument('--checks', type=int, default=20000,
+                        help='checks made by each process')
+    parser.add_argument('--keys', type=int, default=100,
+                        help='number of clients (game servers) the checks are spread over')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        print('{:>8} {:>10} {:>10} {:>10} {:>12}'.format(
+            'storage', 'processes', 'mean (us)', 'p99 (us)', 'checks/s'))
+        for processes in args.processes:
+            for name, url in (('memory', 'memory://'),
+                              ('sqlite', 'sqlite:///' + os.path.join(
+                                  directory, 'ratelimit{}.db'.format(processes)))):
+                mean, p99, rate = run(url, processes, args.keys, args.checks)
+                print('{:>8} {:>10} {:>10.1f} {:>10.1f} {:>12.0f}'.format(
+                    name, processes, mean * 1e6, p99 * 1e6, rate))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# Rate limit counters that every web server process on the host shares.
+#
+# Flask-Limiter keeps its counters in the memory of each process by default,
+# so running N workers lets a client make N times as many requests. Setting
+#
+#   RATELIMIT_STORAGE_URL = 'sqlite:////var/lib/get5/ratelimit.db'
+#
+# keeps them in a sqlite database in WAL mode instead, which the workers
+# share without running anything else. A hit is a single short write
+# transaction, and with synchronous=NORMAL it isn't synced to disk, so
+# counters may be lost if the host crashes, but never by a worker crashing.
+# Only the fixed-window strategies are supported.
+
+from limits.errors import ConfigurationError
+from limits.storage import Storage
+
+import sqlitedb
+
+import sqlite3
+import time
+import urlparse
+
+# Seconds between each process deleting the counters that have expired.
+CLEANUP_INTERVAL = 60
+
+
+class SQLiteStorage(Storage):
+    STORAGE_SCHEME = 'sqlite'
+
+    def __init__(self, uri, **options):
+        # Like SQLALCHEMY_DATABASE_URI, sqlite:///relative/path or
+        # sqlite:////absolute/path.
+        self.path = urlparse.urlparse(uri).path[1:]
+        if not self.path:
+            raise ConfigurationError('No database path in {}'.format(uri))
+        self._db = sqlitedb.ConnectionPool(
+            self.path, options.get('timeout', sqlitedb.BUSY_TIMEOUT))
+        self._next_cleanup = 0
+        super(SQLiteStorage, self).__init__(uri)
+        self._db.get().execute(
+            'CREATE TABLE IF NOT EXISTS ratelimit ('
+            'key TEXT PRIMARY KEY, count INTEGER NOT NULL, expiry REAL NOT NULL)')
+
+    def incr(self, key, expiry, elastic_expiry=False):
+        now = time.time()
+        conn = self._db.get()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Starts a new window if the last one is over.
+            updated = conn.execute(
+                'UPDATE ratelimit SET '
+                'count = CASE WHEN expiry <= ? THEN 1 ELSE count + 1 END, '
+                'expiry = CASE WHEN expiry <= ? OR ? THEN ? ELSE expiry END '
+                'WHERE key = ?',
+                (now, now, bool(elastic_expiry), now + expiry, key)).rowcount
+            if updated:
+                count = conn.execute(
+                    'SELECT count FROM ratelimit WHERE key = ?', (key,)).fetchone()[0]
+            else:
+                conn.execute('INSERT INTO ratelimit (key, count, expiry) VALUES (?, 1, ?)',
+                             (key, now + expiry))
+                count = 1
+            if now >= self._next_cleanup:
+                self._next_cleanup = now + CLEANUP_INTERVAL
+                conn.execute('DELETE FROM ratelimit WHERE expiry <= ?', (now,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return count
+
+    def _get_row(self, key):
+        row = self._db.get().execute(
+            'SELECT count, expiry FROM ratelimit WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return row
+
+    def get(self, key):
+        row = self._get_row(key)
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        row = self._get_row(key)
+        return int(row[1] if row else time.time())
+
+    def check(self):
+        try:
+            self._db.get().execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        self._db.get().execute('DELETE FROM ratelimit')
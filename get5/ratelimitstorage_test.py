@@ -0,0 +1,87 @@
+import unittest
+
+import ratelimitstorage
+
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+
+def _hit_many(path, key, count):
+    storage = ratelimitstorage.SQLiteStorage('sqlite:///' + path)
+    for _ in range(count):
+        storage.incr(key, 60)
+
+
+class SQLiteStorageTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'ratelimit.db')
+        self.storage = self.open_storage()
+
+    def open_storage(self):
+        return storage_from_string('sqlite:///' + self.path)
+
+    def test_storage_from_string(self):
+        self.assertIsInstance(self.storage, ratelimitstorage.SQLiteStorage)
+        self.assertEqual(self.storage.path, self.path)
+        self.assertTrue(self.storage.check())
+
+    def test_fixed_window(self):
+        self.assertEqual(self.storage.get('a'), 0)
+        self.assertEqual(self.storage.incr('a', 60), 1)
+        self.assertEqual(self.storage.incr('a', 60), 2)
+        self.assertEqual(self.storage.incr('b', 60), 1)
+        self.assertEqual(self.storage.get('a'), 2)
+        expiry = self.storage.get_expiry('a')
+        self.assertAlmostEqual(expiry, time.time() + 60, delta=2)
+
+        self.storage.reset()
+        self.assertEqual(self.storage.get('a'), 0)
+
+    def test_window_expires(self):
+        self.storage.incr('a', 0.05)
+        self.storage.incr('a', 0.05)
+        time.sleep(0.1)
+        self.assertEqual(self.storage.get('a'), 0)
+        self.assertEqual(self.storage.incr('a', 60), 1)
+
+    def test_elastic_expiry(self):
+        self.storage.incr('a', 1)
+        self.storage.incr('a', 60, elastic_expiry=True)
+        self.assertGreater(self.storage.get_expiry('a'), time.time() + 30)
+
+    def test_shared_between_processes(self):
+        processes = [multiprocessing.Process(target=_hit_many, args=(self.path, 'a', 200))
+                     for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+        self.assertEqual(self.storage.get('a'), 800)
+        self.assertEqual(self.open_storage().get('a'), 800)
+
+    def test_limiter(self):
+        # The limiter only keeps a weak reference to its storage.
+        other_storage = self.open_storage()
+        limiter = FixedWindowRateLimiter(self.storage)
+        other_worker = FixedWindowRateLimiter(other_storage)
+        limit = parse('3 per minute')
+        self.assertTrue(limiter.hit(limit, '127.0.0.1'))
+        self.assertTrue(other_worker.hit(limit, '127.0.0.1'))
+        self.assertTrue(limiter.hit(limit, '127.0.0.1'))
+        self.assertFalse(other_worker.hit(limit, '127.0.0.1'))
+        self.assertTrue(other_worker.hit(limit, '127.0.0.2'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+# Keeps authenticated RCON sessions open between commands, so sending a
+# command to a game server doesn't cost a TCP connect and an authentication
+# round trip every time.
+#
+# Sessions are keyed by (ip, port). A session is only used by one thread at a
+# time: it is taken out of the pool for a command and put back afterwards,
+# and concurrent commands to one server simply open more sessions. Anything
+# that goes wrong on a session closes it.
+
+import counters
+
+from valve.source.rcon import RCON, AuthenticationError, IncompleteMessageError, NoResponseError
+
+import errno
+import socket
+import threading
+import time
+
+# Sessions unused for this long are closed.
+IDLE_TIMEOUT = 60
+# Sessions are reopened after this long even when busy, so one that has
+# gone bad without us noticing doesn't live forever.
+MAX_AGE = 600
+# Most sessions kept open per server, extra ones are closed when returned.
+MAX_IDLE_PER_SERVER = 4
+
+# Errors after which a session can't be used again.
+SESSION_ERRORS = (socket.error, socket.timeout, KeyError,
+                  AuthenticationError, IncompleteMessageError, NoResponseError)
+
+
+class SentError(Exception):
+    # Something went wrong after commands were written to the server, so
+    # they may have run, and sending them again could run them twice.
+
+    def __init__(self, error):
+        Exception.__init__(self, str(error) or error.__class__.__name__)
+        self.error = error
+
+
+class _Session(object):
+
+    def __init__(self, rcon, password):
+        self.rcon = rcon
+        self.password = password
+        self.created = time.time()
+        self.last_used = self.created
+
+    def expired(self, now):
+        return (now - self.last_used >= IDLE_TIMEOUT or
+                now - self.created >= MAX_AGE)
+
+    def is_alive(self):
+        # The socket is non-blocking, so this returns straight away: EOF
+        # means the server closed it (e.g. a map change restarted it), and
+        # data nobody asked for means the session is out of step.
+        try:
+            self.rcon._socket.recv(1, socket.MSG_PEEK)
+        except socket.error as e:
+            return e.errno in (errno.EAGAIN, errno.EWOULDBLOCK)
+        return False
+
+    def close(self):
+        try:
+            self.rcon.disconnect()
+        except socket.error:
+            pass
+
+
+class RconPool(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def execute(self, host, port, password, command, timeout=3.0):
+        # Returns the server's response to command. Raises the same errors as
+        # valve's RCON: socket errors, AuthenticationError, NoResponseError,
+        # and KeyError for some wrong passwords.
+        return self.execute_many(host, port, password, [command], timeout)[0]
+
+    def execute_many(self, host, port, password, commands, timeout=3.0):
+        # Like execute, for a list of commands, returning their responses in
+        # order.
+        key = (host, port)
+        session = self._checkout(key, password)
+        if session is not None:
+            try:
+                responses = self._run(session, commands, timeout)
+            except SESSION_ERRORS:
+                # The server may have restarted or dropped the session before
+                # anything was sent, try again once on a new one.
+                session.close()
+            except SentError:
+                session.close()
+                raise
+            else:
+                self._checkin(key, session)
+                return responses
+
+        session = self._connect(host, port, password, timeout)
+        try:
+            responses = self._run(session, commands, timeout)
+        except Exception:
+            session.close()
+            raise
+        self._checkin(key, session)
+        return responses
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for sessions in idle.values():
+            for session in sessions:
+                session.close()
+
+    def idle_count(self):
+        with self._lock:
+            return sum(len(sessions) for sessions in self._idle.values())
+
+    def _run(self, session, commands, timeout):
+        # Every command is written before waiting on any of them, so a batch
+        # costs one round trip. The server answers in order, and valve
+        # collects the packets of each (possibly multi-packet) response until
+        # the end marker that follows it.
+        requests = []
+        try:
+            for command in commands:
+                requests.append(session.rcon.execute(command, block=False))
+            responses = []
+            for request in requests:
+                with session.rcon.response_to(request, timeout) as response:
+                    responses.append(response.body)
+        except SESSION_ERRORS as e:
+            if requests:
+                raise SentError(e)
+            raise
+        session.last_used = time.time()
+        return responses
+
+    def _connect(self, host, port, password, timeout):
+        counters.inc('rcon_connections')
+        rcon = RCON((host, port), password, timeout=timeout)
+        # valve connects with a blocking socket and no timeout, give it one.
+        rcon._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        rcon._socket.settimeout(timeout)
+        try:
+            rcon.connect()
+            rcon.authenticate(password)
+        except Exception:
+            rcon._socket.close()
+            raise
+        return _Session(rcon, password)
+
+    def _checkout(self, key, password):
+        now = time.time()
+        while True:
+            with self._lock:
+                sessions = self._idle.get(key)
+                if not sessions:
+                    return None
+                session = sessions.pop()
+
+            if session.password == password and not session.expired(now) and session.is_alive():
+                return session
+            session.close()
+
+    def _checkin(self, key, session):
+        now = time.time()
+        expired = []
+        with self._lock:
+            sessions = self._idle.setdefault(key, [])
+            if len(sessions) < MAX_IDLE_PER_SERVER:
+                sessions.append(session)
+            else:
+                expired.append(session)
+
+            # Sweep every server here, so sessions to servers we stop talking
+            # to get closed too.
+            for other_key, others in self._idle.items():
+                expired.extend(s for s in others if s.expired(now))
+                others[:] = [s for s in others if not s.expired(now)]
+                if not others:
+                    del self._idle[other_key]
+
+        for session in expired:
+            session.close()
+
+
+pool = RconPool()
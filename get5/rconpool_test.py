@@ -0,0 +1,269 @@
+import unittest
+
+from valve.source.rcon import Message
+
+import counters
+import get5
+import get5_test
+import rconpool
+import serverinfo
+import util
+from get5 import cache, db
+from models import GameServer, Match
+
+import SocketServer
+import socket
+import struct
+import threading
+import time
+
+
+class FakeRconHandler(SocketServer.BaseRequestHandler):
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+            server.clients.append(self.request)
+        buf = b''
+        while True:
+            try:
+                data = self.request.recv(4096)
+            except Exception:
+                return
+            if not data:
+                return
+            buf += data
+            while len(buf) >= 4:
+                size = struct.unpack(b'<i', buf[:4])[0]
+                if len(buf) < size + 4:
+                    break
+                packet, buf = buf[:size + 4], buf[size + 4:]
+                id, type = struct.unpack(b'<ii', packet[4:12])
+                body = packet[12:-2]
+                reply = self.reply(id, type, body)
+                if reply is None:
+                    # Resets the connection, like a server that crashed.
+                    self.request.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                            struct.pack(b'ii', 1, 0))
+                    self.request.close()
+                    return
+                self.request.sendall(reply)
+
+    def reply(self, id, type, body):
+        server = self.server
+        if type == Message.SERVERDATA_AUTH:
+            with server.lock:
+                server.auths += 1
+            if body != server.password:
+                id = -1
+            return (Message(id, Message.SERVERDATA_RESPONSE_VALUE).encode() +
+                    Message(id, Message.SERVERDATA_AUTH_RESPONSE).encode())
+        elif type == Message.SERVERDATA_EXECCOMAND:
+            with server.lock:
+                server.commands.append(body)
+            if body in server.hang_ups:
+                # Once valve has sent the packet that follows it.
+                self.hanging_up = True
+                return b''
+            time.sleep(server.delay)
+            output = server.outputs.get(body, 'response to ' + body)
+            # Long output is split over several packets, like SRCDS does.
+            chunks = [output[i:i + 4000] for i in range(0, len(output), 4000)] or ['']
+            return b''.join(Message(id, Message.SERVERDATA_RESPONSE_VALUE, chunk).encode()
+                            for chunk in chunks)
+        elif getattr(self, 'hanging_up', False):
+            return None
+        else:
+            # The empty packet valve sends after every command, SRCDS mirrors
+            # it and then follows it with an end of response marker.
+            return (Message(id, Message.SERVERDATA_RESPONSE_VALUE).encode() +
+                    Message(id, Message.SERVERDATA_RESPONSE_VALUE, '\x00\x01\x00\x00').encode())
+
+
+class FakeRconServer(SocketServer.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, password):
+        SocketServer.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), FakeRconHandler)
+        self.password = password
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.auths = 0
+        self.commands = []
+        self.clients = []
+        self.outputs = {}
+        # Seconds taken to run each command.
+        self.delay = 0
+        # Commands that run, but the connection drops before their reply.
+        self.hang_ups = set()
+
+    def drop_clients(self):
+        # What a server restart looks like to us.
+        with self.lock:
+            for client in self.clients:
+                client.shutdown(socket.SHUT_RDWR)
+                client.close()
+            self.clients = []
+
+
+def start_fake_rcon_server(password='password'):
+    server = FakeRconServer(password)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+class FakeRconServerMixin(object):
+    # Points each GameServer at its own FakeRconServer, in self.rcon_servers
+    # in id order. self.rcon_server is the first one's.
+
+    def setUp(self):
+        super(FakeRconServerMixin, self).setUp()
+        rconpool.pool.close_all()
+        self.rcon_servers = []
+        for server in GameServer.query.order_by(GameServer.id):
+            rcon_server = start_fake_rcon_server()
+            rcon_server.outputs['sv_password'] = '"sv_password" = "secret" ( def. "" )'
+            rcon_server.outputs['tv_port'] = '"tv_port" = "27020" ( def. "27020" )'
+            self.rcon_servers.append(rcon_server)
+            server.port = rcon_server.server_address[1]
+            cache.delete(serverinfo._cache_key(server))
+        self.rcon_server = self.rcon_servers[0]
+        db.session.commit()
+
+    def tearDown(self):
+        for server in GameServer.query:
+            cache.delete(serverinfo._cache_key(server))
+        rconpool.pool.close_all()
+        for rcon_server in self.rcon_servers:
+            rcon_server.shutdown()
+            rcon_server.server_close()
+        super(FakeRconServerMixin, self).tearDown()
+
+
+class RconPoolTests(get5_test.Get5Test):
+
+    def setUp(self):
+        super(RconPoolTests, self).setUp()
+        self.server = start_fake_rcon_server()
+        self.port = self.server.server_address[1]
+        rconpool.pool.close_all()
+        counters.reset()
+
+    def tearDown(self):
+        rconpool.pool.close_all()
+        self.server.shutdown()
+        self.server.server_close()
+        super(RconPoolTests, self).tearDown()
+
+    def send(self, command, password='password', **kwargs):
+        return util.send_rcon_command('127.0.0.1', self.port, password, command, **kwargs)
+
+    def test_reuses_connection(self):
+        for i in range(10):
+            self.assertEqual(self.send('status {}'.format(i)), 'response to status {}'.format(i))
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(self.server.auths, 1)
+        self.assertEqual(len(self.server.commands), 10)
+        self.assertEqual(counters.get_counters()['rcon_connections'], 1)
+        self.assertEqual(counters.get_counters()['rcon_commands'], 10)
+
+    def test_match_send_to_server(self):
+        server = GameServer.query.get(1)
+        server.port = self.port
+        server.rcon_password = util.encrypt(get5.app.config['DATABASE_KEY'], 'password')
+        with get5.app.test_request_context():
+            # False since the fake server answers get5_loadmatch_url.
+            self.assertFalse(Match.query.get(1).send_to_server())
+        server.send_rcon_command('get5_status')
+        # Three commands from send_to_server and one more, on one connection.
+        self.assertEqual(len(self.server.commands), 4)
+        self.assertEqual(self.server.commands[2], 'map de_dust2')
+        self.assertEqual(self.server.connections, 1)
+
+    def test_batch(self):
+        self.server.outputs['sv_password'] = '"sv_password" = "secret" ( def. "" )'
+        self.server.outputs['tv_port'] = '"tv_port" = "27020" ( def. "27020" )'
+        self.server.outputs['cvarlist'] = ''.join('cvar_{}\n'.format(i) for i in range(2000))
+
+        responses = util.send_rcon_commands(
+            '127.0.0.1', self.port, 'password', ['status', 'cvarlist', 'echo'])
+        self.assertEqual(responses, ['response to status', self.server.outputs['cvarlist'],
+                                     'response to echo'])
+        self.assertEqual(counters.get_counters()['rcon_commands'], 3)
+
+        server = GameServer.query.get(1)
+        server.port = self.port
+        self.assertEqual(server.receive_rcon_values(['sv_password', 'tv_port', 'status']),
+                         ['secret', '27020', None])
+        self.assertEqual(self.server.connections, 1)
+
+    def test_batch_unreachable(self):
+        server = GameServer.query.get(1)
+        server.port = 1
+        self.assertIsNone(server.send_rcon_batch(['status', 'echo'], num_retries=1))
+        self.assertEqual(server.receive_rcon_values(['sv_password', 'tv_port']),
+                         [None, None])
+        self.assertEqual(counters.get_counters()['rcon_failures'], 4)
+
+    def test_batch_not_resent_after_sending(self):
+        # The commands reach the server, but the responses take too long.
+        self.server.delay = 0.3
+        self.assertIsNone(util.send_rcon_commands(
+            '127.0.0.1', self.port, 'password', ['get5_loadmatch_url x', 'map de_dust2'],
+            num_retries=3, timeout=0.1))
+        time.sleep(0.7)
+        self.assertEqual(self.server.commands.count('get5_loadmatch_url x'), 1)
+        self.assertEqual(counters.get_counters()['rcon_failures'], 2)
+
+    def test_reconnects_after_server_restart(self):
+        self.assertIsNotNone(self.send('status'))
+        self.server.drop_clients()
+        self.assertEqual(self.send('status'), 'response to status')
+        self.assertEqual(self.server.connections, 2)
+
+    def test_password_change(self):
+        self.assertIsNotNone(self.send('status'))
+        self.server.password = 'newpassword'
+        with self.assertRaises(util.RconError):
+            self.send('status', password='wrong', num_retries=1)
+        self.assertEqual(self.send('status', password='newpassword'), 'response to status')
+        # The session with the old password was dropped.
+        self.assertEqual(rconpool.pool.idle_count(), 1)
+        self.assertEqual(self.server.connections, 3)
+
+    def test_idle_eviction(self):
+        self.assertIsNotNone(self.send('status'))
+        self.assertEqual(rconpool.pool.idle_count(), 1)
+        old_timeout = rconpool.IDLE_TIMEOUT
+        rconpool.IDLE_TIMEOUT = 0
+        try:
+            self.assertIsNotNone(self.send('status'))
+        finally:
+            rconpool.IDLE_TIMEOUT = old_timeout
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(rconpool.pool.idle_count(), 0)
+
+    def test_concurrent_commands(self):
+        errors = []
+
+        def worker(n):
+            for i in range(20):
+                if self.send('cmd {} {}'.format(n, i)) != 'response to cmd {} {}'.format(n, i):
+                    errors.append((n, i))
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.server.commands), 160)
+        self.assertLessEqual(self.server.connections, 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import get5
+from get5 import cache, db
+from models import Match, MapStats, PlayerStats, Team
+import steamprofiles
+
+from flask import json
+from collections import OrderedDict
+
+import hashlib
+import uuid
+
+# Broadcast overlays poll /match/<id>/scoreboard every couple of seconds, so
+# it's served from the cache, and only rebuilt after the game server has
+# sent new stats for the match (see invalidate). Entries are stored under
+# the match's current generation, so a scoreboard built from data that was
+# changed while it was being built is never served.
+
+
+def _generation_key(matchid):
+    return 'match_scoreboard_generation/{}'.format(matchid)
+
+
+def _cache_key(matchid, generation):
+    return 'match_scoreboard/{}/{}'.format(matchid, generation)
+
+
+def _get_generation(matchid):
+    generation = cache.get(_generation_key(matchid))
+    if generation is None:
+        cache.add(_generation_key(matchid), uuid.uuid4().hex, timeout=0)
+        generation = cache.get(_generation_key(matchid))
+    return generation
+
+
+def invalidate(matchid):
+    # Call after committing a change to the match's stats.
+    cache.set(_generation_key(matchid), uuid.uuid4().hex, timeout=0)
+
+
+def get_scoreboard(matchid):
+    # Returns a dict with the scoreboard's JSON 'body' and 'etag', and whether
+    # the match is 'private', or None if there's no such match.
+    generation = _get_generation(matchid)
+    entry = cache.get(_cache_key(matchid, generation))
+    if entry is None:
+        match = Match.query.get(matchid)
+        if match is None:
+            return None
+        body = json.dumps(build(match), sort_keys=False)
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        entry = {
+            'body': body,
+            'etag': hashlib.sha1(body).hexdigest(),
+            'private': bool(match.is_private_match()),
+        }
+        cache.set(_cache_key(matchid, generation), entry,
+                  timeout=get5.config_setting('SCOREBOARD_CACHE_TTL'))
+    return entry
+
+
+def build(match):
+    # map_<n> -> each team's players by kills, with the team's name and score
+    # on that map, plus the map's name.
+    team1 = Team.query.get(match.team1_id)
+    team2 = Team.query.get(match.team2_id)
+    rows = db.session.query(MapStats, PlayerStats).outerjoin(
+        PlayerStats, PlayerStats.map_id == MapStats.id).filter(
+        MapStats.match_id == match.id).order_by(
+        MapStats.map_number, PlayerStats.id).all()
+    steamprofiles.prefetch(player.steam_id for _, player in rows if player is not None)
+
+    maps = OrderedDict()
+    players = {}
+    for map_stats, player in rows:
+        if map_stats.id not in maps:
+            maps[map_stats.id] = map_stats
+            players[map_stats.id] = []
+        if player is not None:
+            players[map_stats.id].append(player)
+
+    scoreboard = OrderedDict()
+    for map_num, map_stats in enumerate(maps.values()):
+        board = OrderedDict()
+        for team, score in ((team1, map_stats.team1_score), (team2, map_stats.team2_score)):
+            team_players = [(player.steam_id, player.get_scoreboard_values())
+                            for player in players[map_stats.id]
+                            if player.team_id == team.id]
+            team_board = OrderedDict(sorted(
+                team_players, key=lambda x: x[1]['kills'], reverse=True))
+            team_board['TeamName'] = team.name
+            team_board['TeamScore'] = score
+            board[team.name] = team_board
+        board['map'] = map_stats.map_name
+        scoreboard['map_{}'.format(map_num)] = board
+    return scoreboard
@@ -0,0 +1,131 @@
+import unittest
+
+import get5_test
+import scoreboard
+from get5 import db
+from models import User, Match, SteamProfile
+
+from collections import OrderedDict
+
+import datetime
+import json
+import sqlalchemy
+
+
+class ScoreboardTests(get5_test.Get5Test):
+
+    def setUp(self):
+        super(ScoreboardTests, self).setUp()
+        # The cache outlives the test database.
+        scoreboard.invalidate(1)
+        now = datetime.datetime.utcnow()
+        db.session.add(SteamProfile(steam_id='76561198053858673', personaname='player1',
+                                    updated_at=now))
+        db.session.add(SteamProfile(steam_id='76561198064755913', personaname='player2',
+                                    updated_at=now))
+        db.session.add(SteamProfile(steam_id='76561198064755914', personaname='player3',
+                                    updated_at=now))
+        db.session.commit()
+
+        self.matchkey = Match.query.get(1).api_key
+        self.app.post('/match/1/map/0/start',
+                      data={'mapname': 'de_dust2', 'key': self.matchkey})
+        self.update_players([
+            {'steamid': '76561198053858673', 'team': 'team1', 'kills': 5,
+             'deaths': 3, 'roundsplayed': 10, 'damage': 800},
+            {'steamid': '76561198064755913', 'team': 'team2', 'kills': 2,
+             'deaths': 6, 'roundsplayed': 10, 'damage': 300},
+            {'steamid': '76561198064755914', 'team': 'team2', 'kills': 4,
+             'deaths': 5, 'roundsplayed': 10, 'damage': 500},
+        ])
+
+    def update_players(self, players):
+        response = self.app.post(
+            '/match/1/map/0/players/update?key=' + self.matchkey,
+            data=json.dumps(players), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def count_queries(self, url, **kwargs):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        sqlalchemy.event.listen(
+            db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = self.app.get(url, **kwargs)
+        finally:
+            sqlalchemy.event.remove(
+                db.engine, 'before_cursor_execute', before_cursor_execute)
+        return response, len(statements)
+
+    def test_scoreboard(self):
+        data = json.loads(self.app.get('/match/1/scoreboard').data,
+                          object_pairs_hook=OrderedDict)
+        self.assertEqual(data.keys(), ['map_0'])
+        board = data['map_0']
+        self.assertEqual(board['map'], 'de_dust2')
+        self.assertEqual(board['EnvyUs']['TeamName'], 'EnvyUs')
+        self.assertEqual(board['EnvyUs']['TeamScore'], 0)
+        self.assertEqual(board['EnvyUs']['76561198053858673']['Player'], 'player1')
+        self.assertEqual(board['EnvyUs']['76561198053858673']['kills'], 5.0)
+        self.assertEqual(board['EnvyUs']['76561198053858673']['ADR'], 80.0)
+        # Each team's players come out most kills first.
+        self.assertEqual(board['Fnatic'].keys(), [
+            '76561198064755914', '76561198064755913', 'TeamName', 'TeamScore'])
+
+    def test_polling_is_cached(self):
+        response, queries = self.count_queries('/match/1/scoreboard')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(queries, 0)
+        etag = response.headers['ETag']
+
+        response, queries = self.count_queries('/match/1/scoreboard')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, 0)
+
+        response, queries = self.count_queries(
+            '/match/1/scoreboard', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(queries, 0)
+
+    def test_updates_invalidate(self):
+        etag = self.app.get('/match/1/scoreboard').headers['ETag']
+
+        self.app.post('/match/1/map/0/update',
+                      data={'team1score': 3, 'team2score': 1, 'key': self.matchkey})
+        response = self.app.get('/match/1/scoreboard', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['map_0']['EnvyUs']['TeamScore'], 3)
+        etag = response.headers['ETag']
+
+        self.update_players([{'steamid': '76561198064755913', 'team': 'team2',
+                              'kills': 9, 'deaths': 6, 'roundsplayed': 11}])
+        response = self.app.get('/match/1/scoreboard', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data, object_pairs_hook=OrderedDict)
+        self.assertEqual(data['map_0']['Fnatic'].keys()[0],
+                         '76561198064755913')
+
+    def test_private_match(self):
+        match = Match.query.get(1)
+        match.private_match = True
+        User.query.get(1).super_admin = True
+        db.session.commit()
+        scoreboard.invalidate(1)
+
+        for _ in range(2):
+            self.assertEqual(self.app.get('/match/1/scoreboard').status_code, 400)
+        with self.app as c:
+            with c.session_transaction() as sess:
+                sess['user_id'] = 1
+            self.assertEqual(c.get('/match/1/scoreboard').status_code, 200)
+
+    def test_missing_match(self):
+        scoreboard.invalidate(100)
+        self.assertEqual(self.app.get('/match/100/scoreboard').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,9 @@ from flask import Blueprint, request, render_template, flash, g, redirect
 import get5
 from get5 import app, db, BadRequestError, config_setting
 from models import Season, User, Match
+from match import match_to_dict
 from datetime import datetime
+import pagination
 import util
 
 from wtforms import (
@@ -40,12 +42,36 @@ class SeasonForm(Form):
 season_blueprint = Blueprint('season', __name__)
 
 
+def season_to_dict(season):
+    def format_time(value):
+        return value.isoformat() if value is not None else None
+
+    return {
+        'id': season.id,
+        'name': season.name,
+        'start_date': format_time(season.start_date),
+        'end_date': format_time(season.end_date),
+    }
+
+
+def get_match_counts(seasons):
+    # Number of (non-cancelled) matches in each of the seasons on a page.
+    season_ids = [season.id for season in seasons]
+    if not season_ids:
+        return {}
+    return dict(db.session.query(Match.season_id, db.func.count(Match.id)).filter(
+        Match.season_id.in_(season_ids), Match.cancelled == False).group_by(
+        Match.season_id))
+
+
 @season_blueprint.route('/seasons')
 def seasons():
-    seasons = Season.query.order_by(-Season.id)
-    seasoned_matches = Match.query.filter(Match.season_id.isnot(None), Match.cancelled==False)
+    seasons = pagination.paginate_request(Season.query, Season.id, descending=True)
+    if util.as_int(request.values.get('json'), on_fail=0):
+        return pagination.jsonify_page(seasons, 'seasons', season_to_dict)
     return render_template('seasons.html', user=g.user, seasons=seasons,
-                           my_seasons=False, matches=seasoned_matches, all_seasons=True)
+                           my_seasons=False, match_counts=get_match_counts(seasons),
+                           all_seasons=True)
 
 
 @season_blueprint.route('/season/create', methods=['GET', 'POST'])
@@ -83,8 +109,11 @@ def season_create():
 @season_blueprint.route("/season/<int:seasonid>")
 def season_matches(seasonid):
     season_info = Season.query.get_or_404(seasonid)
-    matches = Match.query.order_by(-Match.id).filter_by(season_id=seasonid,
-                                                        cancelled=False)
+    matches = Match.query.filter_by(season_id=seasonid, cancelled=False).options(
+        *Match.listing_options())
+    matches = pagination.paginate_request(matches, Match.id, descending=True)
+    if util.as_int(request.values.get('json'), on_fail=0):
+        return pagination.jsonify_page(matches, 'matches', match_to_dict)
     return render_template('matches.html', user=g.user, matches=matches,
                            season_matches=True, all_matches=False,
                            season=season_info)
@@ -93,12 +122,13 @@ def season_matches(seasonid):
 @season_blueprint.route("/season/user/<int:userid>")
 def seasons_user(userid):
     user = User.query.get_or_404(userid)
-    seasons = user.seasons.order_by(-Season.id)
-    seasoned_matches = Match.query.filter(Match.season_id.isnot(None), Match.cancelled==False)
+    seasons = pagination.paginate_request(user.seasons, Season.id, descending=True)
+    if util.as_int(request.values.get('json'), on_fail=0):
+        return pagination.jsonify_page(seasons, 'seasons', season_to_dict)
     is_owner = (g.user is not None) and (userid == g.user.id)
     return render_template('seasons.html', user=g.user, seasons=seasons,
-                           my_seasons=is_owner, all_matches=False, matches=seasoned_matches,
-                           season_owner=user)
+                           my_seasons=is_owner, all_matches=False,
+                           match_counts=get_match_counts(seasons), season_owner=user)
 
 
 @season_blueprint.route('/season/<int:seasonid>/edit', methods=['GET', 'POST'])
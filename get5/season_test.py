@@ -1,6 +1,8 @@
 import unittest
+import json
 
 import get5_test
+from get5 import db
 from flask import url_for
 from datetime import datetime, timedelta, date
 from models import User, Match, GameServer, MapStats, Season
@@ -83,5 +85,27 @@ class SeasonTests(get5_test.Get5Test):
 
             self.assertIn('Not your season', response.data)
 
+    def test_seasons_json_pagination(self):
+        user = User.query.get(1)
+        for i in range(4):
+            Season.create(user, 'Season {}'.format(i), datetime.utcnow(), None)
+        db.session.commit()
+
+        data = json.loads(self.app.get('/seasons?json=1&limit=3').data)
+        self.assertEqual([season['id'] for season in data['seasons']], [5, 4, 3])
+        self.assertEqual(data['next_cursor'], 3)
+
+        data = json.loads(self.app.get('/seasons?json=1&limit=3&after=3').data)
+        self.assertEqual([season['id'] for season in data['seasons']], [2, 1])
+        self.assertEqual(data['seasons'][1]['name'], 'Season One Test')
+        self.assertIsNone(data['next_cursor'])
+
+        data = json.loads(self.app.get('/season/1?json=1').data)
+        self.assertEqual([match['id'] for match in data['matches']], [1])
+
+        response = self.app.get('/seasons')
+        self.assertIn('<td>1</td>', response.data)
+
+
 if __name__ == '__main__':
     unittest.main()
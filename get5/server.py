@@ -1,5 +1,5 @@
 from get5 import app, db, flash_errors, config_setting, BadRequestError
-from models import GameServer
+from models import GameServer, ServerStatus
 import util
 
 from flask import Blueprint, request, render_template, flash, g, redirect
@@ -108,6 +108,8 @@ def server_edit(serverid):
             server.port = data['port']
             server.rcon_password = encRcon
             server.public_server = (data['public_server'] and (g.user.admin or g.user.super_admin))
+            # Have the poller look at the server again straight away.
+            ServerStatus.query.filter_by(server_id=server.id).delete()
 
             if mock or util.check_server_connection(server, dbKey):
                 db.session.commit()
@@ -139,6 +141,7 @@ def server_delete(serverid):
     for m in matches:
         m.server_id = None
 
+    ServerStatus.query.filter_by(server_id=serverid).delete()
     GameServer.query.filter_by(id=serverid).delete()
     db.session.commit()
     return redirect('/myservers')
@@ -154,4 +157,6 @@ def myservers():
     if g.user.super_admin:
         servers = GameServer.query.order_by(-GameServer.id)
 
-    return render_template('servers.html', user=g.user, servers=servers)
+    servers = servers.all()
+    statuses = ServerStatus.get_for(server.id for server in servers)
+    return render_template('servers.html', user=g.user, servers=servers, statuses=statuses)
@@ -0,0 +1,35 @@
+import get5
+from get5 import db
+from models import GameServer, ServerStatus
+
+import datetime
+
+# The server_id the match form uses for "pick one for me".
+AUTO_SERVER_ID = -1
+
+
+def get_candidates(user):
+    # Free servers user may use whose last check (see serverpoller) was
+    # recent and found them ready for a match, fastest to answer first.
+    oldest_allowed = datetime.datetime.utcnow() - datetime.timedelta(
+        seconds=get5.config_setting('SERVER_STATUS_MAX_AGE'))
+    return GameServer.query.join(
+        ServerStatus, ServerStatus.server_id == GameServer.id).filter(
+        db.or_(GameServer.user_id == user.id, GameServer.public_server == True),  # noqa: E712
+        db.or_(GameServer.in_use == False, GameServer.in_use == None),  # noqa: E711,E712
+        ServerStatus.online == True,  # noqa: E712
+        ServerStatus.error == None,  # noqa: E711
+        ServerStatus.gamestate == 0,
+        ServerStatus.last_checked >= oldest_allowed).order_by(
+        ServerStatus.latency_ms, GameServer.id)
+
+
+def allocate(user):
+    # Reserves the best free server for a new match of user's, or returns
+    # None if there isn't one. Other requests may be allocating at the same
+    # time, so a candidate can be gone by the time we reserve it, in which
+    # case the next one is tried.
+    for server in get_candidates(user):
+        if server.reserve():
+            return server
+    return None
@@ -0,0 +1,132 @@
+import unittest
+
+import get5
+import get5_test
+import serverallocator
+from get5 import db
+from models import User, Match, GameServer, ServerStatus
+
+import datetime
+import threading
+
+
+class ServerAllocatorTests(get5_test.Get5Test):
+
+    def add_status(self, server, latency_ms=20, **kwargs):
+        status = ServerStatus(server_id=server.id, online=True, latency_ms=latency_ms,
+                              plugin_version='0.5.0', gamestate=0,
+                              last_checked=datetime.datetime.utcnow())
+        for key, value in kwargs.items():
+            setattr(status, key, value)
+        db.session.add(status)
+        return status
+
+    def add_servers(self, count):
+        user = User.query.get(1)
+        servers = [GameServer.create(user, 'auto{}'.format(i), '127.0.0.1', 28000 + i,
+                                     'password', False) for i in range(count)]
+        db.session.commit()
+        for i, server in enumerate(servers):
+            self.add_status(server, latency_ms=10 + i)
+        db.session.commit()
+        return servers
+
+    def match_form(self, server_id):
+        return {
+            'server_id': server_id,
+            'team1_id': 1,
+            'team2_id': 2,
+            'match_title': 'Map {MAPNUMBER} of {MAXMAPS}',
+            'series_type': 'bo1',
+            'veto_first': 'CT',
+            'veto_mappool': ['de_dust2', 'de_cache', 'de_mirage'],
+            'team1_series_score': 0,
+            'team2_series_score': 0,
+        }
+
+    def test_allocate_picks_lowest_latency(self):
+        self.add_status(GameServer.query.get(2), latency_ms=50)
+        slow, fast = self.add_servers(2)
+        slow_status = ServerStatus.query.get(slow.id)
+        slow_status.latency_ms = 100
+        db.session.commit()
+
+        self.assertEqual(serverallocator.allocate(User.query.get(1)).id, fast.id)
+        self.assertEqual(serverallocator.allocate(User.query.get(1)).id, 2)
+        self.assertEqual(serverallocator.allocate(User.query.get(1)).id, slow.id)
+        self.assertIsNone(serverallocator.allocate(User.query.get(1)))
+        db.session.commit()
+        self.assertTrue(GameServer.query.get(fast.id).in_use)
+
+    def test_allocate_skips_unhealthy_servers(self):
+        offline, erroring, busy, stale, other_users = self.add_servers(5)
+        ServerStatus.query.get(offline.id).online = False
+        ServerStatus.query.get(erroring.id).error = 'Failed to connect to server'
+        ServerStatus.query.get(busy.id).gamestate = 1
+        ServerStatus.query.get(stale.id).last_checked = (
+            datetime.datetime.utcnow() - datetime.timedelta(days=1))
+        other_users.user_id = 2
+        db.session.commit()
+
+        # Server 2 is public but has never been checked.
+        self.assertIsNone(serverallocator.allocate(User.query.get(1)))
+
+    def test_reserve(self):
+        server = GameServer.query.get(2)
+        self.assertTrue(server.reserve())
+        self.assertTrue(server.in_use)
+        self.assertFalse(server.reserve())
+        self.assertFalse(GameServer.query.get(1).reserve())
+
+    def test_match_create_auto(self):
+        server_id = self.add_servers(1)[0].id
+        with self.app as c:
+            with c.session_transaction() as sess:
+                sess['user_id'] = 1
+            response = c.get('/match/create')
+            self.assertIn('Automatic', response.data)
+
+            response = c.post('/match/create', data=self.match_form(-1))
+            self.assertEqual(response.status_code, 302)
+            match = Match.query.order_by(Match.id.desc()).first()
+            self.assertEqual(match.server_id, server_id)
+            self.assertEqual(match.plugin_version, '0.5.0')
+
+            response = c.post('/match/create', data=self.match_form(-1))
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('No free servers are available right now', response.data)
+
+    def test_parallel_match_creation(self):
+        # 50 matches created at once for 10 servers: each server should go to
+        # exactly one of them.
+        server_ids = [server.id for server in self.add_servers(10)]
+        first_match_id = Match.query.order_by(Match.id.desc()).first().id
+        db.session.remove()
+
+        start = threading.Event()
+        status_codes = []
+
+        def create_match():
+            client = get5.app.test_client()
+            with client.session_transaction() as sess:
+                sess['user_id'] = 1
+            start.wait()
+            response = client.post('/match/create', data=self.match_form(-1))
+            status_codes.append(response.status_code)
+
+        threads = [threading.Thread(target=create_match) for _ in range(50)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(status_codes.count(302), len(server_ids))
+        self.assertEqual(status_codes.count(200), 50 - len(server_ids))
+        matches = Match.query.filter(Match.id > first_match_id).all()
+        self.assertEqual(sorted(m.server_id for m in matches),
+                         sorted(server_ids))
+
+
+if __name__ == '__main__':
+    unittest.main()
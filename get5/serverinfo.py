@@ -0,0 +1,133 @@
+import get5
+from get5 import app, cache
+import models
+import util
+
+import threading
+import time
+
+# Servers with a refresh already running in this process.
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+# How long a cached value is kept around to show while it's being refreshed.
+_KEEP_SECONDS = 24 * 60 * 60
+
+
+class ConnectInfo(object):
+    # What the match page needs to let players connect to a server, as last
+    # read over RCON.
+
+    def __init__(self, online, password=None, gotv_port=None, fetched_at=None):
+        self.online = online
+        self.password = password
+        self.gotv_port = gotv_port
+        self.fetched_at = fetched_at or time.time()
+
+    @staticmethod
+    def from_cache(key):
+        # Cached as a plain dict.
+        values = cache.get(key)
+        if values is None:
+            return None
+        return ConnectInfo(**values)
+
+    def to_cache(self, key):
+        cache.set(key, self.__dict__, timeout=_KEEP_SECONDS)
+
+    def age(self):
+        return int(time.time() - self.fetched_at)
+
+    def expired(self):
+        if self.online:
+            ttl = get5.config_setting('SERVER_INFO_TTL')
+        else:
+            ttl = get5.config_setting('SERVER_INFO_OFFLINE_TTL')
+        return self.age() >= ttl
+
+    def connect_string(self, server):
+        if not self.online:
+            return None
+        return 'steam://connect/{}:{}/{}'.format(
+            server.ip_string, server.port, self.password or '')
+
+    def gotv_string(self, server):
+        if not self.online or not self.gotv_port:
+            return None
+        return 'steam://connect/{}:{}'.format(server.ip_string, self.gotv_port)
+
+
+def _cache_key(server):
+    # Includes the address, so editing a server starts afresh.
+    return 'server_connect_info/{}/{}'.format(server.id, server.get_hostport())
+
+
+def get_connect_info(server):
+    # Returns the cached ConnectInfo for server, or None if there is nothing
+    # cached yet. Expired or missing values are refreshed in the background,
+    # waiting at most SERVER_INFO_WAIT seconds for the result, so a page
+    # never blocks on a slow or offline server for long.
+    info = ConnectInfo.from_cache(_cache_key(server))
+    if info is None or info.expired():
+        thread = refresh_async(server)
+        if info is None and thread is not None:
+            thread.join(get5.config_setting('SERVER_INFO_WAIT'))
+            info = ConnectInfo.from_cache(_cache_key(server))
+    return info
+
+
+def store(server, info):
+    # For code that reads the same cvars anyway, like serverpoller.
+    info.to_cache(_cache_key(server))
+
+
+def refresh_async(server):
+    # Starts refreshing server's info on a thread of its own, unless one is
+    # running already. Returns the thread, or None.
+    with _refreshing_lock:
+        if server.id in _refreshing:
+            return None
+        _refreshing.add(server.id)
+
+    # The thread doesn't touch the database, so it gets plain values rather
+    # than the server object.
+    thread = threading.Thread(target=_refresh, args=(
+        server.id, _cache_key(server), server.ip_string, server.port,
+        server.get_rcon_password()))
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def refresh(server):
+    # Reads server's info now, caches it and returns it.
+    with _refreshing_lock:
+        _refreshing.add(server.id)
+    return _refresh(server.id, _cache_key(server), server.ip_string, server.port,
+                    server.get_rcon_password())
+
+
+def _refresh(server_id, key, host, port, rcon_password):
+    try:
+        # One short attempt: an offline server is remembered as offline
+        # rather than retried here.
+        responses = None
+        try:
+            responses = util.send_rcon_commands(
+                host, port, rcon_password, ['sv_password', 'tv_port'],
+                num_retries=1, timeout=get5.config_setting('SERVER_INFO_RCON_TIMEOUT'))
+        except util.RconError as e:
+            app.logger.info('Failed to read connect info from {}:{}: {}'.format(
+                host, port, e))
+
+        if responses is None:
+            info = ConnectInfo(online=False)
+        else:
+            password, gotv_port = [models.GameServer.parse_rcon_value(response)
+                                   for response in responses]
+            info = ConnectInfo(online=True, password=password, gotv_port=gotv_port)
+        info.to_cache(key)
+        return info
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(server_id)
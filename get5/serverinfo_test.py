@@ -0,0 +1,83 @@
+import unittest
+
+import get5
+import get5_test
+import rconpool_test
+import serverinfo
+from get5 import cache, db
+from models import GameServer, Match
+
+import datetime
+import time
+
+
+class ServerInfoTests(rconpool_test.FakeRconServerMixin, get5_test.Get5Test):
+
+    def setUp(self):
+        super(ServerInfoTests, self).setUp()
+        self.server = GameServer.query.get(1)
+
+    def wait_for_refresh(self):
+        for _ in range(100):
+            if self.server.id not in serverinfo._refreshing:
+                return
+            time.sleep(0.01)
+
+    def test_match_page_uses_cache(self):
+        response = self.app.get('/match/1')
+        self.assertEqual(response.status_code, 200)
+        connect = 'steam://connect/127.0.0.1:{}/secret'.format(self.server.port)
+        self.assertIn(connect, response.data)
+        self.assertIn('steam://connect/127.0.0.1:27020', response.data)
+        self.assertIn('Server details as of', response.data)
+        self.assertEqual(len(self.rcon_server.commands), 2)
+
+        for _ in range(5):
+            self.assertIn(connect, self.app.get('/match/1').data)
+        self.assertEqual(len(self.rcon_server.commands), 2)
+
+    def test_live_match_shows_staleness(self):
+        match = Match.query.get(1)
+        match.start_time = datetime.datetime.utcnow()
+        db.session.commit()
+        response = self.app.get('/match/1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Server details as of', response.data)
+
+    def test_stale_value_served_while_refreshing(self):
+        serverinfo.refresh(self.server)
+        self.rcon_server.outputs['sv_password'] = '"sv_password" = "changed" ( def. "" )'
+
+        get5.app.config['SERVER_INFO_TTL'] = 0
+        try:
+            info = serverinfo.get_connect_info(self.server)
+            self.assertEqual(info.password, 'secret')
+            self.wait_for_refresh()
+            info = serverinfo.get_connect_info(self.server)
+            self.wait_for_refresh()
+        finally:
+            del get5.app.config['SERVER_INFO_TTL']
+        self.assertEqual(info.password, 'changed')
+
+    def test_offline_server(self):
+        self.server.port = 1
+        db.session.commit()
+        try:
+            start = time.time()
+            response = self.app.get('/match/1')
+            self.assertLess(time.time() - start, 2)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('steam://connect', response.data)
+            self.wait_for_refresh()
+
+            info = serverinfo.get_connect_info(self.server)
+            self.assertFalse(info.online)
+            self.assertFalse(info.expired())
+            # Remembered as offline, so no new attempt is made.
+            self.assertNotIn(self.server.id, serverinfo._refreshing)
+        finally:
+            cache.delete(serverinfo._cache_key(self.server))
+
+
+if __name__ == '__main__':
+    unittest.main()
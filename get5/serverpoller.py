@@ -0,0 +1,129 @@
+import get5
+from get5 import app, db
+import models
+import serverinfo
+import util
+
+from multiprocessing.pool import ThreadPool
+
+import datetime
+import threading
+import time
+
+# Read with one RCON round trip per server. The connect info goes to
+# serverinfo, so match pages rarely have to ask the server themselves.
+POLL_COMMANDS = ['get5_web_avaliable', 'sv_password', 'tv_port']
+
+# How often run_poller looks for servers that are due a check.
+_WAKEUP_SECONDS = 5
+
+
+def check_server(host, port, rcon_password, timeout):
+    # Runs on the poller's threads, so it only deals in plain values. Returns
+    # a dict of the ServerStatus fields, plus connect_info for serverinfo.
+    start = time.time()
+    try:
+        responses = util.send_rcon_commands(
+            host, port, rcon_password, POLL_COMMANDS, num_retries=1, timeout=timeout)
+    except util.RconError as e:
+        return {'online': False, 'error': str(e)}
+    if responses is None:
+        return {'online': False, 'error': 'Failed to connect to server'}
+
+    result = {
+        'online': True,
+        'latency_ms': int((time.time() - start) * 1000),
+        'connect_info': serverinfo.ConnectInfo(
+            online=True,
+            password=models.GameServer.parse_rcon_value(responses[1]),
+            gotv_port=models.GameServer.parse_rcon_value(responses[2])),
+    }
+    json_reply, message = util.parse_get5_web_avaliable(responses[0])
+    if json_reply is None:
+        result['error'] = message
+    else:
+        result['plugin_version'] = json_reply.get('plugin_version')
+        result['gamestate'] = json_reply.get('gamestate')
+    return result
+
+
+def record(server, result, status=None, now=None):
+    # Saves a check_server result for server, in status if it has one
+    # already, and works out when to check it next: every
+    # SERVER_POLL_INTERVAL seconds while it answers, backing off exponentially
+    # up to SERVER_POLL_MAX_BACKOFF seconds while it doesn't.
+    now = now or datetime.datetime.utcnow()
+    if status is None:
+        status = models.ServerStatus.query.get(server.id)
+    if status is None:
+        status = models.ServerStatus(server_id=server.id, failures=0)
+        db.session.add(status)
+
+    status.online = result['online']
+    status.latency_ms = result.get('latency_ms')
+    status.plugin_version = result.get('plugin_version')
+    status.gamestate = result.get('gamestate')
+    status.error = result.get('error')
+    status.last_checked = now
+
+    interval = get5.config_setting('SERVER_POLL_INTERVAL')
+    if status.online:
+        status.failures = 0
+        status.last_online = now
+        delay = interval
+    else:
+        status.failures = (status.failures or 0) + 1
+        delay = min(interval * 2 ** min(status.failures, 16),
+                    get5.config_setting('SERVER_POLL_MAX_BACKOFF'))
+    status.next_check = now + datetime.timedelta(seconds=delay)
+
+    if 'connect_info' in result:
+        serverinfo.store(server, result['connect_info'])
+    elif not status.online:
+        serverinfo.store(server, serverinfo.ConnectInfo(online=False))
+    return status
+
+
+def poll_once(force=False):
+    # Checks every server that is due (or every server, with force) in
+    # parallel, and returns how many were checked.
+    now = datetime.datetime.utcnow()
+    query = models.GameServer.query.outerjoin(
+        models.ServerStatus, models.ServerStatus.server_id == models.GameServer.id)
+    if not force:
+        query = query.filter(db.or_(models.ServerStatus.next_check == None,  # noqa: E711
+                                    models.ServerStatus.next_check <= now))
+    servers = query.all()
+    if not servers:
+        return 0
+
+    timeout = get5.config_setting('SERVER_POLL_TIMEOUT')
+    jobs = [(server.ip_string, server.port, server.get_rcon_password(), timeout)
+            for server in servers]
+    pool = ThreadPool(min(len(jobs), get5.config_setting('SERVER_POLL_THREADS')))
+    try:
+        results = pool.map(lambda job: check_server(*job), jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    statuses = models.ServerStatus.get_for(server.id for server in servers)
+    for server, result in zip(servers, results):
+        record(server, result, statuses.get(server.id), now)
+    db.session.commit()
+    return len(servers)
+
+
+def run_poller(stop_event=None):
+    # Checks whichever servers are due until stop_event is set.
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        try:
+            polled = poll_once()
+            if polled:
+                app.logger.info('Checked {} servers'.format(polled))
+        except Exception:
+            app.logger.exception('Failed to check servers')
+        finally:
+            db.session.remove()
+        stop_event.wait(_WAKEUP_SECONDS)
@@ -0,0 +1,113 @@
+import unittest
+
+import get5
+import get5_test
+import rconpool_test
+import serverinfo
+import serverpoller
+from get5 import db
+from models import GameServer, ServerStatus
+
+import datetime
+import json
+import time
+
+
+class ServerPollerTests(rconpool_test.FakeRconServerMixin, get5_test.Get5Test):
+
+    def setUp(self):
+        super(ServerPollerTests, self).setUp()
+        for rcon_server in self.rcon_servers:
+            rcon_server.outputs['get5_web_avaliable'] = json.dumps(
+                {'gamestate': 0, 'plugin_version': '0.5.0'})
+
+    def test_poll(self):
+        self.rcon_servers[1].outputs['get5_web_avaliable'] = json.dumps(
+            {'gamestate': 1, 'plugin_version': '0.5.0'})
+        self.assertEqual(serverpoller.poll_once(), 2)
+
+        status = ServerStatus.query.get(1)
+        self.assertTrue(status.online)
+        self.assertEqual(status.plugin_version, '0.5.0')
+        self.assertEqual(status.gamestate, 0)
+        self.assertIsNotNone(status.latency_ms)
+        self.assertEqual(status.get_avaliability()[1], '')
+        self.assertEqual(ServerStatus.query.get(2).get_avaliability(),
+                         (None, 'Server already has a get5 match setup'))
+
+        # The connect info was cached for the match page along the way.
+        info = serverinfo.ConnectInfo.from_cache(
+            serverinfo._cache_key(GameServer.query.get(1)))
+        self.assertEqual(info.password, 'secret')
+
+        # Nothing is due again yet.
+        self.assertEqual(serverpoller.poll_once(), 0)
+        self.assertEqual(len(self.rcon_servers[0].commands), 3)
+
+    def test_parallel(self):
+        for rcon_server in self.rcon_servers:
+            rcon_server.delay = 0.3
+        start = time.time()
+        serverpoller.poll_once()
+        # Each server takes 0.9s to answer its three commands.
+        self.assertLess(time.time() - start, 1.5)
+
+    def test_backoff(self):
+        server = GameServer.query.get(1)
+        server.port = 1
+        db.session.commit()
+        now = datetime.datetime.utcnow()
+        delays = []
+        for _ in range(8):
+            status = serverpoller.record(
+                server, serverpoller.check_server('127.0.0.1', 1, 'password', 0.5), now=now)
+            delays.append((status.next_check - now).total_seconds())
+        self.assertFalse(status.online)
+        self.assertEqual(status.failures, 8)
+        self.assertEqual(delays[:4], [60, 120, 240, 480])
+        self.assertEqual(delays[-1], get5.config_setting('SERVER_POLL_MAX_BACKOFF'))
+
+        status = serverpoller.record(server, {'online': True, 'gamestate': 0}, now=now)
+        self.assertEqual(status.failures, 0)
+        self.assertEqual((status.next_check - now).total_seconds(), 30)
+
+    def test_servers_page(self):
+        serverpoller.poll_once()
+        with self.app.session_transaction() as sess:
+            sess['user_id'] = 1
+        response = self.app.get('/myservers')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('get5 0.5.0', response.data)
+        self.assertNotIn('Not checked yet', response.data)
+
+    def test_match_create_uses_status(self):
+        self.rcon_servers[1].outputs['get5_web_avaliable'] = json.dumps(
+            {'gamestate': 1, 'plugin_version': '0.5.0'})
+        serverpoller.poll_once()
+        self.rcon_servers[1].commands = []
+
+        get5.app.config['TESTING'] = False
+        try:
+            with self.app.session_transaction() as sess:
+                sess['user_id'] = 1
+            response = self.app.get('/match/create')
+            self.assertIn('Online, match loaded', response.data)
+            response = self.app.post('/match/create', data={
+                'server_id': 2,
+                'team1_id': 1,
+                'team2_id': 2,
+                'series_type': 'bo1',
+                'veto_first': 'CT',
+                'veto_mappool': ['de_dust2', 'de_cache', 'de_mirage'],
+                'team1_series_score': 0,
+                'team2_series_score': 0,
+            })
+        finally:
+            get5.app.config['TESTING'] = True
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Server already has a get5 match setup', response.data)
+        self.assertEqual(self.rcon_servers[1].commands, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# Connections to a sqlite database that every web server process on the host
+# shares, like the cache (tieredcache) and the rate limit counters
+# (ratelimitstorage). The database is in WAL mode, so reads never wait for
+# a write, and with synchronous=NORMAL commits are only synced to disk at
+# checkpoints.
+
+import os
+import sqlite3
+import threading
+
+# Seconds to wait for another connection's write to finish.
+BUSY_TIMEOUT = 5.0
+
+
+class _Lease(object):
+    # Puts a thread's connection back in the pool once the thread has ended
+    # and its threading.local values are dropped.
+
+    def __init__(self, pool, conn):
+        self.pool = pool
+        self.conn = conn
+        self.pid = os.getpid()
+
+    def __del__(self, getpid=os.getpid):
+        if self.pid == getpid():
+            # list.append is atomic, this may run with the pool's lock held.
+            self.pool._idle.append(self.conn)
+
+
+class ConnectionPool(object):
+    # Each thread uses a connection of its own, so a read never waits on
+    # another thread's query. When the thread ends its connection goes to
+    # the next new thread, as opening one costs a few hundred microseconds
+    # on its first query, which would be every request on a server that
+    # starts a thread for each one. A process forked after they were opened
+    # opens its own, as they can't be shared.
+
+    def __init__(self, path, timeout=BUSY_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._idle = []
+        self._pid = os.getpid()
+        self._wal = False
+
+    def get(self):
+        lease = getattr(self._local, 'lease', None)
+        if lease is None or lease.pid != os.getpid():
+            lease = _Lease(self, self._checkout())
+            self._local.lease = lease
+        return lease.conn
+
+    def _checkout(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._idle = []
+                self._pid = os.getpid()
+            if self._idle:
+                return self._idle.pop()
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                               check_same_thread=False)
+        if not self._wal:
+            # Stays set in the database file.
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._wal = True
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def idle_count(self):
+        with self._lock:
+            return len(self._idle)
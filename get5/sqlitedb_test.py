@@ -0,0 +1,70 @@
+import unittest
+
+import sqlitedb
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+
+class ConnectionPoolTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.pool = sqlitedb.ConnectionPool(os.path.join(self.dir, 'test.db'))
+        self.pool.get().execute('CREATE TABLE t (x INTEGER)')
+
+    def run_thread(self, target):
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+        # The thread's values are dropped just after join() returns.
+        deadline = time.time() + 5
+        while not self.pool.idle_count() and time.time() < deadline:
+            time.sleep(0.001)
+
+    def test_reused_by_new_threads(self):
+        conn = self.pool.get()
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.assertIs(self.pool.get(), conn)
+        seen = []
+
+        def insert():
+            seen.append(self.pool.get())
+            seen[-1].execute('INSERT INTO t (x) VALUES (1)')
+
+        for _ in range(3):
+            self.run_thread(insert)
+        self.assertNotIn(conn, seen)
+        self.assertEqual(seen, [seen[0]] * 3)
+        self.assertEqual(self.pool.idle_count(), 1)
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM t').fetchone()[0], 3)
+
+    def test_read_during_write(self):
+        writing = threading.Event()
+        done = threading.Event()
+
+        def write():
+            conn = self.pool.get()
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('INSERT INTO t (x) VALUES (1)')
+            writing.set()
+            done.wait(5)
+            conn.execute('COMMIT')
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        writing.wait(5)
+        # Doesn't wait for the write, and doesn't see it yet.
+        conn = self.pool.get()
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM t').fetchone()[0], 0)
+        done.set()
+        thread.join()
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM t').fetchone()[0], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
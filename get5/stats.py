@@ -1,6 +1,6 @@
 from flask import Blueprint, render_template, redirect, abort, g
-from models import PlayerStats
-from statistics import mean
+from models import PlayerCareer, PlayerStats, get_steam_name
+import pagination
 
 
 stats_blueprint = Blueprint('stats', __name__)
@@ -10,33 +10,45 @@ stats_blueprint = Blueprint('stats', __name__)
 # and output a table with all their stats.
 @stats_blueprint.route('/stats/<int:steamid>')
 def get_user_stats(steamid):
-    all_stats = PlayerStats.query.filter_by(steam_id=steamid)
-    if all_stats.count() == 0:
+    career = PlayerCareer.query.get(str(steamid))
+    if career is None or not career.maps_played:
         abort(404)
-    steam_url = all_stats.first().get_steam_url()
-    kills = sum(c.kills for c in all_stats)
-    deaths = sum(c.deaths for c in all_stats)
-    kdr = mean(c.get_kdr() for c in all_stats)
-    assists = sum(c.assists for c in all_stats)
-    adr = mean(c.get_adr() for c in all_stats)
-    k3 = sum(c.k3 for c in all_stats)
-    k4 = sum(c.k4 for c in all_stats)
-    k5 = sum(c.k5 for c in all_stats)
-    v1 = sum(c.v1 for c in all_stats)
-    v2 = sum(c.v2 for c in all_stats)
-    v3 = sum(c.v3 for c in all_stats)
-    v4 = sum(c.v4 for c in all_stats)
-    v5 = sum(c.v5 for c in all_stats)
-    hltvrating = mean(c.get_rating() for c in all_stats)
-    hsp = mean(c.get_hsp() for c in all_stats)
-    total_rounds = sum(c.roundsplayed for c in all_stats)
-    flashbang_assists = sum(c.flashbang_assists for c in all_stats)
-
-    name = all_stats.first().get_player_name()
-    return render_template('stats.html', user_kills=kills, user_deaths=deaths,
-                           user_kdr=kdr, user_assists=assists, user_adr=adr,
-                           user_3k=k3, user_4k=k4, user_5k=k5,
-                           user_1v1=v1, user_1v2=v2, user_1v3=v3,
-                           user_1v4=v4, user_1v5=v5, user_rating=hltvrating,
-                           user_headshot=hsp, user_totalrounds=total_rounds, user_fbAssists=flashbang_assists,
-                           user_name=name, steam_url=steam_url, user=g.user)
+
+    name = get_steam_name(career.steam_id)
+    return render_template('stats.html', user_kills=career.kills, user_deaths=career.deaths,
+                           user_kdr=career.get_kdr(), user_assists=career.assists,
+                           user_adr=career.get_adr(),
+                           user_3k=career.k3, user_4k=career.k4, user_5k=career.k5,
+                           user_1v1=career.v1, user_1v2=career.v2, user_1v3=career.v3,
+                           user_1v4=career.v4, user_1v5=career.v5,
+                           user_rating=career.get_rating(),
+                           user_headshot=career.get_hsp(), user_totalrounds=career.roundsplayed,
+                           user_fbAssists=career.flashbang_assists,
+                           user_name=name, steam_url=career.get_steam_url(), user=g.user)
+
+
+def player_stats_to_dict(player_stats):
+    return {
+        'id': player_stats.id,
+        'match_id': player_stats.match_id,
+        'map_id': player_stats.map_id,
+        'team_id': player_stats.team_id,
+        'kills': player_stats.kills,
+        'deaths': player_stats.deaths,
+        'assists': player_stats.assists,
+        'flashbang_assists': player_stats.flashbang_assists,
+        'headshot_kills': player_stats.headshot_kills,
+        'damage': player_stats.damage,
+        'roundsplayed': player_stats.roundsplayed,
+        'rating': player_stats.get_rating(),
+        'adr': player_stats.get_adr(),
+    }
+
+
+# A player's stats for every map they played, newest first.
+@stats_blueprint.route('/stats/<int:steamid>/maps')
+def get_user_map_stats(steamid):
+    player_stats = PlayerStats.query.filter_by(steam_id=str(steamid))
+    player_stats = pagination.paginate_request(
+        player_stats, PlayerStats.id, descending=True)
+    return pagination.jsonify_page(player_stats, 'stats', player_stats_to_dict)
@@ -1,4 +1,6 @@
 from valve.steam.id import SteamID, SteamIDError
+import counters
+import perf
 
 import json
 import re
@@ -45,9 +47,12 @@ def custom_url_to_steam3(url):
     if '?xml=1' not in url:
         url += '?xml=1'
 
+    counters.inc('steam_api_calls')
     try:
-        dom = minidom.parse(urllib2.urlopen(url))
+        with perf.timed('steam'):
+            dom = minidom.parse(urllib2.urlopen(url))
     except ExpatError:
+        counters.inc('steam_api_failures')
         return False, ''
 
     return steam64_from_dom(dom)
@@ -101,5 +106,7 @@ def get_steam_userinfo(steamid, api_key):
     }
     url = 'http://api.steampowered.com/ISteamUser/' \
           'GetPlayerSummaries/v0001/?%s' % urllib.urlencode(options)
-    rv = json.load(urllib2.urlopen(url))
+    counters.inc('steam_api_calls')
+    with perf.timed('steam'):
+        rv = json.load(urllib2.urlopen(url))
     return rv['response']['players']['player'][0] or {}
@@ -0,0 +1,202 @@
+import get5
+from get5 import app, db
+import counters
+import models
+import perf
+
+from flask import g, has_app_context
+import sqlalchemy.exc
+import requests
+
+import datetime
+import threading
+import time
+
+# GetPlayerSummaries accepts at most 100 steam ids per call.
+STEAM_API_CHUNK_SIZE = 100
+
+# Reuse connections to the Steam API between calls.
+_session = requests.Session()
+
+# When the Steam API is unreachable, stop asking it for a little while so
+# every page render doesn't wait on it timing out.
+_API_BACKOFF_SECONDS = 30
+_api_backoff_until = 0
+
+
+def get_name(steam64):
+    if not steam64:
+        return None
+    return get_names([steam64]).get(str(steam64))
+
+
+def get_names(steam_ids):
+    # Returns a dict of steam64 -> persona name (None when unknown). Names are
+    # remembered for the rest of the request, then looked up in the
+    # SteamProfile table, and anything missing or expired is fetched from the
+    # Steam API in bulk.
+    steam_ids = set(str(steam64) for steam64 in steam_ids if steam64)
+    names = _request_names()
+    missing = steam_ids.difference(names)
+    if missing:
+        names.update(_load_names(missing))
+    return dict((steam64, names.get(steam64)) for steam64 in steam_ids)
+
+
+def prefetch(steam_ids):
+    # Resolves every name a page is about to need with as few calls as
+    # possible, so the individual lookups that follow are dict hits.
+    get_names(steam_ids)
+
+
+def _request_names():
+    if not has_app_context():
+        return {}
+    if not hasattr(g, 'steam_names'):
+        g.steam_names = {}
+    return g.steam_names
+
+
+def _load_names(steam_ids):
+    # Stored names are always served, even past their TTL: the refresher
+    # (refresh_stale) keeps them current, so only players we have never seen
+    # cost a Steam API call during a request.
+    names = {}
+    stale = 0
+    oldest_allowed = _oldest_allowed()
+
+    stored = db.session.query(
+        models.SteamProfile.steam_id, models.SteamProfile.personaname,
+        models.SteamProfile.updated_at).filter(
+        models.SteamProfile.steam_id.in_(steam_ids))
+    for steam64, personaname, updated_at in stored:
+        names[steam64] = personaname
+        if updated_at is None or updated_at < oldest_allowed:
+            stale += 1
+
+    missing = set(steam_ids).difference(names)
+    counters.inc('steam_profile_hits', len(names) - stale)
+    counters.inc('steam_profile_stale_hits', stale)
+    counters.inc('steam_profile_misses', len(missing))
+    if missing:
+        fetched = fetch_names(missing)
+        if fetched is not None:
+            store_names(fetched)
+            names.update(fetched)
+
+    return names
+
+
+def _oldest_allowed(margin=0):
+    return datetime.datetime.utcnow() - datetime.timedelta(
+        seconds=get5.config_setting('STEAM_PROFILE_TTL') - margin)
+
+
+def refresh_stale(limit=None):
+    # Re-fetches the profiles that have expired or will within
+    # STEAM_PROFILE_REFRESH_MARGIN seconds, oldest first, at most limit of
+    # them. Returns how many were refreshed.
+    if limit is None:
+        limit = get5.config_setting('STEAM_PROFILE_REFRESH_BATCH')
+    margin = get5.config_setting('STEAM_PROFILE_REFRESH_MARGIN')
+
+    steam_ids = [row.steam_id for row in db.session.query(
+        models.SteamProfile.steam_id).filter(
+        db.or_(models.SteamProfile.updated_at == None,  # noqa: E711
+               models.SteamProfile.updated_at < _oldest_allowed(margin))).order_by(
+        models.SteamProfile.updated_at).limit(limit)]
+    if not steam_ids:
+        return 0
+
+    fetched = fetch_names(steam_ids)
+    if fetched is None:
+        return 0
+
+    store_names(fetched)
+    counters.inc('steam_profiles_refreshed', len(fetched))
+    return len(fetched)
+
+
+def run_refresher(interval=None, stop_event=None):
+    # Refreshes a batch of profiles every interval seconds until stop_event
+    # is set. Bounding the batch size bounds how hard we hit the Steam API.
+    if interval is None:
+        interval = get5.config_setting('STEAM_PROFILE_REFRESH_INTERVAL')
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        try:
+            refreshed = refresh_stale()
+            if refreshed:
+                app.logger.info('Refreshed {} steam profiles, lag is {}s'.format(
+                    refreshed, refresh_lag()))
+        except Exception:
+            app.logger.exception('Failed to refresh steam profiles')
+        finally:
+            # Don't hold a transaction (and its snapshot) open while idle.
+            db.session.remove()
+        stop_event.wait(interval)
+
+
+def refresh_lag():
+    # How many seconds the most out of date stored profile is past its TTL.
+    oldest = db.session.query(db.func.min(models.SteamProfile.updated_at)).scalar()
+    if oldest is None:
+        return 0
+    lag = (_oldest_allowed() - oldest).total_seconds()
+    return max(0, int(lag))
+
+
+def fetch_names(steam_ids):
+    # Returns a dict of steam64 -> persona name for every requested id, with
+    # None for ids Steam doesn't know. Returns None if the API can't be
+    # reached.
+    global _api_backoff_until
+    if time.time() < _api_backoff_until:
+        return None
+
+    steam_ids = sorted(steam_ids)
+    url = '{}/ISteamUser/GetPlayerSummaries/v0002/'.format(
+        get5.config_setting('STEAM_API_URL'))
+    names = dict((steam64, None) for steam64 in steam_ids)
+    for i in range(0, len(steam_ids), STEAM_API_CHUNK_SIZE):
+        chunk = steam_ids[i:i + STEAM_API_CHUNK_SIZE]
+        counters.inc('steam_api_calls')
+        try:
+            with perf.timed('steam'):
+                response = _session.get(url, timeout=5.0, params={
+                    'key': get5.config_setting('STEAM_API_KEY'),
+                    'steamids': ','.join(chunk),
+                })
+            if response.status_code != 200:
+                raise ValueError(
+                    'Unexpected status code {}'.format(response.status_code))
+            for player in response.json()['response']['players']:
+                names[str(player['steamid'])] = player['personaname']
+
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            counters.inc('steam_api_failures')
+            app.logger.warning(
+                'Failed to fetch steam profiles from the Steam API: {}'.format(e))
+            _api_backoff_until = time.time() + _API_BACKOFF_SECONDS
+            return None
+
+    return names
+
+
+def store_names(names):
+    # Written on a connection of its own, so caching profiles never commits
+    # (or rolls back) whatever the current request has in its session.
+    if not names:
+        return
+    table = models.SteamProfile.__table__
+    now = datetime.datetime.utcnow()
+    rows = [{'steam_id': steam64, 'personaname': name, 'updated_at': now}
+            for steam64, name in names.items()]
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(table.delete().where(
+                table.c.steam_id.in_(names.keys())))
+            connection.execute(table.insert(), rows)
+    except sqlalchemy.exc.IntegrityError:
+        # Another worker cached the same profiles at the same time.
+        pass
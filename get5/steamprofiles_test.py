@@ -0,0 +1,131 @@
+import BaseHTTPServer
+import datetime
+import json
+import threading
+import urlparse
+
+import counters
+import get5
+from get5 import db
+from models import SteamProfile
+import steamprofiles
+import get5_test
+
+
+class FakeSteamApi(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Knows every steam id except the ones ending in 0.
+    calls = []
+
+    def do_GET(self):
+        params = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+        steam_ids = params['steamids'][0].split(',')
+        FakeSteamApi.calls.append(steam_ids)
+        players = [{'steamid': steam64, 'personaname': 'player ' + steam64[-3:]}
+                   for steam64 in steam_ids if not steam64.endswith('0')]
+        body = json.dumps({'response': {'players': players}})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SteamProfileTests(get5_test.Get5Test):
+
+    def setUp(self):
+        super(SteamProfileTests, self).setUp()
+        FakeSteamApi.calls = []
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), FakeSteamApi)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        get5.app.config['STEAM_API_URL'] = 'http://127.0.0.1:{}'.format(
+            self.server.server_port)
+        steamprofiles._api_backoff_until = 0
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super(SteamProfileTests, self).tearDown()
+
+    def test_get_names_batches_requests(self):
+        steam_ids = [str(76561198000000001 + i) for i in range(250)]
+        with get5.app.test_request_context():
+            names = steamprofiles.get_names(steam_ids)
+            self.assertEqual(len(FakeSteamApi.calls), 3)
+            self.assertEqual(names['76561198000000001'], 'player 001')
+            self.assertIsNone(names['76561198000000010'])
+
+            # Already resolved during this request.
+            self.assertEqual(
+                steamprofiles.get_name('76561198000000001'), 'player 001')
+            self.assertEqual(len(FakeSteamApi.calls), 3)
+
+        self.assertEqual(SteamProfile.query.count(), 250)
+        with get5.app.test_request_context():
+            names = steamprofiles.get_names(steam_ids)
+            self.assertEqual(names['76561198000000002'], 'player 002')
+            self.assertEqual(len(FakeSteamApi.calls), 3)
+
+    def test_expired_profiles_are_served_stale(self):
+        with get5.app.test_request_context():
+            self.assertEqual(
+                steamprofiles.get_name('76561198000000001'), 'player 001')
+        self.assertEqual(len(FakeSteamApi.calls), 1)
+
+        SteamProfile.query.update({'personaname': 'old name',
+                                   'updated_at': datetime.datetime.utcnow() -
+                                   datetime.timedelta(days=2)})
+        db.session.commit()
+        stale_hits = counters.get_counters()['steam_profile_stale_hits']
+        with get5.app.test_request_context():
+            self.assertEqual(
+                steamprofiles.get_name('76561198000000001'), 'old name')
+        self.assertEqual(len(FakeSteamApi.calls), 1)
+        self.assertEqual(counters.get_counters()['steam_profile_stale_hits'],
+                         stale_hits + 1)
+        self.assertIn('get5_steam_profile_stale_hits_total {}'.format(stale_hits + 1),
+                      counters.render_prometheus({}).splitlines())
+        self.assertGreaterEqual(steamprofiles.refresh_lag(), 60 * 60 * 24)
+
+    def test_refresh_stale(self):
+        with get5.app.test_request_context():
+            steamprofiles.get_names(['76561198000000001', '76561198000000002',
+                                     '76561198000000003'])
+        self.assertEqual(steamprofiles.refresh_stale(), 0)
+
+        now = datetime.datetime.utcnow()
+        SteamProfile.query.filter_by(steam_id='76561198000000001').update(
+            {'personaname': 'old name', 'updated_at': now - datetime.timedelta(days=3)})
+        # About to expire, so it gets refreshed ahead of time.
+        SteamProfile.query.filter_by(steam_id='76561198000000002').update(
+            {'updated_at': now - datetime.timedelta(hours=23, minutes=30)})
+        db.session.commit()
+
+        FakeSteamApi.calls = []
+        refreshed = counters.get_counters()['steam_profiles_refreshed']
+        self.assertEqual(steamprofiles.refresh_stale(limit=1), 1)
+        self.assertEqual(FakeSteamApi.calls, [['76561198000000001']])
+        self.assertEqual(steamprofiles.refresh_stale(), 1)
+        self.assertEqual(FakeSteamApi.calls[1], ['76561198000000002'])
+        self.assertEqual(steamprofiles.refresh_lag(), 0)
+        self.assertEqual(counters.get_counters()['steam_profiles_refreshed'], refreshed + 2)
+
+        with get5.app.test_request_context():
+            self.assertEqual(
+                steamprofiles.get_name('76561198000000001'), 'player 001')
+
+    def test_unreachable_api_serves_stored_names(self):
+        with get5.app.test_request_context():
+            steamprofiles.get_name('76561198000000001')
+
+        SteamProfile.query.update({'updated_at': datetime.datetime.utcnow() -
+                                   datetime.timedelta(days=2)})
+        db.session.commit()
+        get5.app.config['STEAM_API_URL'] = 'http://127.0.0.1:1'
+        with get5.app.test_request_context():
+            self.assertEqual(
+                steamprofiles.get_name('76561198000000001'), 'player 001')
+            self.assertIsNone(steamprofiles.get_name('76561198000000002'))
@@ -4,6 +4,7 @@ from models import User, Team, TeamAuthNames
 import itertools
 import countries
 import logos
+import pagination
 import steamid
 import util
 import os
@@ -14,7 +15,7 @@ import xml.etree.ElementTree as ET
 from werkzeug.utils import secure_filename
 from PIL import Image
 
-from flask import Blueprint, request, render_template, flash, g, redirect, jsonify
+from flask import Blueprint, request, render_template, flash, g, redirect
 
 from wtforms import (
     validators,
@@ -304,62 +305,51 @@ def team_delete(teamid):
     return redirect('/myteams')
 
 
+def team_to_dict(team):
+    team_dict = {}
+    team_dict['id'] = team.id
+    team_dict['name'] = team.name
+    team_dict['tag'] = team.tag
+    team_dict['flag'] = team.flag
+    team_dict['logo'] = team.logo
+    team_dict['players'] = filter(lambda x: bool(x), team.auths)
+    team_dict['players_pref_names'] = filter(
+        lambda x: bool(x), team.preferred_names or [])
+    return team_dict
+
+
 @team_blueprint.route('/teams/<int:userid>', methods=['GET'])
 def teams_user(userid):
     user = User.query.get_or_404(userid)
-    page = util.as_int(request.values.get('page'), on_fail=1)
+    teams = pagination.paginate_request(user.teams, Team.id)
     json_data = util.as_int(request.values.get('json'), on_fail=0)
 
     if json_data:
-        teams_dict = {}
-        for team in user.teams:
-            team_dict = {}
-            team_dict['name'] = team.name
-            team_dict['tag'] = team.tag
-            team_dict['flag'] = team.flag
-            team_dict['logo'] = team.logo
-            team_dict['players'] = filter(lambda x: bool(x), team.auths)
-            team_dict['players_pref_names'] = filter(
-                lambda x: bool(x), team.preferred_names)
-            teams_dict[team.id] = team_dict
-        return jsonify(teams_dict)
+        return pagination.jsonify_page(teams, 'teams', team_to_dict)
 
     else:
         # Render teams page
         my_teams = (g.user is not None and ((userid == g.user.id) or g.user.super_admin))
-        teams = user.teams.paginate(page, 20)
         return render_template(
             'teams.html', user=g.user, teams=teams, my_teams=my_teams,
-            page=page, owner=user)
+            owner=user)
 
 
 @team_blueprint.route('/teams', methods=['GET'])
 def all_teams():
     all_public_teams = Team.query.filter_by(public_team=True)
-    page = util.as_int(request.values.get('page'), on_fail=1)
+    teams = pagination.paginate_request(all_public_teams, Team.id)
     json_data = util.as_int(request.values.get('json'), on_fail=0)
 
     if json_data:
-        teams_dict = {}
-        for team in all_public_teams:
-            team_dict = {}
-            team_dict['name'] = team.name
-            team_dict['tag'] = team.tag
-            team_dict['flag'] = team.flag
-            team_dict['logo'] = team.logo
-            team_dict['players'] = filter(lambda x: bool(x), team.auths)
-            team_dict['players_pref_names'] = filter(
-                lambda x: bool(x), team.preferred_names)
-            teams_dict[team.id] = team_dict
-        return jsonify(teams_dict)
+        return pagination.jsonify_page(teams, 'teams', team_to_dict)
 
     else:
         # Render teams page
-        teams = all_public_teams.paginate(page, 20)
         editable = g.user is not None and g.user.super_admin
         return render_template(
             'teams.html', user=g.user, teams=teams, my_teams=editable,
-            page=page, owner=None)
+            owner=None)
 
 
 @team_blueprint.route('/myteams', methods=['GET'])
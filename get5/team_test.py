@@ -1,8 +1,10 @@
 import unittest
+import json
 
 from flask import url_for
 
 import get5_test
+from get5 import db
 from models import User, Team
 
 
@@ -172,6 +174,32 @@ class TeamTests(get5_test.Get5Test):
         self.assertEqual(team.public_team, True)
         self.assertTrue(team in User.query.get(1).teams)
 
+    def test_teams_json_pagination(self):
+        user = User.query.get(1)
+        for i in range(25):
+            Team.create(user, 'Team {}'.format(i), 'T{}'.format(i), 'us', '',
+                        [], public_team=True)
+        db.session.commit()
+
+        team_ids = []
+        url = '/teams?json=1&limit=10'
+        while True:
+            data = json.loads(self.app.get(url).data)
+            self.assertLessEqual(len(data['teams']), 10)
+            team_ids += [team['id'] for team in data['teams']]
+            if data['next_cursor'] is None:
+                break
+            url = '/teams?json=1&limit=10&after={}'.format(data['next_cursor'])
+
+        public_ids = [team.id for team in
+                      Team.query.filter_by(public_team=True).order_by(Team.id)]
+        self.assertEqual(team_ids, public_ids)
+        self.assertEqual(len(team_ids), 25)
+
+        data = json.loads(self.app.get('/teams/1?json=1&limit=100').data)
+        self.assertEqual(len(data['teams']), 27)
+        self.assertIsNone(data['next_cursor'])
+
 
 if __name__ == '__main__':
     unittest.main()
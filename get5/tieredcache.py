@@ -0,0 +1,219 @@
+# The Flask-Cache backend behind get5.cache.
+#
+# Values are kept in a sqlite database (SQLiteCache) that every web server
+# process on the host shares, the same way the old filesystem cache in /tmp
+# was, but without a file per value or scanning the directory to prune it.
+# In front of that each process keeps the values it read most recently in
+# memory (TieredCache), for as long as the local TTL of the key's namespace
+# allows: the part of the key before the first '/'. A value changed by
+# another process can be served from memory for up to that many seconds, so
+# namespaces whose values change under the same key, like the scoreboard
+# generations, should have a local TTL of 0, which always reads the shared
+# store. Hits, misses and evictions are counted per namespace in counters.
+#
+# Values read from memory are the same object every time, so they mustn't be
+# modified.
+
+from werkzeug.contrib.cache import BaseCache
+
+import counters
+import sqlitedb
+
+from collections import OrderedDict
+
+import cPickle as pickle
+import os
+import sqlite3
+import threading
+import time
+
+# Seconds between each process deleting expired values from the shared store.
+CLEANUP_INTERVAL = 60
+
+
+def _namespace(key):
+    return key.partition('/')[0]
+
+
+class SQLiteCache(BaseCache):
+    # A timeout of 0 never expires.
+
+    def __init__(self, path, threshold=500, default_timeout=300):
+        BaseCache.__init__(self, default_timeout)
+        self.path = path
+        self.threshold = threshold
+        self._db = sqlitedb.ConnectionPool(path)
+        self._next_cleanup = 0
+        self._db.get().execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)')
+
+    def _expires(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return time.time() + timeout if timeout else 0
+
+    def get_entry(self, key):
+        # Returns (value, expires) for key, where expires is 0 if it never
+        # does, or None if there's no such value.
+        row = self._db.get().execute(
+            'SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None or (row[1] and row[1] <= time.time()):
+            return None
+        return pickle.loads(str(row[0])), row[1]
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return entry[0] if entry else None
+
+    def set(self, key, value, timeout=None):
+        value = sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        conn = self._db.get()
+        conn.execute('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                     (key, value, self._expires(timeout)))
+        self._prune(conn)
+        return True
+
+    def add(self, key, value, timeout=None):
+        value = sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        conn = self._db.get()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM cache WHERE key = ? AND expires != 0 AND expires <= ?',
+                         (key, time.time()))
+            added = conn.execute(
+                'INSERT OR IGNORE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                (key, value, self._expires(timeout))).rowcount == 1
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return added
+
+    def delete(self, key):
+        self._db.get().execute('DELETE FROM cache WHERE key = ?', (key,))
+        return True
+
+    def has(self, key):
+        return self.get_entry(key) is not None
+
+    def clear(self):
+        self._db.get().execute('DELETE FROM cache')
+        return True
+
+    def _prune(self, conn):
+        now = time.time()
+        if now < self._next_cleanup:
+            return
+        self._next_cleanup = now + CLEANUP_INTERVAL
+        conn.execute('DELETE FROM cache WHERE expires != 0 AND expires <= ?', (now,))
+        if self.threshold:
+            # Past the threshold, whatever would expire soonest goes first.
+            excess = conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0] - self.threshold
+            if excess > 0:
+                conn.execute(
+                    'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                    'ORDER BY expires = 0, expires LIMIT ?)', (excess,))
+
+
+class TieredCache(BaseCache):
+
+    def __init__(self, shared, max_entries=1024, local_ttls=None, local_default_ttl=0,
+                 default_timeout=300):
+        BaseCache.__init__(self, default_timeout)
+        self.shared = shared
+        self.max_entries = max_entries
+        self.local_ttls = local_ttls or {}
+        self.local_default_ttl = local_default_ttl
+        self._lock = threading.Lock()
+        # key -> (value, expires)
+        self._entries = OrderedDict()
+
+    def _local_ttl(self, namespace):
+        return self.local_ttls.get(namespace, self.local_default_ttl)
+
+    def _remember(self, key, namespace, value, expires):
+        ttl = self._local_ttl(namespace)
+        if ttl:
+            self._store(key, value, time.time() + ttl, expires)
+
+    def _store(self, key, value, local_expires, expires):
+        # expires is when the value expires in the shared store, 0 for never.
+        if expires:
+            local_expires = min(local_expires, expires)
+        evicted = []
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, local_expires)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+        for evicted_key in evicted:
+            counters.inc_cache(_namespace(evicted_key), 'eviction')
+
+    def _forget(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def get(self, key):
+        namespace = _namespace(key)
+        ttl = self._local_ttl(namespace)
+        if ttl:
+            now = time.time()
+            with self._lock:
+                entry = self._entries.pop(key, None)
+                if entry is not None and entry[1] > now:
+                    self._entries[key] = entry
+                    value = entry[0]
+                else:
+                    entry = None
+            if entry is not None:
+                counters.inc_cache(namespace, 'local_hit')
+                return value
+
+        entry = self.shared.get_entry(key)
+        if entry is None:
+            counters.inc_cache(namespace, 'miss')
+            return None
+        counters.inc_cache(namespace, 'shared_hit')
+        if ttl:
+            self._store(key, entry[0], now + ttl, entry[1])
+        return entry[0]
+
+    def set(self, key, value, timeout=None):
+        timeout = self._normalize_timeout(timeout)
+        self.shared.set(key, value, timeout)
+        self._remember(key, _namespace(key), value, time.time() + timeout if timeout else 0)
+        return True
+
+    def add(self, key, value, timeout=None):
+        timeout = self._normalize_timeout(timeout)
+        # Another process may have added it first, so what's in memory is
+        # only trusted if this one did.
+        self._forget(key)
+        added = self.shared.add(key, value, timeout)
+        if added:
+            self._remember(key, _namespace(key), value,
+                           time.time() + timeout if timeout else 0)
+        return added
+
+    def delete(self, key):
+        self._forget(key)
+        return self.shared.delete(key)
+
+    def has(self, key):
+        return self.shared.has(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        return self.shared.clear()
+
+
+def tiered(app, config, args, kwargs):
+    # The Flask-Cache factory for CACHE_TYPE 'get5.tieredcache.tiered'.
+    shared = SQLiteCache(os.path.join(config['CACHE_DIR'], 'get5_cache.db'),
+                         threshold=config['CACHE_THRESHOLD'], **kwargs)
+    return TieredCache(shared,
+                       max_entries=config.get('CACHE_LOCAL_MAX_ENTRIES', 1024),
+                       local_ttls=config.get('CACHE_LOCAL_TTLS'),
+                       local_default_ttl=config.get('CACHE_LOCAL_DEFAULT_TTL', 0),
+                       **kwargs)
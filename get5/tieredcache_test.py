@@ -0,0 +1,101 @@
+import unittest
+
+import counters
+import tieredcache
+
+import os
+import shutil
+import tempfile
+import time
+
+
+class TieredCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'cache.db')
+        self.cache = self.open_cache()
+        counters.reset()
+        self.addCleanup(counters.reset)
+
+    def open_cache(self, **kwargs):
+        # Each one is like another web server process.
+        kwargs.setdefault('local_ttls', {'immutable': 60, 'generation': 0})
+        return tieredcache.TieredCache(tieredcache.SQLiteCache(self.path), **kwargs)
+
+    def test_shared_store(self):
+        shared = tieredcache.SQLiteCache(self.path)
+        self.assertIsNone(shared.get('a/1'))
+        self.assertTrue(shared.set('a/1', {'x': [1, 2]}))
+        self.assertEqual(shared.get('a/1'), {'x': [1, 2]})
+        self.assertFalse(shared.add('a/1', 'other'))
+        self.assertTrue(shared.has('a/1'))
+        shared.delete('a/1')
+        self.assertFalse(shared.has('a/1'))
+
+        shared.set('a/2', 'value', timeout=0.05)
+        shared.set('a/3', 'forever', timeout=0)
+        time.sleep(0.1)
+        self.assertIsNone(shared.get('a/2'))
+        self.assertEqual(shared.get('a/3'), 'forever')
+        # An expired value can be added again.
+        self.assertTrue(shared.add('a/2', 'again'))
+
+    def test_threshold(self):
+        shared = tieredcache.SQLiteCache(self.path, threshold=10)
+        for i in range(20):
+            shared.set('a/{}'.format(i), i, timeout=100 + i)
+        shared.set('forever', 1, timeout=0)
+        shared._next_cleanup = 0
+        shared.set('a/20', 20, timeout=120)
+        count = shared._db.get().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        self.assertEqual(count, 10)
+        self.assertIsNone(shared.get('a/0'))
+        self.assertEqual(shared.get('forever'), 1)
+
+    def test_local_hits(self):
+        self.cache.set('immutable/1', 'value')
+        other = self.open_cache()
+        self.assertEqual(other.get('immutable/1'), 'value')
+        self.assertEqual(other.get('immutable/1'), 'value')
+        self.assertIsNone(other.get('immutable/2'))
+        self.assertEqual(self.cache.get('immutable/1'), 'value')
+        self.assertEqual(counters.get_cache_events()['immutable'], {
+            'local_hit': 2, 'shared_hit': 1, 'miss': 1, 'eviction': 0})
+        self.assertIn('get5_cache_local_hit_total{namespace="immutable"} 2',
+                      counters.render_prometheus({}).splitlines())
+
+        # Other processes only see a change once their copy expires.
+        self.cache.set('immutable/1', 'changed')
+        self.assertEqual(other.get('immutable/1'), 'value')
+        other.delete('immutable/1')
+        self.assertIsNone(other.get('immutable/1'))
+
+    def test_local_ttl_follows_shared_timeout(self):
+        self.cache.set('immutable/1', 'value', timeout=0.05)
+        time.sleep(0.1)
+        self.assertIsNone(self.cache.get('immutable/1'))
+
+    def test_uncached_namespace(self):
+        other = self.open_cache()
+        self.assertTrue(self.cache.add('generation/1', 'a', timeout=0))
+        self.assertFalse(other.add('generation/1', 'b', timeout=0))
+        self.assertEqual(other.get('generation/1'), 'a')
+        self.cache.set('generation/1', 'c', timeout=0)
+        self.assertEqual(other.get('generation/1'), 'c')
+        self.assertNotIn('generation/1', other._entries)
+
+    def test_eviction(self):
+        cache = self.open_cache(max_entries=3)
+        for i in range(5):
+            cache.set('immutable/{}'.format(i), i)
+        self.assertEqual(cache._entries.keys(), ['immutable/2', 'immutable/3', 'immutable/4'])
+        self.assertEqual(counters.get_cache_events()['immutable']['eviction'], 2)
+        # Still in the shared store.
+        self.assertEqual(cache.get('immutable/0'), 0)
+        self.assertEqual(counters.get_cache_events()['immutable']['shared_hit'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
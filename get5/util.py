@@ -2,6 +2,9 @@ import os
 import socket
 import subprocess
 import base64
+import counters
+import perf
+import rconpool
 from Crypto.Cipher import AES
 from Crypto.Hash import SHA256
 from Crypto import Random
@@ -42,8 +45,6 @@ def check_server_connection(server, key=None):
 
 
 def check_server_avaliability(server, key=None):
-    import json
-
     if not server:
         return None, 'Server not found'
     if key:
@@ -53,38 +54,56 @@ def check_server_avaliability(server, key=None):
     response = send_rcon_command(
         server.ip_string, server.port, encRcon, 'get5_web_avaliable')
 
-    if response:
-        json_error = False
-        already_live = False
-        try:
-            json_reply = json.loads(response)
-            already_live = json_reply['gamestate'] != 0
-        except (ValueError, KeyError):
-            json_error = True
+    json_reply, message = parse_get5_web_avaliable(response)
+    if json_reply is not None and json_reply.get('gamestate') != 0:
+        return None, 'Server already has a get5 match setup'
+    return json_reply, message
+
+
+def parse_get5_web_avaliable(response):
+    # Returns the decoded reply to get5_web_avaliable, or None and why the
+    # server can't be used.
+    import json
 
     if response is None:
         return None, 'Failed to connect to server'
-
     elif 'Unknown command' in str(response):
         return None, 'Either get5 or get5_apistats plugin missing'
 
-    elif already_live:
-        return None, 'Server already has a get5 match setup'
-
-    elif json_error:
+    try:
+        json_reply = json.loads(response)
+        json_reply['gamestate']
+    except (ValueError, KeyError, TypeError):
         return None, 'Error reading get5_web_avaliable response'
-
-    else:
-        return json_reply, ''
+    return json_reply, ''
 
 
 class RconError(ValueError):
     pass
 
 
+class RconSentError(RconError):
+    # The commands reached the server but its reply didn't, so they may have
+    # run and sending them again could run them twice.
+    pass
+
+
 def send_rcon_command(host, port, rcon_password, command,
                       raise_errors=False, num_retries=3, timeout=3.0):
-    from valve.source.rcon import (RCON, IncompleteMessageError,
+    responses = send_rcon_commands(host, port, rcon_password, [command],
+                                   raise_errors, num_retries, timeout)
+    if responses is None:
+        return None
+    return responses[0]
+
+
+def send_rcon_commands(host, port, rcon_password, commands,
+                       raise_errors=False, num_retries=3, timeout=3.0):
+    # Sends every command over one connection without waiting in between,
+    # and returns the list of responses in the same order. The batch is only
+    # retried if it failed before any of it was sent, as commands like
+    # get5_loadmatch_url mustn't run twice.
+    from valve.source.rcon import (IncompleteMessageError,
                                    AuthenticationError, NoResponseError)
 
     try:
@@ -92,23 +111,33 @@ def send_rcon_command(host, port, rcon_password, command,
     except ValueError:
         return None
 
+    counters.inc('rcon_commands', len(commands))
     attempts = 0
     while attempts < num_retries:
         attempts += 1
         try:
-            with RCON((host, port), rcon_password, timeout=timeout) as rcon:
-                response = rcon(command)
-                return strip_rcon_logline(response)
+            with perf.timed('rcon'):
+                responses = rconpool.pool.execute_many(
+                    host, port, rcon_password, commands, timeout)
+            return [strip_rcon_logline(response) for response in responses]
 
         except KeyError:
             # There seems to be a bug in python-vavle where a wrong password
             # trigger a KeyError at line 203 of valve/source/rcon.py,
             # so this is a work around for that.
+            counters.inc('rcon_failures', len(commands))
             raise RconError('Incorrect rcon password')
 
+        except rconpool.SentError as e:
+            counters.inc('rcon_failures', len(commands))
+            if raise_errors:
+                raise RconSentError(str(e))
+            return None
+
         except (socket.error, socket.timeout,
                 IncompleteMessageError, AuthenticationError, NoResponseError) as e:
             if attempts >= num_retries:
+                counters.inc('rcon_failures', len(commands))
                 if raise_errors:
                     raise RconError(str(e))
                 else:
@@ -1,8 +1,13 @@
 #!/usr/bin/env python2.7
 
+import sys
+
 import get5
 from get5 import db
+import get5.jobs
 import get5.models
+import get5.serverpoller
+import get5.steamprofiles
 
 import flask_script
 import flask_migrate
@@ -14,5 +19,60 @@ migrate = flask_migrate.Migrate(get5.app, get5.db)
 manager.add_command('db', flask_migrate.MigrateCommand)
 
 
+@manager.command
+def rebuild_careers():
+    """Rebuild every player's career totals from the raw player stats."""
+    get5.models.PlayerCareer.rebuild()
+    db.session.commit()
+
+
+@manager.command
+def refresh_names(once=False):
+    """Keep cached Steam persona names fresh in the background."""
+    if once:
+        get5.steamprofiles.refresh_stale()
+    else:
+        get5.steamprofiles.run_refresher()
+
+
+@manager.command
+def poll_servers(once=False):
+    """Keep every game server's status up to date in the background."""
+    if once:
+        get5.serverpoller.poll_once(force=True)
+    else:
+        get5.serverpoller.run_poller()
+
+
+@manager.command
+def run_jobs(once=False):
+    """Run the RCON commands queued by the match pages."""
+    if once:
+        get5.jobs.run_once()
+    else:
+        get5.jobs.run_worker()
+
+
+@manager.option('-f', '--format', dest='format', default='csv',
+                choices=['csv', 'ndjson'], help='csv or ndjson')
+@manager.option('-o', '--output', dest='output', default=None,
+                help='file to write to, defaults to stdout')
+@manager.option('--season', dest='season_id', type=int, default=None)
+@manager.option('--since', dest='since', default=None, help='YYYY-MM-DD')
+@manager.option('--until', dest='until', default=None, help='YYYY-MM-DD')
+def export(format, output, season_id, since, until):
+    """Export every player's per-map stats."""
+    import get5.export
+    rows = get5.export.iter_player_stats(
+        season_id, get5.export.parse_date(since), get5.export.parse_date(until))
+    out = open(output, 'wb') if output else sys.stdout
+    try:
+        for chunk in get5.export.generate(format, rows):
+            out.write(chunk)
+    finally:
+        if output:
+            out.close()
+
+
 if __name__ == '__main__':
     manager.run()
\ No newline at end of file
@@ -0,0 +1,29 @@
+"""Add steam profile cache table.
+
+Revision ID: 5a1c0d2b7e4f
+Revises: eb1c3fdf3e85
+Create Date: 2026-10-18 18:40:02.117430
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5a1c0d2b7e4f'
+down_revision = 'eb1c3fdf3e85'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('steam_profile',
+        sa.Column('steam_id', sa.String(length=40), nullable=False),
+        sa.Column('personaname', sa.String(length=128), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('steam_id')
+    )
+    op.create_index(op.f('ix_steam_profile_updated_at'), 'steam_profile', ['updated_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_steam_profile_updated_at'), table_name='steam_profile')
+    op.drop_table('steam_profile')
@@ -0,0 +1,32 @@
+"""Count players per map and make (map_id, steam_id) unique.
+
+Revision ID: a7d2e6c41f08
+Revises: 5a1c0d2b7e4f
+Create Date: 2026-10-18 20:12:47.390211
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a7d2e6c41f08'
+down_revision = '5a1c0d2b7e4f'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Drop any duplicate rows the old lookup let through before making the
+    # pair unique, keeping the first one.
+    op.execute('DELETE FROM player_stats WHERE id NOT IN '
+               '(SELECT id FROM (SELECT MIN(id) AS id FROM player_stats '
+               'GROUP BY map_id, steam_id) AS keep)')
+    op.create_index('ix_player_stats_map_id_steam_id', 'player_stats', ['map_id', 'steam_id'], unique=True)
+
+    op.add_column('map_stats', sa.Column('player_count', sa.Integer(), server_default='0', nullable=True))
+    op.execute('UPDATE map_stats SET player_count = '
+               '(SELECT COUNT(*) FROM player_stats WHERE player_stats.map_id = map_stats.id)')
+
+
+def downgrade():
+    op.drop_index('ix_player_stats_map_id_steam_id', table_name='player_stats')
+    op.drop_column('map_stats', 'player_count')
@@ -0,0 +1,40 @@
+"""Add indexes for the stats and match listing queries.
+
+Revision ID: c3f9b1e85d27
+Revises: a7d2e6c41f08
+Create Date: 2026-10-18 21:03:15.824406
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c3f9b1e85d27'
+down_revision = 'a7d2e6c41f08'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index(op.f('ix_player_stats_steam_id'), 'player_stats', ['steam_id'], unique=False)
+    op.create_index(op.f('ix_player_stats_match_id'), 'player_stats', ['match_id'], unique=False)
+    op.create_index('ix_map_stats_match_id_map_number', 'map_stats', ['match_id', 'map_number'], unique=False)
+    op.create_index('ix_match_season_id_cancelled', 'match', ['season_id', 'cancelled'], unique=False)
+    op.create_index('ix_match_user_id_cancelled', 'match', ['user_id', 'cancelled'], unique=False)
+    op.create_index(op.f('ix_veto_match_id'), 'veto', ['match_id'], unique=False)
+
+    # TeamAuthNames.set_or_create only ever updates the first row for a
+    # (team, auth) pair, drop any others before making the pair unique.
+    op.execute('DELETE FROM team_auth_names WHERE id NOT IN '
+               '(SELECT id FROM (SELECT MIN(id) AS id FROM team_auth_names '
+               'GROUP BY team_id, auth) AS keep)')
+    op.create_index('ix_team_auth_names_team_id_auth', 'team_auth_names', ['team_id', 'auth'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_team_auth_names_team_id_auth', table_name='team_auth_names')
+    op.drop_index(op.f('ix_veto_match_id'), table_name='veto')
+    op.drop_index('ix_match_user_id_cancelled', table_name='match')
+    op.drop_index('ix_match_season_id_cancelled', table_name='match')
+    op.drop_index('ix_map_stats_match_id_map_number', table_name='map_stats')
+    op.drop_index(op.f('ix_player_stats_match_id'), table_name='player_stats')
+    op.drop_index(op.f('ix_player_stats_steam_id'), table_name='player_stats')
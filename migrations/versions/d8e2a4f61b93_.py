@@ -0,0 +1,43 @@
+"""Add the metric_counter table, seeded from the existing rows.
+
+Revision ID: d8e2a4f61b93
+Revises: c3f9b1e85d27
+Create Date: 2026-10-18 22:40:51.173205
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'd8e2a4f61b93'
+down_revision = 'c3f9b1e85d27'
+
+from alembic import op
+import sqlalchemy as sa
+
+# The totals the app keeps from now on, and the query that counts what is
+# already in the database.
+INITIAL_VALUES = [
+    ('users_registered', 'SELECT COUNT(*) FROM user'),
+    ('teams_created', 'SELECT COUNT(*) FROM team'),
+    ('matches_created', 'SELECT COUNT(*) FROM `match`'),
+    ('matches_finished', 'SELECT COUNT(*) FROM `match` WHERE end_time IS NOT NULL'),
+    ('servers_added', 'SELECT COUNT(*) FROM game_server'),
+    ('maps_played', 'SELECT COUNT(*) FROM map_stats WHERE end_time IS NOT NULL'),
+    # Not player_career, which is empty until ./manager.py rebuild_careers is
+    # run after upgrading.
+    ('unique_players', 'SELECT COUNT(DISTINCT steam_id) FROM player_stats'),
+]
+
+
+def upgrade():
+    op.create_table('metric_counter',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    for name, query in INITIAL_VALUES:
+        op.execute("INSERT INTO metric_counter (name, value) SELECT '{}', ({})".format(
+            name, query))
+
+
+def downgrade():
+    op.drop_table('metric_counter')
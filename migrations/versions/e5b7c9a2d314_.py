@@ -0,0 +1,37 @@
+"""Add the server_status table.
+
+Revision ID: e5b7c9a2d314
+Revises: d8e2a4f61b93
+Create Date: 2026-10-18 23:12:07.550918
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e5b7c9a2d314'
+down_revision = 'd8e2a4f61b93'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('server_status',
+    sa.Column('server_id', sa.Integer(), nullable=False),
+    sa.Column('online', sa.Boolean(), nullable=True),
+    sa.Column('latency_ms', sa.Integer(), nullable=True),
+    sa.Column('plugin_version', sa.String(length=32), nullable=True),
+    sa.Column('gamestate', sa.Integer(), nullable=True),
+    sa.Column('error', sa.String(length=128), nullable=True),
+    sa.Column('last_checked', sa.DateTime(), nullable=True),
+    sa.Column('last_online', sa.DateTime(), nullable=True),
+    sa.Column('failures', sa.Integer(), nullable=True),
+    sa.Column('next_check', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['server_id'], ['game_server.id'], ),
+    sa.PrimaryKeyConstraint('server_id')
+    )
+    op.create_index(op.f('ix_server_status_next_check'), 'server_status', ['next_check'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_server_status_next_check'), table_name='server_status')
+    op.drop_table('server_status')
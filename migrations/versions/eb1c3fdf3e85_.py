@@ -0,0 +1,46 @@
+"""Add player career rollup tables.
+
+Run ./manager.py rebuild_careers once after upgrading to fill them in.
+
+Revision ID: eb1c3fdf3e85
+Revises: 3d5477aad91e
+Create Date: 2026-10-18 17:52:10.512203
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'eb1c3fdf3e85'
+down_revision = '3d5477aad91e'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def career_columns():
+    columns = [sa.Column('maps_played', sa.Integer(), nullable=True)]
+    for name in ('kills', 'deaths', 'assists', 'flashbang_assists',
+                 'headshot_kills', 'damage', 'roundsplayed',
+                 'k1', 'k2', 'k3', 'k4', 'k5', 'v1', 'v2', 'v3', 'v4', 'v5'):
+        columns.append(sa.Column(name, sa.Integer(), nullable=True))
+    for name in ('kdr_total', 'adr_total', 'hsp_total', 'rating_total'):
+        columns.append(sa.Column(name, sa.Float(), nullable=True))
+    return columns
+
+
+def upgrade():
+    op.create_table('player_career',
+        sa.Column('steam_id', sa.String(length=40), nullable=False),
+        *(career_columns() + [sa.PrimaryKeyConstraint('steam_id')])
+    )
+    op.create_table('player_season_career',
+        sa.Column('season_id', sa.Integer(), nullable=False),
+        sa.Column('steam_id', sa.String(length=40), nullable=False),
+        *(career_columns() + [
+            sa.ForeignKeyConstraint(['season_id'], ['season.id'], ),
+            sa.PrimaryKeyConstraint('season_id', 'steam_id')])
+    )
+
+
+def downgrade():
+    op.drop_table('player_season_career')
+    op.drop_table('player_career')
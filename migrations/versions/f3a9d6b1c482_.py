@@ -0,0 +1,48 @@
+"""Add the job table.
+
+Revision ID: f3a9d6b1c482
+Revises: e5b7c9a2d314
+Create Date: 2026-10-18 23:58:41.204117
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9d6b1c482'
+down_revision = 'e5b7c9a2d314'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=32), nullable=False),
+    sa.Column('match_id', sa.Integer(), nullable=True),
+    sa.Column('server_id', sa.Integer(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('payload', sa.Text(), nullable=True),
+    sa.Column('idempotency_key', sa.String(length=128), nullable=True),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=True),
+    sa.Column('max_attempts', sa.Integer(), nullable=True),
+    sa.Column('run_after', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.String(length=256), nullable=True),
+    sa.Column('result', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['match_id'], ['match.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('idempotency_key')
+    )
+    op.create_index(op.f('ix_job_match_id'), 'job', ['match_id'], unique=False)
+    op.create_index(op.f('ix_job_run_after'), 'job', ['run_after'], unique=False)
+    op.create_index(op.f('ix_job_status'), 'job', ['status'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_job_status'), table_name='job')
+    op.drop_index(op.f('ix_job_run_after'), table_name='job')
+    op.drop_index(op.f('ix_job_match_id'), table_name='job')
+    op.drop_table('job')